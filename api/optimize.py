@@ -1,144 +1,31 @@
 import json
 import os
+import sys
+import tempfile
 import base64
-import zipfile
-import io
-from PIL import Image
 from werkzeug.utils import secure_filename
 
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp', 'tiff', 'tif', 'heic', 'heif'}
-MAX_SIZE = 5 * 1024 * 1024
-TARGET_SIZE = (1080, 1080)
+# Make the shared processing package importable from the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+from processing.archive import ZIP_MIMETYPE, build_zip, wants_zip
+from processing.cache import ResultCache
+from processing.ingest import IngestError, ingest
+from processing.multipart import parse_multipart
+from processing.pipeline import allowed_file, optimized_name, process_optimize_file, requested_format
+from processing.pool import run_batch
+from processing.presets import requested_max_size
 
-def resize_and_compress(image, target_size=(1080, 1080), max_size=5*1024*1024, crop_data=None):
-    if image.mode in ('RGBA', 'LA', 'P'):
-        background = Image.new('RGB', image.size, (255, 255, 255))
-        if image.mode == 'P':
-            image = image.convert('RGBA')
-        if image.mode in ('RGBA', 'LA'):
-            background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-        image = background
-    elif image.mode != 'RGB':
-        image = image.convert('RGB')
-    
-    width, height = image.size
-    target_width, target_height = target_size
-    
-    # Apply crop if provided
-    if crop_data:
-        left = max(0, int(crop_data['x']))
-        top = max(0, int(crop_data['y']))
-        right = min(width, int(crop_data['x'] + crop_data['width']))
-        bottom = min(height, int(crop_data['y'] + crop_data['height']))
-        image = image.crop((left, top, right, bottom))
-        # Resize to exact target size
-        image = image.resize(target_size, Image.Resampling.LANCZOS)
-    else:
-        # Smart Fill: Auto-detect orientation and fill accordingly
-        is_landscape = width >= height
-        
-        if is_landscape:
-            # Landscape: Fill height, crop width (center crop horizontally)
-            scale = target_height / height
-            scaled_width = width * scale
-            
-            if scaled_width >= target_width:
-                # Wide enough - crop width, use full height
-                crop_width = target_width / scale
-                crop_height = height
-                left = (width - crop_width) / 2
-                top = 0
-            else:
-                # Not wide enough - use full width, crop height
-                crop_width = width
-                crop_height = target_height / scale
-                left = 0
-                top = (height - crop_height) / 2
-        else:
-            # Portrait: Fill width, crop height (center crop vertically)
-            scale = target_width / width
-            scaled_height = height * scale
-            
-            if scaled_height >= target_height:
-                # Tall enough - crop height, use full width
-                crop_height = target_height / scale
-                crop_width = width
-                left = 0
-                top = (height - crop_height) / 2
-            else:
-                # Not tall enough - use full height, crop width
-                crop_height = height
-                crop_width = target_width / scale
-                left = (width - crop_width) / 2
-                top = 0
-        
-        left = max(0, int(left))
-        top = max(0, int(top))
-        right = min(width, int(left + crop_width))
-        bottom = min(height, int(top + crop_height))
-        image = image.crop((left, top, right, bottom))
-        
-        # Resize to exact target size
-        image = image.resize(target_size, Image.Resampling.LANCZOS)
-    
-    output = io.BytesIO()
-    image.save(output, format='PNG', optimize=True)
-    file_size = len(output.getvalue())
-    
-    if file_size > max_size:
-        output = io.BytesIO()
-        quantized = image.quantize(colors=256, method=Image.Quantize.MEDIANCUT)
-        quantized = quantized.convert('RGB')
-        quantized.save(output, format='PNG', optimize=True)
-        file_size = len(output.getvalue())
-        image = quantized
-    
-    factor = 0.95
-    while file_size > max_size and factor >= 0.5:
-        new_size = (int(target_width * factor), int(target_height * factor))
-        resized = image.resize(new_size, Image.Resampling.LANCZOS)
-        output = io.BytesIO()
-        resized.save(output, format='PNG', optimize=True)
-        file_size = len(output.getvalue())
-        if file_size <= max_size:
-            break
-        factor -= 0.05
-    
-    if file_size > max_size:
-        for colors in [128, 64, 32]:
-            quantized = image.quantize(colors=colors, method=Image.Quantize.MEDIANCUT)
-            quantized = quantized.convert('RGB')
-            output = io.BytesIO()
-            quantized.save(output, format='PNG', optimize=True)
-            file_size = len(output.getvalue())
-            if file_size <= max_size:
-                break
-    
-    output.seek(0)
-    return output
+# Warm instances keep /tmp, so repeat uploads can skip processing
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'lsa-photo-resizer-cache')
+CACHE_MAX_SIZE = 256 * 1024 * 1024
+
+RESULT_CACHE = ResultCache(CACHE_DIR, CACHE_MAX_SIZE)
 
-def handler_old(request):
+def handler(request):
     from vercel import Response
     
-    # Debug: Log request attributes
-    req_attrs = dir(request)
-    method = None
-    
-    # Try different ways to get the method
-    if hasattr(request, 'method'):
-        method = request.method
-    elif hasattr(request, 'get'):
-        method = request.get('method', 'GET')
-    elif isinstance(request, dict):
-        method = request.get('method', 'GET')
-    else:
-        # Try to get from headers or other attributes
-        method = getattr(request, 'httpMethod', None) or getattr(request, 'requestMethod', None) or 'GET'
-    
-    method = str(method).upper() if method else 'GET'
+    method = getattr(request, 'method', 'GET').upper()
     
     if method == 'OPTIONS':
         return Response(
@@ -153,14 +40,7 @@ def handler_old(request):
     
     if method != 'POST':
         return Response(
-            json.dumps({
-                'error': f'Method not allowed. Received: {method}. Expected: POST',
-                'debug': {
-                    'request_type': str(type(request)),
-                    'has_method': hasattr(request, 'method'),
-                    'attributes': [attr for attr in req_attrs if not attr.startswith('_')][:10]
-                }
-            }),
+            json.dumps({'error': f'Method not allowed. Received: {method}. Expected: POST'}),
             status=405,
             headers={
                 'Content-Type': 'application/json',
@@ -169,19 +49,8 @@ def handler_old(request):
             }
         )
     
-    # Use request as req for the rest of the code
-    req = request
-    
     try:
-        # Parse multipart form data from request
-        # Handle different request object structures
-        headers = getattr(req, 'headers', {})
-        if isinstance(headers, dict):
-            content_type = headers.get('content-type', '') or headers.get('Content-Type', '')
-        elif hasattr(headers, 'get'):
-            content_type = headers.get('content-type', '') or headers.get('Content-Type', '')
-        else:
-            content_type = ''
+        content_type = getattr(request, 'headers', {}).get('content-type', '') or getattr(request, 'headers', {}).get('Content-Type', '')
         
         if 'multipart/form-data' not in content_type:
             return Response(
@@ -190,337 +59,140 @@ def handler_old(request):
                 headers={'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
             )
         
-        # Get request body
-        body = None
-        if hasattr(req, 'body'):
-            body = req.body
-        elif hasattr(req, 'get'):
-            body = req.get('body', b'')
-        elif isinstance(req, dict):
-            body = req.get('body', b'')
-        
-        if body is None:
-            body = b''
+        body = getattr(request, 'body', b'')
         if isinstance(body, str):
             body = body.encode()
         
-        # Get path for Flask context
-        path = getattr(req, 'path', '/api/resize')
+        # Parsed with the parser created at import time
+        form, uploads = parse_multipart(body, content_type)
+        files = uploads.getlist('files')
         
-        # Use Flask's request parsing if available, otherwise parse manually
-        from flask import Flask, request as flask_request
-        from werkzeug.formparser import parse_form_data
-        
-        app_temp = Flask(__name__)
-        with app_temp.test_request_context(
-            path=path,
-            method=method,
-            data=body,
-            content_type=content_type
-        ):
-            files = flask_request.files.getlist('files')
-            
-            if not files or not files[0].filename:
-                return Response(
-                    json.dumps({'error': 'No files provided'}),
-                    status=400,
-                    headers={'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
-                )
-            
-            # Get crop data from form
-            crop_data_list = []
-            for i in range(len(files)):
-                crop_key = f'crop_{i}'
-                if crop_key in flask_request.form:
-                    try:
-                        crop_data_list.append(json.loads(flask_request.form[crop_key]))
-                    except:
-                        crop_data_list.append(None)
-                else:
-                    crop_data_list.append(None)
-            
-            processed_files = []
-            errors = []
-            file_data_list = []
-            
-            for index, file in enumerate(files):
-                if file and allowed_file(file.filename):
-                    try:
-                        image_data = file.read()
-                        image = Image.open(io.BytesIO(image_data))
-                        
-                        # Get crop data for this image
-                        crop_data = crop_data_list[index] if index < len(crop_data_list) else None
-                        
-                        output = resize_and_compress(image, TARGET_SIZE, MAX_SIZE, crop_data)
-                        output_data = output.getvalue()
-                        file_size = len(output_data)
-                        
-                        filename = secure_filename(file.filename)
-                        base_name = os.path.splitext(filename)[0]
-                        output_filename = f"{base_name}_1080x1080.png"
-                        base64_data = base64.b64encode(output_data).decode('utf-8')
-                        
-                        processed_files.append({
-                            'original_name': filename,
-                            'processed_name': output_filename,
-                            'size': file_size,
-                            'size_mb': round(file_size / (1024 * 1024), 2),
-                            'data': base64_data
-                        })
-                        
-                        file_data_list.append({
-                            'name': output_filename,
-                            'data': output_data
-                        })
-                        
-                    except Exception as e:
-                        errors.append({
-                            'filename': file.filename,
-                            'error': str(e)
-                        })
-                else:
-                    errors.append({
-                        'filename': file.filename if file else 'unknown',
-                        'error': 'File type not allowed'
-                    })
-            
-            zip_data = None
-            if file_data_list:
-                zip_buffer = io.BytesIO()
-                with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                    for file_info in file_data_list:
-                        zipf.writestr(file_info['name'], file_info['data'])
-                zip_buffer.seek(0)
-                zip_data = base64.b64encode(zip_buffer.getvalue()).decode('utf-8')
-            
+        if not files:
             return Response(
-                json.dumps({
-                    'success': True,
-                    'processed': len(processed_files),
-                    'errors': len(errors),
-                    'files': processed_files,
-                    'error_details': errors,
-                    'zip_data': zip_data
-                }),
-                status=200,
-                headers={
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                }
+                json.dumps({'error': 'No files provided'}),
+                status=400,
+                headers={'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+            )
+        if not files[0].filename:
+            return Response(
+                json.dumps({'error': 'No files selected'}),
+                status=400,
+                headers={'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
             )
-    
-    except Exception as e:
-        return Response(
-            json.dumps({'error': str(e)}),
-            status=500,
-            headers={'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
-        )
-
-def optimize_image(image, max_size_bytes):
-    """
-    Optimize image to fit within max_size_bytes while maintaining aspect ratio.
-    Returns optimized image as BytesIO.
-    """
-    # Convert to RGB if necessary
-    if image.mode in ('RGBA', 'LA', 'P'):
-        background = Image.new('RGB', image.size, (255, 255, 255))
-        if image.mode == 'P':
-            image = image.convert('RGBA')
-        if image.mode in ('RGBA', 'LA'):
-            background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-        image = background
-    elif image.mode != 'RGB':
-        image = image.convert('RGB')
-    
-    original_width, original_height = image.size
-    aspect_ratio = original_width / original_height
-    
-    # Start with original size
-    output = io.BytesIO()
-    image.save(output, format='PNG', optimize=True)
-    file_size = len(output.getvalue())
-    
-    # If already under max size, return as is
-    if file_size <= max_size_bytes:
-        output.seek(0)
-        return output
-    
-    # Try quantizing first (less quality loss than resizing)
-    if file_size > max_size_bytes:
-        output = io.BytesIO()
-        quantized = image.quantize(colors=256, method=Image.Quantize.MEDIANCUT)
-        quantized = quantized.convert('RGB')
-        quantized.save(output, format='PNG', optimize=True)
-        file_size = len(output.getvalue())
-        if file_size <= max_size_bytes:
-            output.seek(0)
-            return output
-        image = quantized
-    
-    # If still too large, reduce dimensions while maintaining aspect ratio
-    factor = 0.9
-    while file_size > max_size_bytes and factor >= 0.3:
-        new_width = int(original_width * factor)
-        new_height = int(original_width * factor / aspect_ratio)
-        resized = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        output = io.BytesIO()
-        resized.save(output, format='PNG', optimize=True)
-        file_size = len(output.getvalue())
-        if file_size <= max_size_bytes:
-            output.seek(0)
-            return output
-        factor -= 0.05
-    
-    # Final attempt: more aggressive quantization
-    if file_size > max_size_bytes:
-        for colors in [128, 64, 32]:
-            quantized = image.quantize(colors=colors, method=Image.Quantize.MEDIANCUT)
-            quantized = quantized.convert('RGB')
-            output = io.BytesIO()
-            quantized.save(output, format='PNG', optimize=True)
-            file_size = len(output.getvalue())
-            if file_size <= max_size_bytes:
-                output.seek(0)
-                return output
-    
-    output.seek(0)
-    return output
-
-def handler(request):
-    from vercel import Response
-    
-    method = getattr(request, 'method', 'GET').upper()
-    
-    if method == 'OPTIONS':
-        return Response(
-            '',
-            status=200,
-            headers={
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
-            }
-        )
-    
-    if method != 'POST':
-        return Response(
-            json.dumps({'error': f'Method not allowed. Received: {method}. Expected: POST'}),
-            status=405,
-            headers={
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Allow': 'POST, OPTIONS'
-            }
-        )
-    
-    try:
-        content_type = getattr(request, 'headers', {}).get('content-type', '') or getattr(request, 'headers', {}).get('Content-Type', '')
         
-        if 'multipart/form-data' not in content_type:
+        try:
+            output_format = requested_format(form)
+            max_size_bytes = requested_max_size(form)
+        except ValueError as e:
             return Response(
-                json.dumps({'error': f'Content-Type must be multipart/form-data. Received: {content_type}'}),
+                json.dumps({'error': str(e)}),
                 status=400,
                 headers={'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
             )
         
-        body = getattr(request, 'body', b'')
-        if isinstance(body, str):
-            body = body.encode()
+        processed_files = []
+        errors = []
+        file_data_list = []
         
-        from flask import Flask, request as flask_request
-        app_temp = Flask(__name__)
-        with app_temp.test_request_context(
-            path='/api/optimize',
-            method='POST',
-            data=body,
-            content_type=content_type
-        ):
-            files = flask_request.files.getlist('files')
-            
-            if not files or not files[0].filename:
-                return Response(
-                    json.dumps({'error': 'No files provided'}),
-                    status=400,
-                    headers={'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
-                )
-            
-            # Get max_size from form (in bytes)
-            max_size_bytes = MAX_SIZE
-            if 'max_size' in flask_request.form:
-                try:
-                    max_size_bytes = int(float(flask_request.form['max_size']))
-                except:
-                    pass
-            
-            processed_files = []
-            errors = []
-            file_data_list = []
+        request_headers = getattr(request, 'headers', {})
+        accept = request_headers.get('accept', '') or request_headers.get('Accept', '')
+        binary = wants_zip(form, accept)
+        
+        accepted = []
+        for file in files:
+            if not (file and allowed_file(file.filename)):
+                errors.append({
+                    'filename': file.filename if file else 'unknown',
+                    'error': 'File type not allowed'
+                })
+                continue
+            # Rejected the same way as on the Flask app, before decoding
+            try:
+                accepted.append(ingest(file, tempfile.gettempdir()))
+            except IngestError as e:
+                errors.append({
+                    'filename': file.filename,
+                    'error': str(e)
+                })
+        
+        jobs = ((upload.source, max_size_bytes, RESULT_CACHE, output_format) for upload in accepted)
+        try:
+            results = list(zip(accepted, run_batch(process_optimize_file, jobs)))
+        finally:
+            for upload in accepted:
+                upload.discard()
+        for upload, (result, error) in results:
+            if error is not None:
+                errors.append({
+                    'filename': upload.filename,
+                    'error': str(error)
+                })
+                continue
             
-            for file in files:
-                if file and allowed_file(file.filename):
-                    try:
-                        image_data = file.read()
-                        image = Image.open(io.BytesIO(image_data))
-                        
-                        output = optimize_image(image, max_size_bytes)
-                        output_data = output.getvalue()
-                        file_size = len(output_data)
-                        
-                        filename = secure_filename(file.filename)
-                        base_name = os.path.splitext(filename)[0]
-                        output_filename = f"{base_name}_optimized.png"
-                        base64_data = base64.b64encode(output_data).decode('utf-8')
-                        
-                        processed_files.append({
-                            'original_name': filename,
-                            'processed_name': output_filename,
-                            'size': file_size,
-                            'size_mb': round(file_size / (1024 * 1024), 2),
-                            'data': base64_data
-                        })
-                        
-                        file_data_list.append({
-                            'name': output_filename,
-                            'data': output_data
-                        })
-                        
-                    except Exception as e:
-                        errors.append({
-                            'filename': file.filename,
-                            'error': str(e)
-                        })
-                else:
-                    errors.append({
-                        'filename': file.filename if file else 'unknown',
-                        'error': 'File type not allowed'
-                    })
+            output_data, report = result
+            RESULT_CACHE.record(report['cached'], len(output_data))
+            file_size = len(output_data)
             
-            zip_data = None
-            if file_data_list:
-                zip_buffer = io.BytesIO()
-                with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                    for file_info in file_data_list:
-                        zipf.writestr(file_info['name'], file_info['data'])
-                zip_buffer.seek(0)
-                zip_data = base64.b64encode(zip_buffer.getvalue()).decode('utf-8')
+            filename = secure_filename(upload.filename)
+            output_filename = optimized_name(upload.filename, output_format)
+            processed_files.append({
+                'original_name': filename,
+                'processed_name': output_filename,
+                'size': file_size,
+                'size_mb': round(file_size / (1024 * 1024), 2),
+                'format': output_format,
+                'encode_attempts': report['attempts'],
+                'cached': report['cached']
+            })
+            if not binary:
+                processed_files[-1]['data'] = base64.b64encode(output_data).decode('utf-8')
             
+            file_data_list.append({
+                'name': output_filename,
+                'data': output_data
+            })
+        
+        if binary:
+            # Binary mode: the images plus a JSON manifest, no base64
+            manifest = {
+                'success': True,
+                'processed': len(processed_files),
+                'errors': len(errors),
+                'files': processed_files,
+                'error_details': errors
+            }
+            entries = [(file_info['name'], file_info['data']) for file_info in file_data_list]
             return Response(
-                json.dumps({
-                    'success': True,
-                    'processed': len(processed_files),
-                    'errors': len(errors),
-                    'files': processed_files,
-                    'error_details': errors,
-                    'zip_data': zip_data
-                }),
+                build_zip(entries, manifest),
                 status=200,
                 headers={
-                    'Content-Type': 'application/json',
+                    'Content-Type': ZIP_MIMETYPE,
+                    'Content-Disposition': 'attachment; filename="optimized_images.zip"',
                     'Access-Control-Allow-Origin': '*'
                 }
             )
-    
+        
+        zip_data = None
+        if file_data_list:
+            entries = [(file_info['name'], file_info['data']) for file_info in file_data_list]
+            zip_data = base64.b64encode(build_zip(entries)).decode('utf-8')
+        
+        return Response(
+            json.dumps({
+                'success': True,
+                'processed': len(processed_files),
+                'errors': len(errors),
+                'files': processed_files,
+                'error_details': errors,
+                'zip_data': zip_data
+            }),
+            status=200,
+            headers={
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            }
+        )
+
     except Exception as e:
         return Response(
             json.dumps({'error': str(e)}),
@@ -1,226 +1,373 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
-from PIL import Image
-import io
 import os
 import base64
+import json
+import re
+import time
+from urllib.parse import urlencode
 from werkzeug.utils import secure_filename
-import zipfile
+
+from processing.archive import ZIP_MIMETYPE, build_zip, stream_zip, wants_zip
+from processing.autocrop import SALIENCY_SIZE
+from processing.cache import ResultCache
+from processing.events import NDJSON_MIMETYPE, ndjson_lines, wants_ndjson
+from processing.governor import ADMISSION_WAIT, GOVERNOR, Busy, working_set
+from processing.ingest import IngestError, ingest
+from processing.jobs import Job, LocalJobQueue
+from processing import metrics
+from processing.encode import DEFAULT_STRATEGY
+from processing.pipeline import (allowed_file, optimized_name, output_name, process_autocrop_file,
+                                 process_optimize_file, process_renditions_file, requested_crop_mode,
+                                 requested_format)
+from processing.presets import load_presets, requested_max_size, requested_sizes
+from processing.pool import run_batch
+from processing.stages import parse_crop
 
 app = Flask(__name__, static_folder='static', static_url_path='')
 CORS(app)
 
-# Configuration
+# Configuration (image settings live in processing.pipeline and processing.presets)
 UPLOAD_FOLDER = 'uploads'
 OUTPUT_FOLDER = 'output'
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp', 'tiff', 'tif', 'heic', 'heif'}
-MAX_SIZE = 5 * 1024 * 1024  # 5MB in bytes
-TARGET_SIZE = (1080, 1080)
+CACHE_MAX_SIZE = 512 * 1024 * 1024  # Processed results kept on disk
+app.config['MAX_CONTENT_LENGTH'] = 256 * 1024 * 1024  # Whole request, all files
 
 # Create necessary directories
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+RESULT_CACHE = ResultCache(os.path.join(OUTPUT_FOLDER, 'cache'), CACHE_MAX_SIZE)
+# Download URLs carry the cache key, so any worker sharing the cache
+# directory can serve them
+CACHE_KEY = re.compile('[0-9a-f]{64}')
+JOB_QUEUE = LocalJobQueue()
+
+@app.errorhandler(413)
+def request_too_large(e):
+    limit = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    return jsonify({'error': f'Upload too large (limit {limit}MB per request)'}), 413
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({'status': 'ok', 'cache': RESULT_CACHE.stats(), 'memory': GOVERNOR.stats()})
+
+@app.route('/presets', methods=['GET'])
+def presets():
+    """The target presets accepted by the preset form field."""
+    return jsonify({name: {'width': preset['size'][0], 'height': preset['size'][1], 'label': preset['label']}
+                    for name, preset in load_presets().items()})
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+def wants_timings(form, args):
+    """True when the client asked for a per-request timings block."""
+    value = form.get('timings') or args.get('timings') or ''
+    return value.lower() in ('1', 'true', 'yes')
 
-def resize_and_compress(image, target_size=(1080, 1080), max_size=5*1024*1024, crop_data=None):
+def read_crops(form, count):
     """
-    Resize image to target size and compress to ensure it's under max_size.
-    Uses provided crop_data if available, otherwise uses center crop.
+    Crop data for each of count files, from the crop_<index> form fields.
+    Returns (crops, crop_errors): a crop or None per file, and index ->
+    message for the crops that are not valid (see stages.parse_crop).
     """
-    # Convert to RGB if necessary (for formats like RGBA, P, etc.)
-    if image.mode in ('RGBA', 'LA', 'P'):
-        # Create a white background
-        background = Image.new('RGB', image.size, (255, 255, 255))
-        if image.mode == 'P':
-            image = image.convert('RGBA')
-        if image.mode in ('RGBA', 'LA'):
-            background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-        image = background
-    elif image.mode != 'RGB':
-        image = image.convert('RGB')
-    
-    width, height = image.size
-    target_width, target_height = target_size
+    crop_data_list = []
+    crop_errors = {}
+    for i in range(count):
+        crop_key = f'crop_{i}'
+        crop_data = None
+        if crop_key in form:
+            try:
+                crop_data = parse_crop(json.loads(form[crop_key]))
+            except json.JSONDecodeError:
+                pass
+            except ValueError as e:
+                crop_errors[i] = str(e)
+        crop_data_list.append(crop_data)
+    return crop_data_list, crop_errors
+
+def server_busy(e):
+    response = jsonify({'error': str(e)})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
+def discard(accepted):
+    """Delete the (index, Upload) pairs' spooled files, if any are left."""
+    for _, upload in accepted:
+        upload.discard()
+
+def ingest_uploads(files, errors, crop_errors=None):
+    """
+    Move each upload out of the request: large ones are spooled to disk,
+    and non-images, decompression bombs and files with an invalid crop
+    (crop_errors, from read_crops) are rejected before decoding.
+    Returns [(index, Upload)] and appends rejections to errors.
+    """
+    accepted = []
+    for index, file in enumerate(files):
+        if not (file and allowed_file(file.filename)):
+            errors.append({
+                'filename': file.filename if file else 'unknown',
+                'error': 'File type not allowed'
+            })
+            continue
+        if crop_errors and index in crop_errors:
+            errors.append({
+                'filename': file.filename,
+                'error': crop_errors[index]
+            })
+            continue
+        try:
+            accepted.append((index, ingest(file, UPLOAD_FOLDER)))
+        except IngestError as e:
+            errors.append({
+                'filename': file.filename,
+                'error': str(e)
+            })
+    return accepted
+
+@app.route('/autocrop', methods=['POST'])
+def suggest_crops():
+    """
+    Suggested crop_<index> data for each upload, placed on its most
+    salient region, at the aspect ratio of the first requested size. The
+    crop UI starts from these; uploads may be downscaled previews, so the
+    crops are in the pixels of the uploaded file.
+    """
+    if 'files' not in request.files:
+        return jsonify({'error': 'No files provided'}), 400
+
+    files = request.files.getlist('files')
+    if not files or files[0].filename == '':
+        return jsonify({'error': 'No files selected'}), 400
+
+    try:
+        target_size = requested_sizes(request.form)[0]
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    suggestions = []
+    errors = []
+    accepted = ingest_uploads(files, errors)
     
-    # Apply crop if provided
-    if crop_data:
-        # Crop using provided coordinates
-        left = max(0, int(crop_data['x']))
-        top = max(0, int(crop_data['y']))
-        right = min(width, int(crop_data['x'] + crop_data['width']))
-        bottom = min(height, int(crop_data['y'] + crop_data['height']))
-        image = image.crop((left, top, right, bottom))
-        # Resize to exact target size
-        image = image.resize(target_size, Image.Resampling.LANCZOS)
-    else:
-        # Smart Fill: Auto-detect orientation and fill accordingly
-        is_landscape = width >= height
-        
-        if is_landscape:
-            # Landscape: Fill height, crop width (center crop horizontally)
-            scale = target_height / height
-            scaled_width = width * scale
-            
-            if scaled_width >= target_width:
-                # Wide enough - crop width, use full height
-                crop_width = target_width / scale
-                crop_height = height
-                left = (width - crop_width) / 2
-                top = 0
-            else:
-                # Not wide enough - use full width, crop height
-                crop_width = width
-                crop_height = target_height / scale
-                left = 0
-                top = (height - crop_height) / 2
-        else:
-            # Portrait: Fill width, crop height (center crop vertically)
-            scale = target_width / width
-            scaled_height = height * scale
-            
-            if scaled_height >= target_height:
-                # Tall enough - crop height, use full width
-                crop_height = target_height / scale
-                crop_width = width
-                left = 0
-                top = (height - crop_height) / 2
-            else:
-                # Not tall enough - use full height, crop width
-                crop_height = height
-                crop_width = target_width / scale
-                left = (width - crop_width) / 2
-                top = 0
-        
-        # Crop the image
-        left = max(0, int(left))
-        top = max(0, int(top))
-        right = min(width, int(left + crop_width))
-        bottom = min(height, int(top + crop_height))
-        image = image.crop((left, top, right, bottom))
-        
-        # Resize to exact target size
-        image = image.resize(target_size, Image.Resampling.LANCZOS)
+    # Each upload is decoded no larger than the saliency map needs (JPEG
+    # draft), otherwise in full; nothing is encoded
+    analysis_size = (SALIENCY_SIZE * 2, SALIENCY_SIZE * 2)
+    try:
+        reservation = GOVERNOR.reserve(working_set(
+            [upload for _, upload in accepted],
+            [analysis_size],
+            0,
+            holds_outputs=False
+        ), timeout=ADMISSION_WAIT)
+    except Busy as e:
+        discard(accepted)
+        return server_busy(e)
+    except BaseException:
+        discard(accepted)
+        raise
     
-    # Try different compression strategies
-    output = io.BytesIO()
-    image.save(output, format='PNG', optimize=True)
-    file_size = len(output.getvalue())
+    jobs = ((upload.source, target_size) for _, upload in accepted)
+    try:
+        for (index, upload), (result, error) in zip(accepted, run_batch(process_autocrop_file, jobs)):
+            if error is not None:
+                errors.append({
+                    'filename': upload.filename,
+                    'error': str(error)
+                })
+                continue
+            suggestions.append(dict(result, index=index, filename=upload.filename))
+    finally:
+        reservation.release()
+        discard(accepted)
+
+    return jsonify({
+        'success': True,
+        'target_size': f'{target_size[0]}x{target_size[1]}',
+        'files': suggestions,
+        'error_details': errors
+    })
+
+@app.route('/resize', methods=['POST'])
+def resize_images():
+    if 'files' not in request.files:
+        return jsonify({'error': 'No files provided'}), 400
     
-    # If too large, try quantizing to reduce colors
-    if file_size > max_size:
-        output = io.BytesIO()
-        # Quantize to 256 colors (8-bit palette)
-        quantized = image.quantize(colors=256, method=Image.Quantize.MEDIANCUT)
-        quantized = quantized.convert('RGB')
-        quantized.save(output, format='PNG', optimize=True)
-        file_size = len(output.getvalue())
-        image = quantized
+    files = request.files.getlist('files')
+    if not files or files[0].filename == '':
+        return jsonify({'error': 'No files selected'}), 400
     
-    # If still too large, reduce dimensions incrementally
-    factor = 0.95
-    while file_size > max_size and factor >= 0.5:
-        new_size = (int(target_width * factor), int(target_height * factor))
-        resized = image.resize(new_size, Image.Resampling.LANCZOS)
-        output = io.BytesIO()
-        resized.save(output, format='PNG', optimize=True)
-        file_size = len(output.getvalue())
-        if file_size <= max_size:
-            break
-        factor -= 0.05
+    try:
+        output_format = requested_format(request.form)
+        target_sizes = requested_sizes(request.form)
+        max_size = requested_max_size(request.form)
+        crop_mode = requested_crop_mode(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    # Final check - if still too large, use more aggressive quantization
-    if file_size > max_size:
-        for colors in [128, 64, 32]:
-            quantized = image.quantize(colors=colors, method=Image.Quantize.MEDIANCUT)
-            quantized = quantized.convert('RGB')
-            output = io.BytesIO()
-            quantized.save(output, format='PNG', optimize=True)
-            file_size = len(output.getvalue())
-            if file_size <= max_size:
-                break
+    processed_files = []
+    # <cache key>/<name> of each output, as /download and /download-zip take them
+    downloads = []
+    errors = []
+    # stage -> [seconds] across every file of this request
+    request_timings = {}
+    show_timings = wants_timings(request.form, request.args)
+    crop_data_list, crop_errors = read_crops(request.form, len(files))
+    accepted = ingest_uploads(files, errors, crop_errors)
+    accept = request.headers.get('Accept')
+    streamed = wants_ndjson(request.form, accept) or wants_zip(request.form, accept)
     
-    output.seek(0)
-    return output
-
-def optimize_image(image, max_size_bytes):
-    """
-    Optimize image to fit within max_size_bytes while maintaining aspect ratio.
-    Returns optimized image as BytesIO.
-    """
-    # Convert to RGB if necessary
-    if image.mode in ('RGBA', 'LA', 'P'):
-        background = Image.new('RGB', image.size, (255, 255, 255))
-        if image.mode == 'P':
-            image = image.convert('RGBA')
-        if image.mode in ('RGBA', 'LA'):
-            background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-        image = background
-    elif image.mode != 'RGB':
-        image = image.convert('RGB')
+    # Reserve the batch's estimated working set before decoding anything;
+    # when the server is full, queue briefly, then turn the request away
+    try:
+        reservation = GOVERNOR.reserve(working_set(
+            [upload for _, upload in accepted],
+            target_sizes,
+            max_size,
+            [crop_data_list[index] if index < len(crop_data_list) else None for index, _ in accepted],
+            holds_outputs=not streamed
+        ), timeout=ADMISSION_WAIT)
+    except Busy as e:
+        discard(accepted)
+        return server_busy(e)
+    except BaseException:
+        discard(accepted)
+        raise
     
-    original_width, original_height = image.size
-    aspect_ratio = original_width / original_height
+    # Workers read spooled uploads from disk, one image at a time each, and
+    # make every requested size from a single decode
+    jobs = (
+        (upload.source, crop_data_list[index] if index < len(crop_data_list) else None,
+         target_sizes, max_size, RESULT_CACHE, output_format, DEFAULT_STRATEGY, crop_mode)
+        for index, upload in accepted
+    )
     
-    # Start with original size
-    output = io.BytesIO()
-    image.save(output, format='PNG', optimize=True)
-    file_size = len(output.getvalue())
+    def outcomes(jobs):
+        """Yield (file info, image bytes) for each rendition as its upload finishes; (None, None) on failure."""
+        try:
+            for (index, upload), (result, error) in zip(accepted, run_batch(process_renditions_file, jobs)):
+                upload.discard()
+                if error is not None:
+                    metrics.observe_error()
+                    errors.append({
+                        'filename': upload.filename,
+                        'error': str(error)
+                    })
+                    yield None, None
+                    continue
+                
+                outputs, report = result
+                metrics.observe_result(report)
+                metrics.merge_timings(request_timings, report['timings'])
+                
+                filename = secure_filename(upload.filename)
+                for target_size, output_data, rendition in zip(target_sizes, outputs, report['renditions']):
+                    RESULT_CACHE.record(rendition['cached'], len(output_data))
+                    output_filename = output_name(upload.filename, target_size, output_format)
+                    downloads.append(f"{rendition['cache_key']}/{output_filename}")
+                    
+                    file_size = len(output_data)
+                    processed_files.append({
+                        'original_name': filename,
+                        'processed_name': output_filename,
+                        'target_size': f'{target_size[0]}x{target_size[1]}',
+                        'size': file_size,
+                        'size_mb': round(file_size / (1024 * 1024), 2),
+                        'format': output_format,
+                        'encode_attempts': rendition['attempts'],
+                        'cached': rendition['cached'],
+                        'download_url': f'/download/{downloads[-1]}'
+                    })
+                    if show_timings:
+                        # Stages run once per upload, shared by its renditions
+                        processed_files[-1]['timings'] = metrics.summarize(report['timings'])
+                    yield processed_files[-1], output_data
+        finally:
+            discard(accepted)
     
-    # If already under max size, return as is
-    if file_size <= max_size_bytes:
-        output.seek(0)
-        return output
+    def process_uploads(jobs):
+        """Yield (name, image bytes) for each upload as it finishes processing."""
+        for file_info, output_data in outcomes(jobs):
+            if file_info is not None:
+                yield file_info['processed_name'], output_data
     
-    # Try quantizing first (less quality loss than resizing)
-    if file_size > max_size_bytes:
-        output = io.BytesIO()
-        quantized = image.quantize(colors=256, method=Image.Quantize.MEDIANCUT)
-        quantized = quantized.convert('RGB')
-        quantized.save(output, format='PNG', optimize=True)
-        file_size = len(output.getvalue())
-        if file_size <= max_size_bytes:
-            output.seek(0)
-            return output
-        image = quantized
+    def events(jobs):
+        """Progress events for NDJSON mode, see processing.events."""
+        started = time.perf_counter()
+        for error in list(errors):
+            yield dict(error, event='error', elapsed_ms=0)
+        for file_info, _ in outcomes(jobs):
+            elapsed_ms = round((time.perf_counter() - started) * 1000)
+            if file_info is None:
+                yield dict(errors[-1], event='error', elapsed_ms=elapsed_ms)
+            else:
+                yield dict(file_info, event='file', elapsed_ms=elapsed_ms)
+        names = [('file', download) for download in downloads]
+        yield dict(summary(), event='done', elapsed_ms=round((time.perf_counter() - started) * 1000),
+                   zip_url=f'/download-zip?{urlencode(names)}' if names else None)
     
-    # If still too large, reduce dimensions while maintaining aspect ratio
-    # Start at 90% and work down
-    factor = 0.9
-    while file_size > max_size_bytes and factor >= 0.3:
-        new_width = int(original_width * factor)
-        new_height = int(original_width * factor / aspect_ratio)
-        resized = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        output = io.BytesIO()
-        resized.save(output, format='PNG', optimize=True)
-        file_size = len(output.getvalue())
-        if file_size <= max_size_bytes:
-            output.seek(0)
-            return output
-        factor -= 0.05
+    def summary():
+        body = {
+            'success': True,
+            'processed': len(processed_files),
+            'errors': len(errors),
+            'files': processed_files,
+            'error_details': errors
+        }
+        if show_timings:
+            body['timings'] = metrics.summarize(request_timings)
+        return body
     
-    # Final attempt: more aggressive quantization
-    if file_size > max_size_bytes:
-        for colors in [128, 64, 32]:
-            quantized = image.quantize(colors=colors, method=Image.Quantize.MEDIANCUT)
-            quantized = quantized.convert('RGB')
-            output = io.BytesIO()
-            quantized.save(output, format='PNG', optimize=True)
-            file_size = len(output.getvalue())
-            if file_size <= max_size_bytes:
-                output.seek(0)
-                return output
+    def respond():
+        if wants_ndjson(request.form, request.headers.get('Accept')):
+            # Streamed mode: one JSON line per finished file, then a summary
+            return Response(
+                stream_with_context(ndjson_lines(events(jobs))),
+                mimetype=NDJSON_MIMETYPE,
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+        
+        if wants_zip(request.form, request.headers.get('Accept')):
+            # Binary mode: stream each image into the ZIP as it is finished,
+            # with the JSON manifest as the last entry
+            return Response(
+                stream_with_context(stream_zip(process_uploads(jobs), summary)),
+                mimetype=ZIP_MIMETYPE,
+                headers={'Content-Disposition': 'attachment; filename=resized_images.zip'}
+            )
+        
+        # Create a zip file in memory with all processed images
+        entries = list(process_uploads(jobs))
+        zip_data = None
+        if entries:
+            with metrics.collect() as timings:
+                with metrics.stage('zip'):
+                    archive = build_zip(entries)
+                with metrics.stage('base64'):
+                    zip_data = base64.b64encode(archive).decode('utf-8')
+            metrics.observe_timings(timings)
+            metrics.merge_timings(request_timings, timings)
+        
+        return jsonify(dict(summary(), zip_data=zip_data))
     
-    output.seek(0)
-    return output
+    # The reservation is held until the response, streamed or not, is closed
+    try:
+        response = respond()
+    except BaseException:
+        reservation.release()
+        discard(accepted)
+        raise
+    response.call_on_close(reservation.release)
+    return response
 
-@app.route('/health', methods=['GET'])
-def health():
-    return jsonify({'status': 'ok'})
-
-@app.route('/resize', methods=['POST'])
-def resize_images():
+@app.route('/optimize', methods=['POST'])
+def optimize_images():
+    """
+    Compress each upload under max_size at its own dimensions; the Flask
+    counterpart of /api/optimize.
+    """
     if 'files' not in request.files:
         return jsonify({'error': 'No files provided'}), 400
     
@@ -228,98 +375,220 @@ def resize_images():
     if not files or files[0].filename == '':
         return jsonify({'error': 'No files selected'}), 400
     
+    try:
+        output_format = requested_format(request.form)
+        max_size_bytes = requested_max_size(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     processed_files = []
     errors = []
+    accepted = ingest_uploads(files, errors)
+    binary = wants_zip(request.form, request.headers.get('Accept'))
     
-    # Get crop data from form
-    crop_data_list = []
-    for i in range(len(files)):
-        crop_key = f'crop_{i}'
-        if crop_key in request.form:
-            try:
-                import json
-                crop_data_list.append(json.loads(request.form[crop_key]))
-            except:
-                crop_data_list.append(None)
-        else:
-            crop_data_list.append(None)
+    # Admitted like /resize, with each upload kept at its own size
+    try:
+        reservation = GOVERNOR.reserve(working_set(
+            [upload for _, upload in accepted],
+            None,
+            max_size_bytes,
+            holds_outputs=not binary
+        ), timeout=ADMISSION_WAIT)
+    except Busy as e:
+        discard(accepted)
+        return server_busy(e)
+    except BaseException:
+        discard(accepted)
+        raise
     
-    for index, file in enumerate(files):
-        if file and allowed_file(file.filename):
-            try:
-                # Read image
-                image_data = file.read()
-                image = Image.open(io.BytesIO(image_data))
-                
-                # Get crop data for this image
-                crop_data = crop_data_list[index] if index < len(crop_data_list) else None
-                
-                # Resize and compress
-                output = resize_and_compress(image, TARGET_SIZE, MAX_SIZE, crop_data)
-                
-                # Save processed image
-                filename = secure_filename(file.filename)
-                base_name = os.path.splitext(filename)[0]
-                output_filename = f"{base_name}_1080x1080.png"
-                output_path = os.path.join(OUTPUT_FOLDER, output_filename)
+    jobs = ((upload.source, max_size_bytes, RESULT_CACHE, output_format) for _, upload in accepted)
+    
+    def process_uploads(jobs):
+        """Yield (name, image bytes) for each upload as it finishes processing."""
+        try:
+            for (_, upload), (result, error) in zip(accepted, run_batch(process_optimize_file, jobs)):
+                upload.discard()
+                if error is not None:
+                    metrics.observe_error()
+                    errors.append({
+                        'filename': upload.filename,
+                        'error': str(error)
+                    })
+                    continue
                 
-                with open(output_path, 'wb') as f:
-                    f.write(output.getvalue())
+                output_data, report = result
+                metrics.observe_result(report)
+                RESULT_CACHE.record(report['cached'], len(output_data))
+                file_size = len(output_data)
                 
-                file_size = len(output.getvalue())
+                output_filename = optimized_name(upload.filename, output_format)
                 processed_files.append({
-                    'original_name': filename,
+                    'original_name': secure_filename(upload.filename),
                     'processed_name': output_filename,
                     'size': file_size,
-                    'size_mb': round(file_size / (1024 * 1024), 2)
-                })
-                
-            except Exception as e:
-                errors.append({
-                    'filename': file.filename,
-                    'error': str(e)
+                    'size_mb': round(file_size / (1024 * 1024), 2),
+                    'format': output_format,
+                    'encode_attempts': report['attempts'],
+                    'cached': report['cached']
                 })
-        else:
-            errors.append({
-                'filename': file.filename if file else 'unknown',
-                'error': 'File type not allowed'
-            })
+                if not binary:
+                    processed_files[-1]['data'] = base64.b64encode(output_data).decode('utf-8')
+                yield output_filename, output_data
+        finally:
+            discard(accepted)
     
-    # Create a zip file in memory with all processed images
-    zip_data = None
-    if processed_files:
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for file_info in processed_files:
-                file_path = os.path.join(OUTPUT_FOLDER, file_info['processed_name'])
-                if os.path.exists(file_path):
-                    with open(file_path, 'rb') as f:
-                        zipf.writestr(file_info['processed_name'], f.read())
-        zip_buffer.seek(0)
-        zip_data = base64.b64encode(zip_buffer.getvalue()).decode('utf-8')
+    def summary():
+        return {
+            'success': True,
+            'processed': len(processed_files),
+            'errors': len(errors),
+            'files': processed_files,
+            'error_details': errors
+        }
     
-    return jsonify({
-        'success': True,
-        'processed': len(processed_files),
-        'errors': len(errors),
-        'files': processed_files,
-        'error_details': errors,
-        'zip_data': zip_data
-    })
+    def respond():
+        if binary:
+            # Binary mode: the images plus a JSON manifest, no base64
+            return Response(
+                stream_with_context(stream_zip(process_uploads(jobs), summary)),
+                mimetype=ZIP_MIMETYPE,
+                headers={'Content-Disposition': 'attachment; filename=optimized_images.zip'}
+            )
+        
+        entries = list(process_uploads(jobs))
+        zip_data = base64.b64encode(build_zip(entries)).decode('utf-8') if entries else None
+        return jsonify(dict(summary(), zip_data=zip_data))
+    
+    # The reservation is held until the response, streamed or not, is closed
+    try:
+        response = respond()
+    except BaseException:
+        reservation.release()
+        discard(accepted)
+        raise
+    response.call_on_close(reservation.release)
+    return response
 
-@app.route('/download/<filename>', methods=['GET'])
-def download_file(filename):
-    file_path = os.path.join(OUTPUT_FOLDER, secure_filename(filename))
-    if os.path.exists(file_path):
-        return send_file(file_path, as_attachment=True)
-    return jsonify({'error': 'File not found'}), 404
+def cached_result(key):
+    """Path of the cached result for a key taken from a URL, or None."""
+    if not CACHE_KEY.fullmatch(key):
+        return None
+    path = RESULT_CACHE.path(key)
+    return path if os.path.isfile(path) else None
+
+@app.route('/download/<key>/<filename>', methods=['GET'])
+def download_file(key, filename):
+    path = cached_result(key)
+    if path is None:
+        return jsonify({'error': 'File not found'}), 404
+    return send_file(path, as_attachment=True, download_name=secure_filename(filename))
 
 @app.route('/download-zip', methods=['GET'])
 def download_zip():
-    zip_path = os.path.join(OUTPUT_FOLDER, 'resized_images.zip')
-    if os.path.exists(zip_path):
-        return send_file(zip_path, as_attachment=True, download_name='resized_images.zip')
-    return jsonify({'error': 'Zip file not found'}), 404
+    """Stream the processed images given as ?file=<cache key>/<name> as a ZIP."""
+    requested = [value.partition('/') for value in request.args.getlist('file')]
+    if not requested:
+        return jsonify({'error': 'No files requested'}), 400
+    entries = [(secure_filename(name), cached_result(key)) for key, _, name in requested]
+    entries = [(name, path) for name, path in entries if path is not None]
+    if not entries:
+        return jsonify({'error': 'Zip file not found'}), 404
+    
+    return Response(
+        stream_zip(read_cached(entries)),
+        mimetype=ZIP_MIMETYPE,
+        headers={'Content-Disposition': 'attachment; filename=resized_images.zip'}
+    )
+
+def read_cached(entries):
+    """Yield (name, bytes) for (name, cache path) pairs still in the cache."""
+    for name, path in entries:
+        try:
+            with open(path, 'rb') as f:
+                yield name, f.read()
+        except FileNotFoundError:
+            # Evicted since the listing
+            continue
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """
+    Start resizing a batch in the background. Takes the same form as
+    /resize and returns 202 with the job id and its status URL at once.
+    """
+    if 'files' not in request.files:
+        return jsonify({'error': 'No files provided'}), 400
+    
+    files = request.files.getlist('files')
+    if not files or files[0].filename == '':
+        return jsonify({'error': 'No files selected'}), 400
+    
+    try:
+        output_format = requested_format(request.form)
+        target_sizes = requested_sizes(request.form)
+        max_size = requested_max_size(request.form)
+        crop_mode = requested_crop_mode(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    errors = []
+    crop_data_list, crop_errors = read_crops(request.form, len(files))
+    accepted = ingest_uploads(files, errors, crop_errors)
+    job = JOB_QUEUE.submit(Job(
+        [upload for _, upload in accepted],
+        [crop_data_list[index] for index, _ in accepted],
+        output_format,
+        RESULT_CACHE,
+        target_sizes,
+        max_size,
+        crop_mode
+    ))
+    return jsonify(job_status_body(job, errors)), 202
+
+def job_status_body(job, error_details=None):
+    body = job.to_dict()
+    body['status_url'] = f'/jobs/{job.id}'
+    body['zip_url'] = f'/jobs/{job.id}/zip'
+    for file_info in body['files']:
+        if file_info['status'] == 'done':
+            file_info['download_url'] = f"/jobs/{job.id}/files/{file_info['processed_name']}"
+    if error_details is not None:
+        body['error_details'] = error_details
+    return body
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Per-file status of a job; finished files carry a download_url."""
+    job = JOB_QUEUE.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_status_body(job))
+
+@app.route('/jobs/<job_id>/files/<filename>', methods=['GET'])
+def job_file(job_id, filename):
+    job = JOB_QUEUE.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    keys = dict(job.done_files())
+    if filename not in keys:
+        return jsonify({'error': 'File not found or not processed yet'}), 404
+    path = RESULT_CACHE.path(keys[filename])
+    if not os.path.exists(path):
+        return jsonify({'error': 'File has expired from the cache'}), 410
+    return send_file(path, as_attachment=True, download_name=filename)
+
+@app.route('/jobs/<job_id>/zip', methods=['GET'])
+def job_zip(job_id):
+    """Stream a job's finished files as a ZIP, with its status as manifest.json."""
+    job = JOB_QUEUE.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    entries = [(name, RESULT_CACHE.path(key)) for name, key in job.done_files()]
+    return Response(
+        stream_zip(read_cached(entries), lambda: job_status_body(job)),
+        mimetype=ZIP_MIMETYPE,
+        headers={'Content-Disposition': 'attachment; filename=resized_images.zip'}
+    )
 
 @app.route('/')
 def index():
@@ -0,0 +1,78 @@
+"""
+Benchmark: PNG encoder strategies in the byte-budget search, over a corpus
+of photos prepared the way /resize prepares them (crop, resample, flatten).
+
+"all max" is the behaviour before encoder strategies: every trial encode
+uses optimize=True. The other rows run trials with the fast strategy and
+encode only the accepted candidate with the named one.
+
+    python bench/encode_strategies.py photos/ [--max-kb 5120] [--size 1080]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from processing.budget import fit_to_budget
+from processing.encode import STRATEGIES, TRIAL_STRATEGY
+from processing.predict import _walk
+from processing.stages import flatten, plan_crop, resample
+
+
+def load(paths, size):
+    images = []
+    for path in paths:
+        try:
+            image = Image.open(path)
+            image.load()
+        except Exception as e:
+            print(f'skipping {path}: {e}', file=sys.stderr)
+            continue
+        target_size = (size, size)
+        image = resample(image.crop(plan_crop(image.size, target_size)), target_size)
+        images.append(flatten(image))
+    return images
+
+
+def measure(images, max_size, strategy, trial_strategy):
+    elapsed = total_bytes = attempts = fits = 0
+    for image in images:
+        start = time.perf_counter()
+        output, report = fit_to_budget(image, max_size, strategy=strategy, trial_strategy=trial_strategy)
+        elapsed += time.perf_counter() - start
+        total_bytes += len(output.getvalue())
+        attempts += report['attempts']
+        fits += report['fits']
+    count = len(images)
+    return elapsed / count * 1000, total_bytes / count, attempts / count, fits
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('paths', nargs='+', help='image files or directories')
+    parser.add_argument('--max-kb', type=int, default=5 * 1024, help='byte budget per image in KB')
+    parser.add_argument('--size', type=int, default=1080, help='square target size in pixels')
+    args = parser.parse_args(argv)
+
+    images = load(list(_walk(args.paths)), args.size)
+    if not images:
+        print('no images found')
+        return 1
+
+    max_size = args.max_kb * 1024
+    rows = [('all max', 'max', 'max')]
+    rows += [(name, name, TRIAL_STRATEGY) for name in STRATEGIES]
+    print(f'{len(images)} images at {args.size}x{args.size}, budget {args.max_kb} KB')
+    print(f"{'strategy':<10} {'ms/image':>9} {'bytes':>10} {'encodes':>8} {'fit':>5}")
+    for label, strategy, trial_strategy in rows:
+        ms, mean_bytes, attempts, fits = measure(images, max_size, strategy, trial_strategy)
+        print(f'{label:<10} {ms:9.1f} {mean_bytes:10.0f} {attempts:8.2f} {fits:>2}/{len(images)}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+Benchmark: alpha flattening on large transparent images, per mode.
+
+"before" is the old stage: Image.new plus paste(mask=alpha), with palette
+images expanded by convert('RGBA') and LA pasted without a mask. "after"
+is processing.stages.flatten. Columns are the time per image and the
+largest per-sample difference between the two (LA differs by design:
+its alpha used to be ignored).
+
+    python bench/flatten.py [--size 4000x3000] [--repeat 5] [photos/ ...]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+
+from processing.predict import _walk
+from processing.stages import WHITE, flatten
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from run import cutout  # noqa: E402
+
+
+def before(image, background=WHITE):
+    flattened = Image.new('RGB', image.size, background)
+    if image.mode == 'P':
+        image = image.convert('RGBA')
+    if image.mode in ('RGBA', 'LA'):
+        flattened.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
+        return flattened
+    return image.convert('RGB')
+
+
+def synthetic(size):
+    """{label: image} of the transparent modes, from one seeded cutout."""
+    rgba = cutout(random.Random(0), size)
+    palette = rgba.convert('RGB').quantize(255)
+    # Index 255 is unused by the 255-colour palette: make it the transparent one
+    indices = np.asarray(palette).copy()
+    indices[np.asarray(rgba)[..., 3] < 128] = 255
+    transparent = Image.fromarray(indices, 'P')
+    transparent.putpalette(palette.getpalette())
+    transparent.info['transparency'] = 255
+    return {
+        'RGBA': rgba,
+        'LA': rgba.convert('LA'),
+        'P transparency': transparent,
+    }
+
+
+def measure(images, func, repeat):
+    elapsed = 0
+    for image in images:
+        func(image)  # warm up
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func(image)
+        elapsed += (time.perf_counter() - start) / repeat
+    return elapsed / len(images) * 1000
+
+
+def difference(images):
+    return max(int(np.abs(np.asarray(before(image), dtype=np.int16) - np.asarray(flatten(image, WHITE))).max())
+               for image in images)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('paths', nargs='*', help='extra image files or directories (transparent PNGs)')
+    parser.add_argument('--size', default='4000x3000', help='synthetic image size, WIDTHxHEIGHT')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per image')
+    args = parser.parse_args(argv)
+
+    width, height = (int(value) for value in args.size.lower().split('x'))
+    groups = {label: [image] for label, image in synthetic((width, height)).items()}
+    for path in _walk(args.paths):
+        image = Image.open(path)
+        image.load()
+        groups.setdefault(f'files {image.mode}', []).append(image)
+
+    print(f'synthetic images at {width}x{height}, {args.repeat} runs each')
+    print(f"{'mode':<16} {'images':>6} {'before ms':>10} {'after ms':>9} {'speedup':>8} {'max diff':>9}")
+    for label, images in groups.items():
+        old = measure(images, before, args.repeat)
+        new = measure(images, flatten, args.repeat)
+        print(f'{label:<16} {len(images):6d} {old:10.1f} {new:9.1f} {old / new:7.2f}x {difference(images):9d}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
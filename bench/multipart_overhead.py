@@ -0,0 +1,68 @@
+"""
+Micro-benchmark: per-request multipart parsing overhead in the Vercel
+handlers, comparing the old throwaway Flask app + test_request_context
+with the parser created once at import time.
+
+    python bench/multipart_overhead.py [--iterations 500] [--upload-kb 200]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, request as flask_request
+from werkzeug.test import EnvironBuilder
+
+from processing.multipart import parse_multipart
+
+
+def make_body(upload_kb):
+    builder = EnvironBuilder(method='POST', data={
+        'files': [(io.BytesIO(os.urandom(upload_kb * 1024)), 'photo.png')],
+        'crop_0': '{"x": 0, "y": 0, "width": 1080, "height": 1080}',
+    })
+    environ = builder.get_environ()
+    return environ['wsgi.input'].read(), environ['CONTENT_TYPE']
+
+
+def parse_with_flask(body, content_type):
+    # What the handlers did before: a new app and request context per call
+    app_temp = Flask(__name__)
+    with app_temp.test_request_context(path='/api/resize', method='POST', data=body,
+                                       content_type=content_type):
+        files = flask_request.files.getlist('files')
+        return flask_request.form.get('crop_0'), files[0].read()
+
+
+def parse_with_shared_parser(body, content_type):
+    form, uploads = parse_multipart(body, content_type)
+    return form.get('crop_0'), uploads.getlist('files')[0].read()
+
+
+def measure(func, body, content_type, iterations):
+    func(body, content_type)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(body, content_type)
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--upload-kb', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    body, content_type = make_body(args.upload_kb)
+    before = measure(parse_with_flask, body, content_type, args.iterations)
+    after = measure(parse_with_shared_parser, body, content_type, args.iterations)
+    print(f'Flask app + test_request_context: {before:8.3f} ms/request')
+    print(f'shared FormDataParser:            {after:8.3f} ms/request')
+    print(f'saved per request:                {before - after:8.3f} ms ({before / after:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark: palette quantization for the PNG budget fallbacks, over a
+corpus of photos prepared the way /resize prepares them.
+
+"rgb mediancut" is the behaviour before processing.quantize: median cut
+from scratch for every palette size, converted back to RGB before the
+PNG encode. The other rows quantize once per method and derive the
+smaller palettes, keeping P mode. Columns are the time to produce all
+palette sizes, the mean PNG size (max strategy) and the mean absolute
+error against the unquantized image, per palette size.
+
+    python bench/quantizers.py photos/ [--size 1080] [--dither]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageChops, ImageStat
+
+from processing.encode import encode_png
+from processing.predict import _walk
+from processing.quantize import METHODS, Quantizer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from encode_strategies import load  # noqa: E402
+
+PALETTES = (256, 128, 64, 32)
+
+
+def rgb_mediancut(image):
+    return [image.quantize(colors, method=Image.Quantize.MEDIANCUT).convert('RGB') for colors in PALETTES]
+
+
+def derived(method, dither):
+    def quantize(image):
+        quantizer = Quantizer(image, method, dither)
+        return [quantizer.quantize(colors) for colors in PALETTES]
+    return quantize
+
+
+def error(image, quantized):
+    difference = ImageChops.difference(image, quantized.convert('RGB'))
+    return sum(ImageStat.Stat(difference).mean) / 3
+
+
+def measure(images, quantize):
+    elapsed = 0
+    sizes = [0] * len(PALETTES)
+    errors = [0] * len(PALETTES)
+    for image in images:
+        start = time.perf_counter()
+        results = quantize(image)
+        elapsed += time.perf_counter() - start
+        for index, result in enumerate(results):
+            sizes[index] += len(encode_png(result, 'max').getvalue())
+            errors[index] += error(image, result)
+    count = len(images)
+    return elapsed / count * 1000, [size / count for size in sizes], [e / count for e in errors]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('paths', nargs='+', help='image files or directories')
+    parser.add_argument('--size', type=int, default=1080, help='square target size in pixels')
+    parser.add_argument('--dither', action='store_true', help='Floyd-Steinberg dithering for derived palettes')
+    args = parser.parse_args(argv)
+
+    images = load(list(_walk(args.paths)), args.size)
+    if not images:
+        print('no images found')
+        return 1
+
+    rows = [('rgb mediancut', rgb_mediancut)]
+    rows += [(f'P {name}', derived(name, args.dither)) for name in METHODS]
+    print(f'{len(images)} images at {args.size}x{args.size}, palettes {PALETTES}')
+    print(f"{'quantizer':<16} {'ms/image':>9}  {'mean bytes per palette':<36}  mean abs error per palette")
+    for label, quantize in rows:
+        ms, sizes, errors = measure(images, quantize)
+        print(f"{label:<16} {ms:9.1f}  {' '.join(f'{size:8.0f}' for size in sizes):<36}  "
+              f"{' '.join(f'{e:5.2f}' for e in errors)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
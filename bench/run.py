@@ -0,0 +1,322 @@
+"""
+Benchmark suite: every pipeline over deterministic synthetic corpora,
+with JSON output to diff between commits.
+
+Corpora are generated from a seed, so every run and every commit sees the
+same input files:
+
+    noisy      4000x3000 photo-like JPEGs with sensor-style noise
+    flat       2400x1600 flat-colour graphics (PNG)
+    alpha      2000x2000 RGBA PNGs with transparent regions
+    panorama   16000x3000 JPEG, the large-decode case
+    tiny       small PNGs and JPEGs, the per-file overhead case
+    photos     real files from --photos, when given
+
+Each pipeline/corpus pair runs in a fresh process so its peak RSS is its
+own. Reported per pair: throughput, mean/p50/p95 latency, peak RSS,
+encode attempts, output bytes, budget fits and mean milliseconds per
+pipeline stage (see processing.metrics). Attempts and bytes are
+deterministic; latencies and RSS are not.
+
+    python bench/run.py [--output head.json] [--corpora noisy,tiny] [--repeat 3]
+    python bench/run.py --compare base.json head.json
+"""
+import argparse
+import io
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PIL
+from PIL import Image, ImageDraw, ImageFilter
+
+from processing.cache import PIPELINE_VERSION
+from processing.pipeline import MAX_SIZE, TARGET_SIZE, process_optimize_file, process_resize_file
+from processing.predict import _walk
+
+SEED = 1080
+# Budget for the optimize pipelines, low enough to make the search work
+OPTIMIZE_BUDGET = 1024 * 1024
+
+# name -> (function, arguments after the source path)
+PIPELINES = {
+    'resize-png': (process_resize_file, (None, TARGET_SIZE, MAX_SIZE, None, 'png')),
+    'resize-jpeg': (process_resize_file, (None, TARGET_SIZE, MAX_SIZE, None, 'jpeg')),
+    'resize-webp': (process_resize_file, (None, TARGET_SIZE, MAX_SIZE, None, 'webp')),
+    'optimize-png': (process_optimize_file, (OPTIMIZE_BUDGET, None, 'png')),
+    'optimize-jpeg': (process_optimize_file, (OPTIMIZE_BUDGET, None, 'jpeg')),
+}
+
+
+def _noise(rng, size, mode='L'):
+    bands = len(mode)
+    return Image.frombytes(mode, size, rng.randbytes(size[0] * size[1] * bands))
+
+
+def photo(rng, size, noise=24):
+    """Smooth colour fields with fine detail and per-pixel noise on top."""
+    width, height = size
+    fields = _noise(rng, (max(2, width // 100), max(2, height // 100)), 'RGB')
+    image = fields.resize(size, Image.Resampling.BICUBIC)
+    detail = _noise(rng, (max(2, width // 8), max(2, height // 8)), 'RGB').resize(size, Image.Resampling.BILINEAR)
+    image = Image.blend(image, detail, 0.2)
+    grain = _noise(rng, size).point(lambda value: 128 - noise + value * 2 * noise // 255)
+    return Image.merge('RGB', [Image.blend(band, grain, 0.25) for band in image.split()])
+
+
+def graphic(rng, size, shapes=60):
+    palette = [tuple(rng.randrange(256) for _ in range(3)) for _ in range(8)]
+    image = Image.new('RGB', size, palette[0])
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    for _ in range(shapes):
+        x0, x1 = sorted(rng.randrange(width) for _ in range(2))
+        y0, y1 = sorted(rng.randrange(height) for _ in range(2))
+        shape = rng.choice((draw.rectangle, draw.ellipse, draw.line))
+        if shape is draw.line:
+            draw.line((x0, y0, x1, y1), fill=rng.choice(palette), width=rng.randrange(2, 24))
+        else:
+            shape((x0, y0, x1, y1), fill=rng.choice(palette))
+    return image
+
+
+def cutout(rng, size):
+    image = photo(rng, size).convert('RGBA')
+    mask = Image.new('L', size, 0)
+    draw = ImageDraw.Draw(mask)
+    width, height = size
+    for _ in range(6):
+        x, y = rng.randrange(width), rng.randrange(height)
+        radius = rng.randrange(min(size) // 10, min(size) // 3)
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=rng.randrange(128, 256))
+    image.putalpha(mask.filter(ImageFilter.GaussianBlur(8)))
+    return image
+
+
+def _encoded(image, image_format, **options):
+    output = io.BytesIO()
+    image.save(output, format=image_format, **options)
+    return output.getvalue()
+
+
+def _noisy(rng, index):
+    return 'jpg', _encoded(photo(rng, (4000, 3000)), 'JPEG', quality=92)
+
+
+def _flat(rng, index):
+    return 'png', _encoded(graphic(rng, (2400, 1600)), 'PNG')
+
+
+def _alpha(rng, index):
+    return 'png', _encoded(cutout(rng, (2000, 2000)), 'PNG')
+
+
+def _panorama(rng, index):
+    return 'jpg', _encoded(photo(rng, (16000, 3000)), 'JPEG', quality=90)
+
+
+def _tiny(rng, index):
+    size = ((64, 48), (200, 150), (320, 320), (500, 80))[index % 4]
+    if index % 2:
+        return 'jpg', _encoded(photo(rng, size), 'JPEG', quality=90)
+    return 'png', _encoded(graphic(rng, size, shapes=10), 'PNG')
+
+
+# name -> (generator, file count)
+CORPORA = {
+    'noisy': (_noisy, 4),
+    'flat': (_flat, 4),
+    'alpha': (_alpha, 3),
+    'panorama': (_panorama, 1),
+    'tiny': (_tiny, 8),
+}
+
+
+def generate(name, directory, seed=SEED):
+    """Write corpus name into directory, reusing files from an earlier run."""
+    generator, count = CORPORA[name]
+    paths = []
+    for index in range(count):
+        # One generator per file, so each file is independent of the others
+        rng = random.Random(f'{seed}/{name}/{index}')
+        stem = os.path.join(directory, f'{name}-{seed}-{index}')
+        existing = [stem + ext for ext in ('.png', '.jpg') if os.path.exists(stem + ext)]
+        if existing:
+            paths.append(existing[0])
+            continue
+        ext, data = generator(rng, index)
+        with open(f'{stem}.{ext}', 'wb') as f:
+            f.write(data)
+        paths.append(f'{stem}.{ext}')
+    return paths
+
+
+def _peak_rss_mb():
+    # ru_maxrss survives fork and exec, so on Linux it would include the
+    # parent's corpus generation; VmHWM belongs to this process alone
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def measure(pipeline, paths, repeat):
+    """Run pipeline over paths repeat times; runs in its own process."""
+    func, args = PIPELINES[pipeline]
+    func(paths[0], *args)  # warm-up: imports, codec setup
+    latencies = []
+    attempts = output_bytes = fits = 0
+    stages = {}
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for path in paths:
+            start = time.perf_counter()
+            output_data, report = func(path, *args)
+            latencies.append(time.perf_counter() - start)
+            attempts += report['attempts']
+            output_bytes += len(output_data)
+            fits += report['fits']
+            for name, durations in report['timings'].items():
+                stages[name] = stages.get(name, 0) + sum(durations)
+    elapsed = time.perf_counter() - started
+    runs = len(latencies)
+    return {
+        'files': len(paths),
+        'runs': runs,
+        'throughput_per_s': round(runs / elapsed, 3),
+        'mean_ms': round(sum(latencies) / runs * 1000, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'peak_rss_mb': _peak_rss_mb(),
+        'attempts_mean': round(attempts / runs, 2),
+        'output_bytes_mean': round(output_bytes / runs),
+        'fits': f'{fits // repeat}/{len(paths)}',
+        'stage_ms': {name: round(total / runs * 1000, 1) for name, total in sorted(stages.items())},
+    }
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(pipelines, corpora, repeat, seed):
+    results = {}
+    # spawn, so each child starts without the parent's corpus in memory
+    context = multiprocessing.get_context('spawn')
+    for corpus, paths in corpora.items():
+        for pipeline in pipelines:
+            with context.Pool(1) as pool:
+                row = pool.apply(measure, (pipeline, paths, repeat))
+            results.setdefault(pipeline, {})[corpus] = row
+            print(f"{pipeline:<14} {corpus:<9} {row['throughput_per_s']:8.2f}/s {row['p50_ms']:9.1f} "
+                  f"{row['p95_ms']:9.1f} {row['peak_rss_mb']:8.1f} {row['attempts_mean']:8.2f} "
+                  f"{row['output_bytes_mean']:10} {row['fits']:>6}", flush=True)
+    return {
+        'meta': {
+            'commit': _commit(),
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'pipeline_version': PIPELINE_VERSION,
+            'cpus': os.cpu_count(),
+            'seed': seed,
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def compare(base, head):
+    """Print head against base, relative change for each shared pair."""
+    print(f"base {base['meta'].get('commit')}  head {head['meta'].get('commit')}")
+    columns = ('throughput_per_s', 'p50_ms', 'p95_ms', 'peak_rss_mb', 'attempts_mean', 'output_bytes_mean')
+    print(f"{'pipeline':<14} {'corpus':<9} " + ' '.join(f'{column:>18}' for column in columns))
+    for pipeline, rows in head['results'].items():
+        for corpus, row in rows.items():
+            old = base['results'].get(pipeline, {}).get(corpus)
+            if old is None:
+                continue
+            cells = []
+            for column in columns:
+                before, after = old[column], row[column]
+                change = (after - before) / before * 100 if before else 0.0
+                cells.append(f'{after:>10} {change:+6.1f}%')
+            print(f'{pipeline:<14} {corpus:<9} ' + ' '.join(cells))
+
+
+def _names(value, known):
+    names = [name for name in value.split(',') if name]
+    unknown = [name for name in names if name not in known]
+    if unknown:
+        raise argparse.ArgumentTypeError(f'unknown: {", ".join(unknown)} (choose from {", ".join(known)})')
+    return names
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pipelines', type=lambda value: _names(value, PIPELINES), default=list(PIPELINES),
+                        help='comma-separated pipelines (default: all)')
+    parser.add_argument('--corpora', type=lambda value: _names(value, CORPORA), default=list(CORPORA),
+                        help='comma-separated synthetic corpora (default: all)')
+    parser.add_argument('--photos', help='directory of real photos to add as the "photos" corpus')
+    parser.add_argument('--repeat', type=int, default=1, help='passes over each corpus')
+    parser.add_argument('--seed', type=int, default=SEED, help='corpus seed')
+    parser.add_argument('--corpus-dir', help='keep generated corpora here and reuse them (default: temporary)')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'HEAD'), help='compare two JSON results and exit')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as base, open(args.compare[1]) as head:
+            compare(json.load(base), json.load(head))
+        return 0
+
+    with tempfile.TemporaryDirectory() as temporary:
+        directory = args.corpus_dir or temporary
+        os.makedirs(directory, exist_ok=True)
+        corpora = {name: generate(name, directory, args.seed) for name in args.corpora}
+        if args.photos:
+            corpora['photos'] = sorted(path for path in _walk([args.photos])
+                                       if path.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')))
+            if not corpora['photos']:
+                print(f'no photos found in {args.photos}')
+                return 1
+
+        print(f"{'pipeline':<14} {'corpus':<9} {'throughput':>10} {'p50 ms':>9} {'p95 ms':>9} "
+              f"{'RSS MB':>8} {'encodes':>8} {'bytes':>10} {'fit':>6}")
+        results = run(args.pipelines, corpora, args.repeat, args.seed)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
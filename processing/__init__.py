@@ -0,0 +1,3 @@
+"""
+Shared image processing code used by the Flask app and the Vercel handlers.
+"""
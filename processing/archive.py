@@ -0,0 +1,68 @@
+"""
+ZIP archives for batch results.
+
+Archives are written as a stream: each entry is emitted as soon as its
+file is processed, so responses start early and memory stays flat with
+batch size. Entries are STORED because PNG (and the other outputs) are
+already compressed; deflating them again costs CPU for almost nothing.
+
+Clients opt into a binary response with the form field response=zip or an
+Accept header that prefers application/zip. The archive then ends with a
+manifest.json entry carrying the same fields as the JSON response minus
+the image data.
+"""
+import io
+import json
+import zipfile
+
+ZIP_MIMETYPE = 'application/zip'
+MANIFEST_NAME = 'manifest.json'
+
+
+def wants_zip(form, accept=None):
+    """True if the request asked for a binary ZIP response."""
+    if form.get('response') == 'zip':
+        return True
+    return bool(accept) and accept.split(',')[0].strip().startswith(ZIP_MIMETYPE)
+
+
+class _Sink(io.RawIOBase):
+    """Unseekable file object that hands back whatever was written to it."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(files, manifest=None):
+    """
+    Yield a ZIP archive chunk by chunk from (name, bytes) pairs, one chunk
+    per entry as the pairs arrive. manifest, if given, is called once the
+    files are exhausted and its result is added as manifest.json.
+    """
+    sink = _Sink()
+    # zipfile falls back to data descriptors when it cannot seek
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as zipf:
+        for name, data in files:
+            zipf.writestr(name, data)
+            yield sink.take()
+        if manifest is not None:
+            zipf.writestr(MANIFEST_NAME, json.dumps(manifest()))
+    yield sink.take()
+
+
+def build_zip(files, manifest=None):
+    """Build a whole ZIP in memory; see stream_zip."""
+    return b''.join(stream_zip(files, (lambda: manifest) if manifest is not None else None))
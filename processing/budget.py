@@ -0,0 +1,413 @@
+"""
+Fit-to-byte-budget engine.
+
+Instead of walking the scale down in fixed 0.05 steps and re-encoding every
+rung, the engine measures the encoded size at a few points and interpolates
+on observed bytes-vs-area to jump close to the largest scale that fits.
+Every encode counts as an attempt and the total is capped. A cheap size
+predictor lets the engine skip rungs that are clearly over budget, and
+the search itself runs on fast trial encodes (see processing.encode).
+"""
+import math
+
+from PIL import Image
+
+from .encode import DEFAULT_STRATEGY, FORMATS, TRIAL_STRATEGY, encode_lossy, encode_png, strategy_ratio
+from .metrics import stage
+from .predict import estimate_png_size, likely_fits, likely_too_big
+from .quantize import Quantizer
+
+MAX_ENCODE_ATTEMPTS = 8
+SCALE_TOLERANCE = 0.02
+# Aim slightly under the budget so the interpolated guess usually fits
+TARGET_FILL = 0.97
+FALLBACK_PALETTES = (128, 64, 32)
+# Lossy formats: lowest quality tried before shrinking, and when to stop bisecting
+MIN_QUALITY = 40
+QUALITY_TOLERANCE = 2
+
+
+def scaled(image, scale):
+    width, height = image.size
+    new_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    if new_size == image.size:
+        return image
+    with stage('resample'):
+        return image.resize(new_size, Image.Resampling.LANCZOS)
+
+
+def _quality(candidate):
+    """Sort key preferring larger scales, then full colour, then larger palettes."""
+    return (candidate.scale, candidate.colors is None, candidate.colors or 0)
+
+
+def _predict(predictor, image):
+    if predictor is None:
+        return None
+    with stage('predict'):
+        return predictor(image)
+
+
+class _Candidate:
+    """One encode: its output, the estimated size under the final strategy and what produced it."""
+
+    def __init__(self, output, estimate, scale, colors, image, kind):
+        self.output = output
+        self.estimate = estimate
+        self.scale = scale
+        self.colors = colors
+        # Kept only while output is a trial encode that confirm() may redo
+        self.image = image
+        self.kind = kind
+
+    @property
+    def final(self):
+        return self.image is None
+
+    @property
+    def size(self):
+        return len(self.output.getvalue())
+
+
+class _Search:
+    """
+    Bookkeeping for one fit: counts encodes and remembers the candidates.
+
+    Trial encodes use trial_strategy and their sizes are scaled by a ratio
+    measured per kind of candidate to estimate the size under strategy.
+    confirm() encodes the best candidate with strategy; a final encode
+    that misses the budget is a real measurement, so the search treats it
+    like any other oversized observation and corrects the ratio. Trial
+    encodes leave one attempt for the final encode, so the total never
+    exceeds max_attempts.
+    """
+
+    def __init__(self, max_size, max_attempts, encode, strategy, trial_strategy):
+        self.max_size = max_size
+        self.max_attempts = max_attempts
+        self.encode = encode
+        self.strategy = strategy
+        self.trial_strategy = trial_strategy
+        self.attempts = 0
+        self.candidates = []
+        # The candidate whose final encode last missed the budget
+        self.missed = None
+        self._ratios = {}
+        self._reserved = 0 if trial_strategy == strategy else 1
+
+    @property
+    def exhausted(self):
+        return self.attempts >= self.max_attempts - self._reserved
+
+    @property
+    def fitting(self):
+        return [candidate for candidate in self.candidates if candidate.estimate <= self.max_size]
+
+    @property
+    def best(self):
+        fitting = self.fitting
+        return max(fitting, key=_quality) if fitting else None
+
+    def try_encode(self, image, scale, colors, final=False):
+        """
+        Trial-encode image and return its estimated final size, or with
+        final=True encode it with the final strategy straight away.
+        """
+        # Scaled candidates are mapped onto the full-size palette rather
+        # than quantized for it, so they compress differently
+        kind = (colors, scale == 1.0)
+        if final or self.trial_strategy == self.strategy:
+            strategy, ratio = self.strategy, 1.0
+        else:
+            if kind not in self._ratios:
+                with stage('predict'):
+                    self._ratios[kind] = strategy_ratio(image, self.trial_strategy, self.strategy, self.encode)
+            strategy, ratio = self.trial_strategy, self._ratios[kind]
+        self.attempts += 1
+        with stage('encode'):
+            output = self.encode(image, strategy)
+        final = strategy == self.strategy
+        candidate = _Candidate(output, int(len(output.getvalue()) * ratio), scale, colors,
+                               None if final else image, kind)
+        self.candidates.append(candidate)
+        return candidate.estimate
+
+    def confirm(self):
+        """
+        Make sure the best fitting candidate really fits, encoding it with
+        the final strategy if needed. Returns False when nothing fits, when
+        no attempt is left, or when the final encode missed; then missed is
+        that candidate, now counted as oversized.
+        """
+        self.missed = None
+        best = self.best
+        if best is None:
+            return False
+        if best.final:
+            return True
+        if self.attempts >= self.max_attempts:
+            return False
+        trial_size = best.size
+        self.attempts += 1
+        with stage('encode'):
+            best.output = self.encode(best.image, self.strategy)
+        best.image = None
+        best.estimate = best.size
+        # Correct the estimates of the other trials of the same kind
+        self._ratios[best.kind] = best.size / trial_size
+        for candidate in self.candidates:
+            if candidate.kind == best.kind and not candidate.final:
+                candidate.estimate = int(candidate.size * self._ratios[best.kind])
+        if best.estimate <= self.max_size:
+            return True
+        self.missed = best
+        return False
+
+    def settle(self):
+        """confirm() the best candidate, moving on to the next best after each miss."""
+        while not self.confirm():
+            if self.missed is None:
+                return False
+        return True
+
+    def result(self):
+        if self.settle():
+            chosen = self.best
+        else:
+            # Nothing confirmed within the cap: a trial output within budget
+            # is still a valid result, just less compressed; else the smallest
+            within = [candidate for candidate in self.candidates if candidate.size <= self.max_size]
+            if within:
+                chosen = max(within, key=_quality)
+            else:
+                chosen = min(self.candidates, key=lambda candidate: candidate.size)
+                if not chosen.final and self.attempts < self.max_attempts:
+                    # Nothing fits; the final strategy at least makes it smaller
+                    self.attempts += 1
+                    with stage('encode'):
+                        output = self.encode(chosen.image, self.strategy)
+                    if len(output.getvalue()) < chosen.size:
+                        chosen.output = output
+        output = chosen.output
+        output.seek(0)
+        return output, {
+            'attempts': self.attempts,
+            'size': chosen.size,
+            'scale': round(chosen.scale, 4),
+            'colors': chosen.colors,
+            'fits': chosen.size <= self.max_size,
+            'strategy': self.strategy,
+        }
+
+
+def _next_scale(low, high, target, min_scale):
+    """
+    Pick the next scale to try given the largest fitting observation (low)
+    and the smallest oversized one (high), both (scale, bytes) pairs.
+    """
+    high_scale, high_bytes = high
+    if low is None:
+        # Encoded size grows roughly with pixel area
+        guess = high_scale * math.sqrt(target / high_bytes)
+        return max(min_scale, min(guess, high_scale - SCALE_TOLERANCE))
+
+    low_scale, low_bytes = low
+    guess = None
+    if low_bytes > 0 and high_bytes > low_bytes:
+        # Secant step on log(bytes) vs log(scale)
+        exponent = math.log(high_bytes / low_bytes) / math.log(high_scale / low_scale)
+        guess = low_scale * (target / low_bytes) ** (1 / exponent)
+    if guess is None or not low_scale < guess < high_scale:
+        guess = (low_scale + high_scale) / 2
+    # Keep the bracket shrinking even when the model overshoots
+    margin = (high_scale - low_scale) / 4
+    return min(max(guess, low_scale + margin), high_scale - margin)
+
+
+def fit_to_budget(image, max_size, min_scale=0.5, max_attempts=MAX_ENCODE_ATTEMPTS,
+                  encode=encode_png, palettes=FALLBACK_PALETTES, predictor=estimate_png_size,
+                  strategy=DEFAULT_STRATEGY, trial_strategy=TRIAL_STRATEGY, quantizer=Quantizer):
+    """
+    Encode image so that it fits in max_size bytes using as few encodes as possible.
+
+    Tries the image as is, then a 256-colour palette, then searches the scale
+    between min_scale and 1.0, and finally smaller palettes at min_scale.
+    Returns (BytesIO, report) where report records the number of encode
+    attempts and the chosen scale/palette. If nothing fits within the attempt
+    cap, the smallest output seen is returned.
+
+    predictor, if given, estimates the encoded size of an image; the full
+    size rungs are skipped when the estimate is well over max_size, and the
+    estimate seeds the scale search instead. Pass None to always encode.
+
+    encode(image, strategy) produces the output. The search runs on cheap
+    trial_strategy encodes and only the result is encoded with strategy.
+    The final encode counts within max_attempts, and one that misses the
+    budget sends the search back to smaller scales or palettes.
+
+    quantizer(image) returns a Quantizer (see processing.quantize); palette
+    candidates are written as indexed PNGs. The 256-colour palette of the
+    full-size image is computed once and reused for scaled candidates and
+    smaller palettes.
+    """
+    search = _Search(max_size, max_attempts, encode, strategy, trial_strategy)
+
+    predicted = _predict(predictor, image)
+    if predicted is None or not likely_too_big(predicted, max_size):
+        # When the image is comfortably within budget a trial encode would
+        # only be thrown away, so go straight to the final strategy
+        final = predicted is not None and likely_fits(predicted, max_size)
+        size = search.try_encode(image, 1.0, None, final=final)
+        if size <= max_size and search.confirm():
+            return search.result()
+
+    palettes_for = quantizer(image)
+    indexed = palettes_for.quantize(256)
+    predicted = _predict(predictor, indexed)
+    if predicted is not None and likely_too_big(predicted, max_size):
+        size = predicted
+    else:
+        size = search.try_encode(indexed, 1.0, 256)
+        if size <= max_size and search.confirm() or search.exhausted:
+            return search.result()
+        if search.missed is not None:
+            size = search.missed.estimate
+
+    # Bracket the largest fitting scale between low (fits) and high (too big).
+    # high may start from a prediction rather than a real encode.
+    target = max_size * TARGET_FILL
+    low, high = None, (1.0, size)
+    while not search.exhausted:
+        if low is not None and high[0] - low[0] <= SCALE_TOLERANCE:
+            if search.confirm() or search.missed is None:
+                break
+            # The final encode of low missed: it is the new upper bound, and
+            # the corrected estimates decide what still fits below it
+            high = (search.missed.scale, search.missed.estimate)
+            fitting = [candidate for candidate in search.fitting if candidate.colors == 256]
+            low = None
+            if fitting:
+                best = max(fitting, key=_quality)
+                low = (best.scale, best.estimate)
+            if low is None and high[0] <= min_scale:
+                break
+            continue
+        scale = _next_scale(low, high, target, min_scale)
+        size = search.try_encode(palettes_for.quantize(256, scaled(image, scale)), scale, 256)
+        if size <= max_size:
+            low = (scale, size)
+        else:
+            high = (scale, size)
+            if scale <= min_scale:
+                break
+
+    if search.settle() or search.exhausted:
+        return search.result()
+
+    # Even min_scale is too big: bisect the palette sizes at min_scale,
+    # looking for the largest palette that fits
+    image = scaled(image, min_scale)
+    candidates = list(palettes)
+    while not search.exhausted:
+        if not candidates:
+            if search.confirm() or search.missed is None:
+                break
+            # The final encode missed: carry on with the smaller palettes
+            tried = {candidate.colors for candidate in search.candidates if candidate.scale == min_scale}
+            candidates = [colors for colors in palettes
+                          if colors < search.missed.colors and colors not in tried]
+            continue
+        middle = len(candidates) // 2
+        colors = candidates[middle]
+        size = search.try_encode(palettes_for.quantize(colors, image), min_scale, colors)
+        if size <= max_size:
+            candidates = candidates[:middle]
+        else:
+            candidates = candidates[middle + 1:]
+
+    return search.result()
+
+
+def _next_quality(low, high, target):
+    """
+    Like _next_scale, for (quality, bytes) pairs. Encoded size grows
+    roughly exponentially with quality, so the secant runs on log(bytes).
+    """
+    low_quality, low_bytes = low
+    high_quality, high_bytes = high
+    guess = None
+    if low_bytes > 0 and high_bytes > low_bytes:
+        slope = math.log(high_bytes / low_bytes) / (high_quality - low_quality)
+        guess = low_quality + math.log(target / low_bytes) / slope
+    if guess is None or not low_quality < guess < high_quality:
+        guess = (low_quality + high_quality) / 2
+    margin = (high_quality - low_quality) / 4
+    return round(min(max(guess, low_quality + margin), high_quality - margin))
+
+
+def fit_quality_to_budget(image, max_size, output_format, min_scale=0.5, max_attempts=MAX_ENCODE_ATTEMPTS,
+                          min_quality=MIN_QUALITY, encode=encode_lossy):
+    """
+    Lossy counterpart of fit_to_budget for JPEG, WebP and AVIF.
+
+    Tries the format's default quality, then min_quality, and searches the
+    highest quality between them that fits. Only if min_quality is still
+    too big does it search the scale, at min_quality. Returns (BytesIO,
+    report) like fit_to_budget, with the chosen quality in the report.
+    """
+    tried = []
+
+    def attempt(candidate_image, scale, quality):
+        with stage('encode'):
+            output = encode(candidate_image, output_format, quality)
+        size = len(output.getvalue())
+        tried.append((output, size, scale, quality))
+        return size
+
+    def result():
+        fitting = [candidate for candidate in tried if candidate[1] <= max_size]
+        if fitting:
+            output, size, scale, quality = max(fitting, key=lambda c: (c[2], c[3]))
+        else:
+            output, size, scale, quality = min(tried, key=lambda c: c[1])
+        output.seek(0)
+        return output, {
+            'attempts': len(tried),
+            'size': size,
+            'scale': round(scale, 4),
+            'quality': quality,
+            'fits': size <= max_size,
+            'format': output_format,
+        }
+
+    target = max_size * TARGET_FILL
+    high = (FORMATS[output_format][3], attempt(image, 1.0, FORMATS[output_format][3]))
+    if high[1] <= max_size:
+        return result()
+
+    low = (min_quality, attempt(image, 1.0, min_quality))
+    if low[1] <= max_size:
+        # Stop once the bracket is narrow or the fitting side nearly fills the budget
+        while len(tried) < max_attempts and high[0] - low[0] > QUALITY_TOLERANCE and low[1] < target:
+            quality = _next_quality(low, high, target)
+            size = attempt(image, 1.0, quality)
+            if size <= max_size:
+                low = (quality, size)
+            else:
+                high = (quality, size)
+        return result()
+
+    # Even min_quality is too big at full size: search the scale instead
+    low, high = None, (1.0, low[1])
+    while len(tried) < max_attempts:
+        if low is not None and high[0] - low[0] <= SCALE_TOLERANCE:
+            break
+        scale = _next_scale(low, high, target, min_scale)
+        size = attempt(scaled(image, scale), scale, min_quality)
+        if size <= max_size:
+            low = (scale, size)
+        else:
+            high = (scale, size)
+            if scale <= min_scale:
+                break
+    return result()
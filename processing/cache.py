@@ -0,0 +1,145 @@
+"""
+Content-addressed result cache.
+
+Results are keyed by the SHA-256 of the upload plus every parameter that
+affects the output (crop, target size, byte budget, pipeline version,
+background colour), so re-submitting an unchanged photo skips decode and
+encode entirely. Entries live on local disk as <key>.bin, whatever the
+output format, with a <key>.json sidecar holding the budget report; the
+directory is kept under max_bytes by evicting the least recently used
+entries (file mtime is bumped on every hit).
+
+Several worker processes may share one directory: writes go through a
+temporary file and os.replace, and eviction tolerates files vanishing. A
+ResultCache pickles without its counters, so it can be passed to pool
+workers as a job argument; counting and eviction stay with the parent's
+instance. The parent keeps running totals of entries and bytes, seeded by
+one directory scan, and only scans again when the totals pass max_bytes.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from .stages import BACKGROUND
+
+# Bump whenever a change alters the output for the same inputs
+PIPELINE_VERSION = 5
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def normalize_crop(crop_data):
+    """Round crop coordinates so equivalent crops share a key."""
+    if not crop_data:
+        return None
+    return {name: round(float(crop_data[name]), 1) for name in ('x', 'y', 'width', 'height')}
+
+
+def cache_key(image_data, **params):
+    """Key for image_data processed with params (all JSON-serializable)."""
+    digest = hashlib.sha256(image_data).hexdigest()
+    described = json.dumps([digest, PIPELINE_VERSION, BACKGROUND, params], sort_keys=True)
+    return hashlib.sha256(described.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Size-bounded LRU of encoded results on local disk."""
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, suffix='.bin'):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._count(self._entries())
+
+    def __getstate__(self):
+        return {'directory': self.directory, 'max_bytes': self.max_bytes, 'suffix': self.suffix}
+
+    def __setstate__(self, state):
+        # Workers only get and put, so they skip the scan __init__ does
+        self.__dict__.update(state, hits=0, misses=0, entries=0, bytes=0, _lock=threading.Lock())
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        """Return (data, report) for key, or None."""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            with open(os.path.join(self.directory, key + '.json')) as f:
+                report = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return data, report
+
+    def put(self, key, data, report):
+        self._write(key + '.json', json.dumps(report).encode('utf-8'))
+        self._write(key + self.suffix, data)
+
+    def record(self, hit, nbytes=0):
+        """
+        Count a lookup, which may have happened in a worker process. A miss
+        stored a new entry of nbytes; once the totals pass max_bytes the
+        least recently used entries are evicted.
+        """
+        with self._lock:
+            if hit:
+                self.hits += 1
+                return
+            self.misses += 1
+            self.entries += 1
+            self.bytes += nbytes
+            if self.bytes > self.max_bytes:
+                self._evict()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': self.entries, 'bytes': self.bytes}
+
+    def _count(self, entries):
+        self.entries = len(entries)
+        self.bytes = sum(size for _, size, _ in entries)
+
+    def _write(self, name, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, os.path.join(self.directory, name))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _entries(self):
+        """(mtime, size, key) for every cached result."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name[:-len(self.suffix)]))
+        return entries
+
+    def _evict(self):
+        """Drop the oldest entries until under max_bytes, and resync the totals."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        while entries and total > self.max_bytes:
+            _, size, key = entries.pop(0)
+            for name in (key + self.suffix, key + '.json'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+            total -= size
+        self._count(entries)
@@ -0,0 +1,253 @@
+"""
+Command-line batch mode: resize or optimize a directory tree without the
+web server, e.g.
+
+    python -m processing resize photos/ -o resized/ --format jpeg --workers 4
+    python -m processing optimize photos/ -o small/ --max-size 2
+    python -m processing watch incoming/ -o output/
+
+
+Files are processed on the shared process pool (processing.pool) straight
+from disk and written as they finish, mirroring the input tree. An index
+in the output directory (INDEX_NAME) records what produced each output,
+so a re-run skips sources whose output is newer than the source or whose
+content hash and settings are unchanged. The watch command keeps running
+and processes files as they appear (see processing.watch).
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from . import pool
+from .cache import cache_key
+from .encode import DEFAULT_STRATEGY, FORMATS, STRATEGIES
+from .pipeline import (CROP_MODES, MAX_SIZE, TARGET_SIZE, allowed_file, optimized_name, output_name,
+                       process_optimize_file, process_resize_file)
+from .presets import load_presets, parse_size
+
+INDEX_NAME = '.resizer-index.json'
+# Save the index every this many written files, so an interrupted run keeps its progress
+INDEX_SAVE_EVERY = 50
+# The web app's OUTPUT_FOLDER
+WATCH_OUTPUT = 'output'
+
+
+def walk(root, skip=None):
+    """Yield the relative path of every image under root, in sorted order."""
+    for directory, names, files in os.walk(root):
+        names[:] = sorted(name for name in names
+                          if skip is None or os.path.abspath(os.path.join(directory, name)) != skip)
+        for name in sorted(files):
+            if allowed_file(name):
+                yield os.path.relpath(os.path.join(directory, name), root)
+
+
+def target_name(relative, args):
+    """Output path, relative to the output directory, for a source path."""
+    directory, filename = os.path.split(relative)
+    if args.command != 'optimize':
+        name = output_name(filename, args.size, args.format)
+    else:
+        name = optimized_name(filename, args.format)
+    return os.path.join(directory, name)
+
+
+def settings(args):
+    # watch resizes, and shares its index entries with resize
+    mode = 'optimize' if args.command == 'optimize' else 'resize'
+    params = {'mode': mode, 'format': args.format, 'strategy': args.strategy,
+              'max_size': args.max_size}
+    if mode == 'resize':
+        params['target_size'] = list(args.size)
+        if args.crop != 'center':
+            params['crop'] = args.crop
+    return params
+
+
+def load_index(output_dir):
+    try:
+        with open(os.path.join(output_dir, INDEX_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_index(output_dir, index):
+    write_file(os.path.join(output_dir, INDEX_NAME), json.dumps(index, indent=1, sort_keys=True).encode('utf-8'))
+
+
+def write_file(path, data):
+    """Write data to path atomically, so a crash never leaves half a file."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def up_to_date(source, output, entry, params, force):
+    """
+    (skip, key): skip is True when output already holds this source with
+    these settings. key is the source's cache key when it had to be hashed.
+    """
+    if force or entry is None or entry.get('settings') != params or not os.path.exists(output):
+        return False, None
+    if os.path.getmtime(output) >= os.path.getmtime(source):
+        return True, None
+    # Touched but maybe unchanged (copied folders, restored backups)
+    with open(source, 'rb') as f:
+        key = cache_key(f.read(), **params)
+    return key == entry.get('key'), key
+
+
+def plan(args, index, params, relatives=None):
+    """
+    Split relatives (default: the whole tree) into (relative, source,
+    output) work, the number of up-to-date files and the number of name
+    clashes.
+    """
+    work = []
+    skipped = clashes = 0
+    claimed = {}
+    output_dir = os.path.abspath(args.output)
+    if relatives is None:
+        relatives = walk(args.input, skip=output_dir)
+    for relative in relatives:
+        source = os.path.join(args.input, relative)
+        target = target_name(relative, args)
+        if target in claimed:
+            print(f'error {relative}: same output name as {claimed[target]}', file=sys.stderr)
+            clashes += 1
+            continue
+        claimed[target] = relative
+        output = os.path.join(output_dir, target)
+        skip, key = up_to_date(source, output, index.get(relative), params, args.force)
+        if skip:
+            if key is not None:
+                # Hashed unchanged: next time the mtime check is enough
+                os.utime(output)
+            skipped += 1
+        else:
+            work.append((relative, source, output))
+    return work, skipped, clashes
+
+
+def jobs_for(work, args):
+    for _, source, _ in work:
+        if args.command != 'optimize':
+            yield source, None, args.size, args.max_size, None, args.format, args.strategy, args.crop
+        else:
+            yield source, args.max_size, None, args.format, args.strategy
+
+
+def process(work, args, index, params):
+    """Process work from plan(), writing outputs as they finish. Returns (done, errors, bytes in, bytes out)."""
+    output_dir = os.path.abspath(args.output)
+    func = process_optimize_file if args.command == 'optimize' else process_resize_file
+    done = errors = bytes_in = bytes_out = 0
+    try:
+        for (relative, source, output), (result, error) in zip(work, pool.run_batch(func, jobs_for(work, args))):
+            if error is not None:
+                errors += 1
+                print(f'error {relative}: {error}', file=sys.stderr)
+                continue
+            output_data, report = result
+            write_file(output, output_data)
+            with open(source, 'rb') as f:
+                key = cache_key(f.read(), **params)
+            index[relative] = {'key': key, 'output': os.path.relpath(output, output_dir), 'settings': params}
+            done += 1
+            bytes_in += os.path.getsize(source)
+            bytes_out += len(output_data)
+            if not args.quiet:
+                fits = '' if report['fits'] else ' (over budget)'
+                print(f"{relative} -> {index[relative]['output']} {len(output_data) / 1024:.0f} KB, "
+                      f"{report['attempts']} encodes{fits}")
+            if done % INDEX_SAVE_EVERY == 0:
+                save_index(output_dir, index)
+    finally:
+        if done:
+            save_index(output_dir, index)
+    return done, errors, bytes_in, bytes_out
+
+
+def run(args):
+    params = settings(args)
+    index = load_index(os.path.abspath(args.output))
+    work, skipped, clashes = plan(args, index, params)
+
+    started = time.perf_counter()
+    done, errors, bytes_in, bytes_out = process(work, args, index, params)
+    errors += clashes
+    elapsed = time.perf_counter() - started
+    rate = done / elapsed if elapsed else 0.0
+    print(f'{done} processed, {skipped} up to date, {errors} failed in {elapsed:.1f}s '
+          f'({rate:.2f} files/s, {bytes_in / (1024 * 1024):.1f} MB in, {bytes_out / (1024 * 1024):.1f} MB out, '
+          f'{pool.WORKERS} workers)')
+    return 1 if errors else 0
+
+
+def _size(value):
+    presets = load_presets()
+    if value.lower() in presets:
+        return presets[value.lower()]['size']
+    try:
+        return parse_size(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f'{e}, or a preset: {", ".join(presets)}')
+
+
+def _megabytes(value):
+    return int(float(value) * 1024 * 1024)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m processing',
+                                     description='Resize or optimize a directory of images.')
+    parser.add_argument('command', choices=('resize', 'optimize', 'watch'))
+    parser.add_argument('input', help='directory to process (walked recursively)')
+    parser.add_argument('-o', '--output', help=f'output directory; the input tree is mirrored here '
+                                                f'(watch default: {WATCH_OUTPUT})')
+    parser.add_argument('--format', choices=list(FORMATS) + ['jpg'], default='png', help='output format')
+    parser.add_argument('--size', type=_size, default=TARGET_SIZE,
+                        help='resize target, e.g. 1080x1350 or a preset name such as story')
+    parser.add_argument('--max-size', type=_megabytes, default=MAX_SIZE, help='byte budget per file in MB (default 5)')
+    parser.add_argument('--crop', choices=CROP_MODES, default='center',
+                        help='crop placement when resizing: center, or auto to follow the most salient region')
+    parser.add_argument('--strategy', choices=list(STRATEGIES), default=DEFAULT_STRATEGY, help='PNG compression')
+    parser.add_argument('--workers', type=int, help='worker processes (default: RESIZER_WORKERS or CPU count)')
+    parser.add_argument('--force', action='store_true', help='reprocess files even when up to date')
+    parser.add_argument('-q', '--quiet', action='store_true', help='only print errors and the summary')
+    watching = parser.add_argument_group('watch')
+    watching.add_argument('--poll', action='store_true', help='poll for changes even where inotify is available')
+    watching.add_argument('--interval', type=float, default=2.0, help='seconds between polls (default 2)')
+    watching.add_argument('--debounce', type=float, default=2.0,
+                          help='seconds a file must stay unchanged before it is processed (default 2)')
+    args = parser.parse_args(argv)
+
+    if args.format == 'jpg':
+        args.format = 'jpeg'
+    if not os.path.isdir(args.input):
+        parser.error(f'{args.input} is not a directory')
+    if args.output is None:
+        if args.command != 'watch':
+            parser.error('the following arguments are required: -o/--output')
+        args.output = WATCH_OUTPUT
+    if args.workers:
+        pool.configure(args.workers)
+    if args.command == 'watch':
+        from .watch import watch
+        return watch(args)
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
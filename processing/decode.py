@@ -0,0 +1,77 @@
+"""
+Decode stage: open an upload at the smallest size that still covers the
+crop at target resolution.
+
+JPEG decoders can scale by 1/2, 1/4 or 1/8 while decoding (Image.draft),
+so a 48 MP phone photo headed for 1080x1080 never gets decoded at full
+resolution. Other formats are decoded in full and box-reduced by an integer
+factor straight away, leaving enough headroom for the final LANCZOS pass.
+"""
+import io
+import math
+
+from PIL import Image
+
+# Keep at least this many times the target size before the final LANCZOS
+# resize when box-reducing, mirroring Pillow's reducing_gap
+REDUCING_GAP = 2.0
+REDUCIBLE_MODES = ('RGB', 'RGBA', 'L', 'LA')
+
+
+def required_scale(size, target_size, crop_data=None):
+    """
+    Smallest factor the full image can be scaled by while the crop region
+    still covers target_size. Values >= 1 mean no reduction is possible.
+    """
+    width, height = size
+    target_width, target_height = target_size
+    if crop_data:
+        crop_width = min(width, crop_data['width'])
+        crop_height = min(height, crop_data['height'])
+    else:
+        # Smart fill always keeps the full width or the full height
+        crop_width, crop_height = width, height
+    if crop_width <= 0 or crop_height <= 0:
+        return 1.0
+    return max(target_width / crop_width, target_height / crop_height)
+
+
+def scale_crop(crop_data, x_scale, y_scale):
+    """Map crop coordinates from the original image into a reduced one."""
+    if not crop_data or (x_scale == 1 and y_scale == 1):
+        return crop_data
+    return dict(
+        crop_data,
+        x=crop_data['x'] * x_scale,
+        y=crop_data['y'] * y_scale,
+        width=crop_data['width'] * x_scale,
+        height=crop_data['height'] * y_scale,
+    )
+
+
+def open_for_target(image_data, target_size, crop_data=None):
+    """
+    Open image_data for resizing to target_size.
+    Returns (image, crop_data) with crop_data mapped into the decoded image.
+    """
+    return open_for_targets(image_data, [target_size], crop_data)
+
+
+def open_for_targets(image_data, target_sizes, crop_data=None):
+    """Like open_for_target, decoded large enough for every size in target_sizes."""
+    image = Image.open(io.BytesIO(image_data))
+    full_width, full_height = image.size
+    scale = max(required_scale(image.size, target_size, crop_data) for target_size in target_sizes)
+    if scale >= 1:
+        return image, crop_data
+
+    if image.format == 'JPEG':
+        requested = (math.ceil(full_width * scale), math.ceil(full_height * scale))
+        image.draft(image.mode, requested)
+    elif image.mode in REDUCIBLE_MODES:
+        factor = int(1 / (scale * REDUCING_GAP))
+        if factor >= 2:
+            image = image.reduce(factor)
+
+    width, height = image.size
+    return image, scale_crop(crop_data, width / full_width, height / full_height)
@@ -0,0 +1,86 @@
+"""
+Output encoders.
+
+PNG output uses one of three strategies:
+
+    fast      zlib level 1; several times quicker than max, larger output
+    balanced  zlib level 6 (Pillow's default)
+    max       optimize=True, the slowest and usually the smallest
+
+The budget engine runs its trial encodes with the fast strategy and only
+re-encodes the accepted candidate with the requested one. Trial sizes are
+converted to the requested strategy with a ratio measured on a strip
+sample of the image (see predict.sample_strips), so the search still
+decides on the size the client will actually receive.
+
+The strategy for final encodes is set with RESIZER_PNG_STRATEGY (default
+max).
+
+JPEG, WebP and (when Pillow is built with it) AVIF are lossy: the budget
+engine searches their quality setting instead of palette size, starting
+from each format's default quality.
+"""
+import io
+import os
+
+from PIL import features
+
+from .predict import sample_strips
+
+STRATEGIES = {
+    'fast': {'compress_level': 1},
+    'balanced': {'compress_level': 6},
+    'max': {'optimize': True},
+}
+DEFAULT_STRATEGY = os.environ.get('RESIZER_PNG_STRATEGY', 'max')
+if DEFAULT_STRATEGY not in STRATEGIES:
+    raise ValueError(f'RESIZER_PNG_STRATEGY must be one of {", ".join(STRATEGIES)}')
+TRIAL_STRATEGY = 'fast'
+
+
+def encode_png(image, strategy=DEFAULT_STRATEGY):
+    output = io.BytesIO()
+    image.save(output, format='PNG', **STRATEGIES[strategy])
+    return output
+
+
+def strategy_ratio(image, trial, final, encode=encode_png):
+    """Estimate size(final) / size(trial) for image from a strip sample."""
+    if trial == final:
+        return 1.0
+    sample = sample_strips(image)
+    trial_size = len(encode(sample, trial).getvalue())
+    return len(encode(sample, final).getvalue()) / trial_size
+
+
+# name -> (Pillow format, file extension, MIME type, default quality or None)
+FORMATS = {
+    'png': ('PNG', 'png', 'image/png', None),
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg', 90),
+    'webp': ('WEBP', 'webp', 'image/webp', 85),
+}
+if features.check('avif'):
+    FORMATS['avif'] = ('AVIF', 'avif', 'image/avif', 75)
+DEFAULT_FORMAT = 'png'
+
+# Extra save options per lossy format; all of them are cheap
+_LOSSY_OPTIONS = {
+    'JPEG': {'optimize': True, 'progressive': True},
+    'WEBP': {'method': 4},
+    'AVIF': {},
+}
+
+
+def is_lossy(output_format):
+    return FORMATS[output_format][3] is not None
+
+
+def extension(output_format):
+    return FORMATS[output_format][1]
+
+
+def encode_lossy(image, output_format, quality):
+    pillow_format = FORMATS[output_format][0]
+    output = io.BytesIO()
+    image.save(output, format=pillow_format, quality=quality, **_LOSSY_OPTIONS[pillow_format])
+    return output
@@ -0,0 +1,32 @@
+"""
+Streamed progress for /resize.
+
+With the form field response=ndjson, or an Accept header that prefers
+application/x-ndjson, /resize answers with one JSON object per line as the
+batch is processed instead of a single response at the end:
+
+    {"event": "error", "filename": ..., "error": ...}    upload rejected or failed
+    {"event": "file", "processed_name": ..., "size": ..., "encode_attempts": ...,
+     "elapsed_ms": ..., "download_url": ...}               one file finished
+    {"event": "done", ...summary..., "zip_url": ...}      always last
+
+NDJSON rather than server-sent events because browsers can only open an
+EventSource with GET, while fetch() can POST the uploads and read the
+response body as it arrives.
+"""
+import json
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def wants_ndjson(form, accept=None):
+    """True if the request asked for a streamed NDJSON response."""
+    if form.get('response') == 'ndjson':
+        return True
+    return bool(accept) and accept.split(',')[0].strip().startswith(NDJSON_MIMETYPE)
+
+
+def ndjson_lines(events):
+    """Serialize event dicts one per line, flushing each as it is produced."""
+    for event in events:
+        yield json.dumps(event) + '\n'
@@ -0,0 +1,174 @@
+"""
+Memory governor: admit work only while its estimated working set fits a
+budget, so concurrent batches queue instead of exhausting memory.
+
+A /resize request holds its in-memory uploads, a decoded frame and its
+working copies per file in flight, and, in JSON mode, every output plus
+the ZIP and its base64 copy. working_set() estimates that from the header
+dimensions read at ingest, before anything is decoded, and the request
+reserves it from GOVERNOR; /optimize does the same with each upload at
+its own size, and /autocrop for the decode its saliency map needs. A
+request that does not fit waits up to RESIZER_ADMISSION_WAIT seconds for
+earlier work to finish and is then refused (app.py answers 503 with
+Retry-After); background jobs wait as long as it takes. Waiters are admitted in arrival order, and a
+reservation larger than the whole budget is capped to it, so an oversized
+batch runs alone rather than never.
+
+    RESIZER_MEMORY_BUDGET   budget in MB (default: half the physical memory)
+    RESIZER_ADMISSION_WAIT  seconds a request may queue (default 10)
+
+The reserved and waiting totals are exported at /metrics.
+"""
+import collections
+import math
+import os
+import threading
+import time
+
+from . import metrics, pool
+from .decode import required_scale
+
+BYTES_PER_PIXEL = 4
+# Decoded frame plus the reduced or cropped copy made from it
+DECODE_COPIES = 2
+# Per rendition: resampled, flattened, quantized or scaled trial, encoder buffer
+RENDITION_COPIES = 4
+# Held outputs in JSON mode: the images, the ZIP and its base64 text
+JSON_OUTPUT_COPIES = 1 + 1 + 4 / 3
+DEFAULT_BUDGET = 1024 * 1024 * 1024
+ADMISSION_WAIT = float(os.environ.get('RESIZER_ADMISSION_WAIT', 10))
+RETRY_AFTER = 5
+
+
+def _default_budget():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2
+    except (ValueError, OSError, AttributeError):
+        return DEFAULT_BUDGET
+
+
+class Busy(Exception):
+    """No room in the budget within the allowed wait."""
+
+    def __init__(self, retry_after=RETRY_AFTER):
+        super().__init__('Server is busy with other uploads, try again shortly')
+        self.retry_after = retry_after
+
+
+class Reservation:
+    """Bytes held against the budget until release(), which may be called more than once."""
+
+    def __init__(self, governor, nbytes):
+        self.governor = governor
+        self.nbytes = nbytes
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.governor._release(self.nbytes)
+
+
+class MemoryGovernor:
+    """A counting semaphore over bytes, admitting waiters first come, first served."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.reserved = 0
+        self._waiting = collections.deque()
+        self._condition = threading.Condition()
+        metrics.MEMORY_BUDGET.set(budget)
+        metrics.MEMORY_RESERVED.set(0)
+        metrics.MEMORY_WAITING.set(0)
+
+    def reserve(self, nbytes, timeout=None):
+        """
+        Reserve nbytes (capped to the budget), waiting up to timeout
+        seconds, or indefinitely when timeout is None. Raises Busy when the
+        wait runs out.
+        """
+        nbytes = min(int(nbytes), self.budget)
+        if nbytes <= 0:
+            # Nothing to decode (every upload was rejected at ingest)
+            return Reservation(self, 0)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        ticket = object()
+        with metrics.stage('admission'), self._condition:
+            self._waiting.append(ticket)
+            try:
+                while self._waiting[0] is not ticket or self.reserved + nbytes > self.budget:
+                    metrics.MEMORY_WAITING.set(len(self._waiting))
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        metrics.ADMISSIONS.inc(outcome='rejected')
+                        raise Busy()
+                    self._condition.wait(remaining)
+                self.reserved += nbytes
+            finally:
+                self._waiting.remove(ticket)
+                metrics.MEMORY_WAITING.set(len(self._waiting))
+                # The next in line may fit now
+                self._condition.notify_all()
+            metrics.ADMISSIONS.inc(outcome='admitted')
+            metrics.MEMORY_RESERVED.set(self.reserved)
+        return Reservation(self, nbytes)
+
+    def _release(self, nbytes):
+        with self._condition:
+            self.reserved -= nbytes
+            metrics.MEMORY_RESERVED.set(self.reserved)
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {'budget': self.budget, 'reserved': self.reserved, 'waiting': len(self._waiting)}
+
+
+def decoded_pixels(size, image_format, target_sizes, crop_data=None):
+    """Pixels the decode stage (processing.decode) will hold for one upload."""
+    width, height = size
+    try:
+        scale = max(required_scale(size, target_size, crop_data) for target_size in target_sizes)
+    except (KeyError, TypeError, ValueError):
+        # A malformed crop fails in the pipeline; assume a full decode
+        scale = 1.0
+    if image_format == 'JPEG' and scale < 1:
+        # Draft mode decodes at 1/2, 1/4 or 1/8 scale, never below what is needed
+        reduction = 2 ** min(3, int(math.log2(1 / scale)))
+        return math.ceil(width / reduction) * math.ceil(height / reduction)
+    return width * height
+
+
+def file_working_set(upload, target_sizes, crop_data=None):
+    """Estimated peak bytes while one upload is processed."""
+    decoded = decoded_pixels(upload.size, upload.format, target_sizes, crop_data)
+    renditions = sum(width * height for width, height in target_sizes)
+    return (upload.length + decoded * BYTES_PER_PIXEL * DECODE_COPIES
+            + renditions * BYTES_PER_PIXEL * RENDITION_COPIES)
+
+
+def output_bytes(target_sizes, max_size):
+    """Upper bound of one upload's encoded outputs."""
+    return sum(min(max_size, width * height * BYTES_PER_PIXEL) for width, height in target_sizes)
+
+
+def working_set(uploads, target_sizes, max_size, crops=None, holds_outputs=True):
+    """
+    Estimated peak bytes of a batch: in-memory uploads, the largest files
+    that can be in flight at once (one per worker) and, when holds_outputs,
+    every output until the response is built. target_sizes None keeps
+    each upload at its own size, as /optimize does.
+    """
+    crops = crops or [None] * len(uploads)
+    sizes = [target_sizes or [upload.size] for upload in uploads]
+    in_memory = sum(upload.length for upload in uploads if upload.path is None)
+    per_file = sorted((file_working_set(upload, upload_sizes, crop)
+                       for upload, upload_sizes, crop in zip(uploads, sizes, crops)), reverse=True)
+    total = in_memory + sum(per_file[:pool.WORKERS])
+    if holds_outputs:
+        total += sum(output_bytes(upload_sizes, max_size) for upload_sizes in sizes) * JSON_OUTPUT_COPIES
+    return int(total)
+
+
+GOVERNOR = MemoryGovernor(int(float(os.environ.get('RESIZER_MEMORY_BUDGET', 0)) * 1024 * 1024)
+                          or _default_budget())
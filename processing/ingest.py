@@ -0,0 +1,118 @@
+"""
+Upload ingestion for /resize.
+
+Each upload is moved out of the request before any processing starts:
+small ones stay in memory, anything past SPOOL_THRESHOLD is spooled to a
+temporary file that the pool workers read from disk. Only the path is
+passed to the workers, so the request thread never holds the whole batch.
+
+Before an upload is accepted its header bytes are sniffed and Pillow reads
+the dimensions without decoding pixels, so non-images and decompression
+bombs are rejected cheaply.
+"""
+import io
+import os
+import shutil
+import tempfile
+
+from PIL import Image
+
+SPOOL_THRESHOLD = 512 * 1024
+MAX_PIXELS = 150 * 1000 * 1000
+COPY_CHUNK = 1024 * 1024
+
+# Leading bytes of the formats we accept (offset, signature)
+SIGNATURES = (
+    (0, b'\x89PNG\r\n\x1a\n'),
+    (0, b'\xff\xd8\xff'),
+    (0, b'GIF87a'),
+    (0, b'GIF89a'),
+    (0, b'BM'),
+    (0, b'II*\x00'),
+    (0, b'MM\x00*'),
+    (8, b'WEBP'),
+    (4, b'ftyp'),  # HEIC/HEIF (ISO base media)
+)
+
+
+class IngestError(ValueError):
+    """The upload was rejected before decoding."""
+
+
+class Upload:
+    """An accepted upload, held either in memory or in a spooled file."""
+
+    def __init__(self, filename, data=None, path=None, size=None, length=0, format=None):
+        self.filename = filename
+        self.data = data
+        self.path = path
+        self.size = size  # (width, height) in pixels
+        self.length = length  # bytes
+        self.format = format  # Pillow format name, e.g. 'JPEG'
+
+    @property
+    def source(self):
+        """What the pipeline workers read: a file path or the bytes themselves."""
+        return self.path if self.path is not None else self.data
+
+    def discard(self):
+        self.data = None
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+
+def sniff(header):
+    """True if header starts like one of the accepted image formats."""
+    return any(header[offset:offset + len(signature)] == signature for offset, signature in SIGNATURES)
+
+
+def ingest(file, spool_dir=None, threshold=SPOOL_THRESHOLD, max_pixels=MAX_PIXELS):
+    """
+    Take ownership of a werkzeug FileStorage. Returns an Upload or raises
+    IngestError with a message suitable for error_details.
+    """
+    head = file.stream.read(threshold + 1)
+    if not sniff(head[:16]):
+        raise IngestError('File is not a supported image')
+
+    upload = Upload(file.filename)
+    if len(head) <= threshold:
+        upload.data = head
+        upload.length = len(head)
+    else:
+        fd, upload.path = tempfile.mkstemp(dir=spool_dir, suffix='.upload')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(head)
+            shutil.copyfileobj(file.stream, f, COPY_CHUNK)
+            upload.length = f.tell()
+
+    try:
+        # Image.open only parses the header; pixels are not decoded here
+        with Image.open(upload.path or io.BytesIO(upload.data)) as image:
+            upload.size = image.size
+            upload.format = image.format
+    except Image.DecompressionBombError as e:
+        upload.discard()
+        raise IngestError(str(e))
+    except Exception:
+        # Pillow's message names the spool path or a BytesIO address
+        upload.discard()
+        raise IngestError('File is not a readable image')
+
+    width, height = upload.size
+    if width * height > max_pixels:
+        upload.discard()
+        raise IngestError(f'Image is too large ({width}x{height} pixels, limit {max_pixels})')
+    return upload
+
+
+def read_source(source):
+    """Return the bytes of an Upload.source."""
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return f.read()
+    return source
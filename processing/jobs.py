@@ -0,0 +1,186 @@
+"""
+Background resize jobs.
+
+POST /jobs hands the ingested uploads to a job queue and returns at once;
+the client polls GET /jobs/<id> for per-file status and downloads each
+result as soon as it is done. Results are stored in the ResultCache, so a
+job only keeps cache keys, never image bytes.
+
+LocalJobQueue is the in-process backend: one background thread takes
+jobs in submission order and runs each job's files through the shared
+process pool (processing.pool). It needs no external services, but jobs
+live in memory, so they are lost on restart and are not shared between
+server processes. Finished jobs are dropped after JOB_TTL seconds.
+
+Before a job starts it reserves its estimated working set from the memory
+governor (processing.governor), waiting while /resize requests hold the
+budget; its status stays queued meanwhile.
+"""
+import queue
+import threading
+import time
+import traceback
+import uuid
+
+from . import metrics
+from .encode import DEFAULT_STRATEGY
+from .governor import GOVERNOR, working_set
+from .pipeline import MAX_SIZE, TARGET_SIZE, output_name, process_renditions_file
+from .pool import run_batch
+
+JOB_TTL = 60 * 60
+# Bookkeeping kept out of the status response
+_PRIVATE = ('cache_key', 'upload')
+
+
+class Job:
+    """A batch of uploads to resize, and the progress made on it."""
+
+    def __init__(self, uploads, crops, output_format, cache, target_sizes=(TARGET_SIZE,), max_size=MAX_SIZE,
+                 crop_mode='center'):
+        self.id = uuid.uuid4().hex
+        self.status = 'queued'
+        self.created = time.time()
+        self.finished = None
+        self.output_format = output_format
+        self.cache = cache
+        self.target_sizes = list(target_sizes)
+        self.max_size = max_size
+        self.crop_mode = crop_mode
+        self._uploads = uploads
+        self._crops = crops
+        self._lock = threading.Lock()
+        # One entry per rendition; an upload's renditions are made together
+        self.files = [{
+            'original_name': upload.filename,
+            'processed_name': output_name(upload.filename, target_size, output_format),
+            'target_size': f'{target_size[0]}x{target_size[1]}',
+            'format': output_format,
+            'status': 'queued',
+            'bytes': upload.length,
+            'upload': index,
+        } for index, upload in enumerate(uploads) for target_size in self.target_sizes]
+
+    def _entries(self, index):
+        return [entry for entry in self.files if entry['upload'] == index]
+
+    def _jobs(self):
+        for index, (upload, crop) in enumerate(zip(self._uploads, self._crops)):
+            # Pulled by run_batch as the pool has room for the file
+            with self._lock:
+                for entry in self._entries(index):
+                    entry['status'] = 'processing'
+            yield (upload.source, crop, self.target_sizes, self.max_size, self.cache, self.output_format,
+                   DEFAULT_STRATEGY, self.crop_mode)
+
+    def run(self):
+        reservation = None
+        try:
+            # Outputs go to the cache, so only the files in flight count
+            reservation = GOVERNOR.reserve(working_set(self._uploads, self.target_sizes, self.max_size,
+                                                       self._crops, holds_outputs=False))
+            with self._lock:
+                self.status = 'running'
+            results = run_batch(process_renditions_file, self._jobs())
+            for index, (upload, (result, error)) in enumerate(zip(self._uploads, results)):
+                upload.discard()
+                entries = self._entries(index)
+                if error is not None:
+                    metrics.observe_error()
+                    with self._lock:
+                        for entry in entries:
+                            entry.update(status='error', error=str(error))
+                    continue
+                outputs, report = result
+                metrics.observe_result(report)
+                for entry, output_data, rendition in zip(entries, outputs, report['renditions']):
+                    with self._lock:
+                        entry.update(
+                            status='done',
+                            size=len(output_data),
+                            size_mb=round(len(output_data) / (1024 * 1024), 2),
+                            encode_attempts=rendition['attempts'],
+                            cached=rendition['cached'],
+                            cache_key=rendition['cache_key'],
+                        )
+                    if self.cache is not None:
+                        self.cache.record(rendition['cached'], len(output_data))
+        finally:
+            if reservation is not None:
+                reservation.release()
+            for upload in self._uploads:
+                upload.discard()
+            with self._lock:
+                for entry in self.files:
+                    if entry['status'] in ('queued', 'processing'):
+                        entry.update(status='error', error='Job stopped')
+                self.status = 'done'
+                self.finished = time.time()
+
+    def done_files(self):
+        """(processed_name, cache key) for every finished file."""
+        with self._lock:
+            return [(entry['processed_name'], entry['cache_key'])
+                    for entry in self.files if entry['status'] == 'done']
+
+    def to_dict(self):
+        with self._lock:
+            files = [{name: value for name, value in entry.items() if name not in _PRIVATE}
+                     for entry in self.files]
+            # Upload bytes count once per upload, not once per rendition
+            uploads = {entry['upload']: entry for entry in self.files}.values()
+            bytes_total = sum(entry['bytes'] for entry in uploads)
+            bytes_done = sum(entry['bytes'] for entry in uploads if entry['status'] in ('done', 'error'))
+            status = self.status
+        return {
+            'job_id': self.id,
+            'status': status,
+            'processed': sum(entry['status'] == 'done' for entry in files),
+            'errors': sum(entry['status'] == 'error' for entry in files),
+            'total': len(files),
+            'bytes_total': bytes_total,
+            'bytes_done': bytes_done,
+            'files': files,
+        }
+
+
+class LocalJobQueue:
+    """In-process job backend: a queue and one worker thread."""
+
+    def __init__(self, ttl=JOB_TTL):
+        self.ttl = ttl
+        self._jobs = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, job):
+        with self._lock:
+            self._expire()
+            self._jobs[job.id] = job
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name='resize-jobs', daemon=True)
+                self._thread.start()
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            self._expire()
+            return self._jobs.get(job_id)
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished is not None and job.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                job.run()
+            except Exception:
+                # Job.run records per-file errors; anything else is logged
+                # and must not stop the queue
+                traceback.print_exc()
@@ -0,0 +1,220 @@
+"""
+Stage timings and Prometheus-style metrics.
+
+Pipeline code wraps its hot spots in stage('decode'), stage('encode') and
+so on. Inside collect() the durations are gathered into a dict of
+{stage: [seconds, ...]} that the pipeline returns with its report; that
+is how timings get out of pool workers, whose own registry nobody reads.
+The parent feeds them to observe_result(), which updates the histograms
+rendered at /metrics. Outside collect(), a stage is observed directly,
+which is what the parent's own zip and base64 stages do.
+
+    resizer_stage_seconds{stage}      histogram, one observation per stage run
+    resizer_files_total{outcome}      processed, cached or error
+    resizer_encode_attempts_total     encodes run by the byte-budget search
+    resizer_memory_budget_bytes       working-set budget of the memory governor
+    resizer_memory_reserved_bytes     working set reserved by admitted work
+    resizer_memory_waiting            requests and jobs waiting for admission
+    resizer_admissions_total{outcome} admitted or rejected by the governor
+"""
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_current = contextvars.ContextVar('resizer_timings', default=None)
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _number(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return [f'{self.name}{_label_text(self.labels, key)} {_number(value)}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, observed = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value, observed + 1)
+
+    def _samples(self, key, value):
+        counts, total, observed = value
+        bucket_labels = self.labels + ('le',)
+        lines = [f'{self.name}_bucket{_label_text(bucket_labels, key + (_number(bound),))} {count}'
+                 for bound, count in zip(self.buckets, counts)]
+        lines.append(f'{self.name}_bucket{_label_text(bucket_labels, key + ("+Inf",))} {observed}')
+        lines.append(f'{self.name}_sum{_label_text(self.labels, key)} {total!r}')
+        lines.append(f'{self.name}_count{_label_text(self.labels, key)} {observed}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._add(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram('resizer_stage_seconds', 'Time spent in each pipeline stage.', ('stage',))
+FILES = REGISTRY.counter('resizer_files_total', 'Uploads handled, by outcome.', ('outcome',))
+ENCODE_ATTEMPTS = REGISTRY.counter('resizer_encode_attempts_total', 'Encodes run by the byte-budget search.')
+MEMORY_BUDGET = REGISTRY.gauge('resizer_memory_budget_bytes', 'Working-set budget of the memory governor.')
+MEMORY_RESERVED = REGISTRY.gauge('resizer_memory_reserved_bytes', 'Estimated working set reserved by admitted work.')
+MEMORY_WAITING = REGISTRY.gauge('resizer_memory_waiting', 'Requests and jobs waiting for memory admission.')
+ADMISSIONS = REGISTRY.counter('resizer_admissions_total', 'Memory admission decisions, by outcome.', ('outcome',))
+
+
+@contextlib.contextmanager
+def collect():
+    """Gather the stages run inside the block into the yielded dict."""
+    observations = {}
+    token = _current.set(observations)
+    try:
+        yield observations
+    finally:
+        _current.reset(token)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Time the block as one run of the named stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observations = _current.get()
+        if observations is not None:
+            observations.setdefault(name, []).append(elapsed)
+        else:
+            STAGE_SECONDS.observe(elapsed, stage=name)
+
+
+def with_timings(func):
+    """
+    Decorate a pipeline entry point returning (data, report) so the report
+    carries the stages it ran under 'timings'.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with collect() as timings:
+            data, report = func(*args, **kwargs)
+        return data, dict(report, timings=timings)
+    return wrapper
+
+
+def observe_timings(observations):
+    for name, durations in observations.items():
+        for elapsed in durations:
+            STAGE_SECONDS.observe(elapsed, stage=name)
+
+
+def observe_result(report):
+    """Record one processed file from its pipeline report."""
+    FILES.inc(outcome='cached' if report.get('cached') else 'processed')
+    ENCODE_ATTEMPTS.inc(report.get('attempts', 0))
+    observe_timings(report.get('timings', {}))
+
+
+def observe_error():
+    FILES.inc(outcome='error')
+
+
+def merge_timings(into, observations):
+    for name, durations in observations.items():
+        into.setdefault(name, []).extend(durations)
+    return into
+
+
+def summarize(observations):
+    """Per-stage run count and total milliseconds, for a response's timings block."""
+    return {
+        name: {'count': len(durations), 'total_ms': round(sum(durations) * 1000, 2)}
+        for name, durations in sorted(observations.items())
+    }
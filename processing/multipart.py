@@ -0,0 +1,23 @@
+"""
+multipart/form-data parsing for the Vercel handlers.
+
+The handlers receive the raw request body rather than a WSGI request, so
+they used to build a throwaway Flask app and a test request context on
+every call just to parse it. A single werkzeug FormDataParser created at
+import time does the same job without the per-request setup; file parts
+are still spooled to temporary files past werkzeug's memory threshold.
+"""
+import io
+
+from werkzeug.formparser import FormDataParser
+from werkzeug.http import parse_options_header
+
+# Stateless between calls, so one instance serves every request
+_PARSER = FormDataParser()
+
+
+def parse_multipart(body, content_type):
+    """Parse a multipart/form-data body. Returns (form, files) MultiDicts."""
+    mimetype, options = parse_options_header(content_type)
+    _, form, files = _PARSER.parse(io.BytesIO(body), mimetype, len(body), options)
+    return form, files
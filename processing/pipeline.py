@@ -0,0 +1,263 @@
+"""
+The resize and optimize pipelines, shared by the Flask app (app.py) and the
+Vercel handlers (api/resize.py, api/optimize.py).
+
+process_resize_file, process_renditions_file and process_optimize_file
+are the per-upload entry points submitted to the process pool. They take the upload as bytes or as
+the path of a spooled file (see processing.ingest) and return bytes, so
+jobs pickle cheaply.
+"""
+import io
+import os
+import time
+
+from PIL import Image
+from werkzeug.utils import secure_filename
+
+from .autocrop import auto_crop, saliency, suggest_crop
+from .budget import fit_quality_to_budget, fit_to_budget
+from .cache import cache_key, normalize_crop
+from .decode import open_for_targets
+from .encode import DEFAULT_FORMAT, DEFAULT_STRATEGY, FORMATS, extension, is_lossy
+from .ingest import read_source
+from .metrics import stage, with_timings
+from .pool import map_threads
+from .stages import flatten, plan_crop, resample
+
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp', 'tiff', 'tif', 'heic', 'heif'}
+MAX_SIZE = 5 * 1024 * 1024  # 5MB in bytes
+TARGET_SIZE = (1080, 1080)
+# Placement of the crop when the client sends no crop_data
+CROP_MODES = ('center', 'auto')
+
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def output_name(filename, target_size, output_format):
+    """Name of the processed file, e.g. photo_1080x1080.png."""
+    base_name = os.path.splitext(secure_filename(filename))[0]
+    return f"{base_name}_{target_size[0]}x{target_size[1]}.{extension(output_format)}"
+
+
+def optimized_name(filename, output_format):
+    """Name of the optimized file, e.g. photo_optimized.png."""
+    base_name = os.path.splitext(secure_filename(filename))[0]
+    return f"{base_name}_optimized.{extension(output_format)}"
+
+
+def requested_format(form):
+    """The output format named by the form field format; ValueError if unknown."""
+    output_format = (form.get('format') or DEFAULT_FORMAT).lower()
+    if output_format == 'jpg':
+        output_format = 'jpeg'
+    if output_format not in FORMATS:
+        raise ValueError(f"Unsupported output format '{output_format}'. Choose one of: {', '.join(FORMATS)}")
+    return output_format
+
+
+def requested_crop_mode(form):
+    """The crop mode named by the form field crop_mode; ValueError if unknown."""
+    crop_mode = (form.get('crop_mode') or CROP_MODES[0]).lower()
+    if crop_mode not in CROP_MODES:
+        raise ValueError(f"Unsupported crop mode '{crop_mode}'. Choose one of: {', '.join(CROP_MODES)}")
+    return crop_mode
+
+
+def _fit(image, max_size, min_scale, strategy, output_format):
+    if is_lossy(output_format):
+        return fit_quality_to_budget(image, max_size, output_format, min_scale=min_scale)
+    return fit_to_budget(image, max_size, min_scale=min_scale, strategy=strategy)
+
+
+def _pyramid(image, target_sizes, crop_data=None, crop_mode='center'):
+    """
+    Crop and resample image to each of target_sizes. Largest first, each
+    rendition is downscaled from the nearest larger one with the same
+    crop box rather than from the source, so the source is cropped once.
+    Without crop_data, crop_mode 'auto' places each crop on the most
+    salient region (processing.autocrop) instead of the center.
+    """
+    made = []
+    renditions = {}
+    weights = None
+    for target_size in sorted(set(target_sizes), key=lambda size: size[0] * size[1], reverse=True):
+        planned = crop_data
+        if crop_data is None and crop_mode == 'auto':
+            with stage('autocrop'):
+                if weights is None:
+                    weights = saliency(image)
+                planned = auto_crop(image, target_size, weights)
+        # Plan the crop on the source, then crop and downscale before
+        # flattening so compositing only runs on target_size pixels
+        box = plan_crop(image.size, target_size, planned)
+        larger = [rendition for rendition_box, rendition in made
+                  if rendition_box == box and rendition.width >= target_size[0] and rendition.height >= target_size[1]]
+        if larger:
+            source = min(larger, key=lambda rendition: rendition.width * rendition.height)
+        else:
+            with stage('crop'):
+                source = image.crop(box)
+        with stage('resample'):
+            renditions[target_size] = resample(source, target_size)
+        made.append((box, renditions[target_size]))
+    return [renditions[target_size] for target_size in target_sizes]
+
+
+def resize_renditions(image, target_sizes, max_size=MAX_SIZE, crop_data=None, reports=None,
+                      strategy=DEFAULT_STRATEGY, output_format=DEFAULT_FORMAT, crop_mode='center'):
+    """
+    Resize image to every size in target_sizes and compress each under
+    max_size. Returns a BytesIO per size, in order; the budget reports
+    are appended to reports. Sizes are encoded in parallel threads (see
+    pool.map_threads).
+    """
+    def fit(rendition):
+        with stage('convert'):
+            rendition = flatten(rendition)
+        # Fit the output under max_size with as few encodes as possible
+        return _fit(rendition, max_size, 0.5, strategy, output_format)
+
+    results = map_threads(fit, _pyramid(image, target_sizes, crop_data, crop_mode))
+    if reports is not None:
+        reports.extend(budget_report for _, budget_report in results)
+    return [output for output, _ in results]
+
+
+def resize_and_compress(image, target_size=TARGET_SIZE, max_size=MAX_SIZE, crop_data=None, report=None,
+                        strategy=DEFAULT_STRATEGY, output_format=DEFAULT_FORMAT):
+    """
+    Resize image to target size and compress to ensure it's under max_size.
+    Uses provided crop_data if available, otherwise uses center crop.
+    """
+    reports = []
+    output, = resize_renditions(image, [target_size], max_size, crop_data, reports, strategy, output_format)
+    if report is not None:
+        report.update(reports[0])
+    return output
+
+
+def optimize_image(image, max_size_bytes, report=None, strategy=DEFAULT_STRATEGY, output_format=DEFAULT_FORMAT):
+    """
+    Optimize image to fit within max_size_bytes while maintaining aspect ratio.
+    Returns optimized image as BytesIO.
+    """
+    # Convert to RGB if necessary
+    with stage('convert'):
+        image = flatten(image)
+
+    # Keeps the aspect ratio: the engine scales both sides by the same factor
+    output, budget_report = _fit(image, max_size_bytes, 0.3, strategy, output_format)
+    if report is not None:
+        report.update(budget_report)
+    return output
+
+
+def _cached(cache, key):
+    if cache is None:
+        return None
+    with stage('cache'):
+        cached = cache.get(key)
+    if cached is None:
+        return None
+    output_data, report = cached
+    return output_data, dict(report, attempts=0, cache_key=key, cached=True)
+
+
+def _store(cache, key, output_data, report):
+    if cache is not None:
+        with stage('cache'):
+            cache.put(key, output_data, report)
+    return output_data, dict(report, cache_key=key, cached=False)
+
+
+def _resize(image_data, crop_data, target_sizes, max_size, cache, output_format, strategy, crop_mode):
+    """(encoded bytes, report) for each of target_sizes; only uncached sizes are processed."""
+    crop = normalize_crop(crop_data)
+    if crop is None and crop_mode != 'center':
+        crop = crop_mode
+    keys = [cache_key(image_data, operation='resize', crop=crop,
+                      target_size=list(target_size), max_size=max_size, strategy=strategy,
+                      format=output_format)
+            for target_size in target_sizes]
+    results = [_cached(cache, key) for key in keys]
+    missing = [index for index, result in enumerate(results) if result is None]
+    if not missing:
+        return results
+
+    # Decode once, no larger than the crop needs at the largest size
+    sizes = [target_sizes[index] for index in missing]
+    with stage('decode'):
+        image, crop_data = open_for_targets(image_data, sizes, crop_data)
+        image.load()
+    reports = []
+    outputs = resize_renditions(image, sizes, max_size, crop_data, reports, strategy, output_format, crop_mode)
+    for index, output, report in zip(missing, outputs, reports):
+        results[index] = _store(cache, keys[index], output.getvalue(), report)
+    return results
+
+
+@with_timings
+def process_resize_file(source, crop_data, target_size=TARGET_SIZE, max_size=MAX_SIZE, cache=None,
+                        output_format=DEFAULT_FORMAT, strategy=DEFAULT_STRATEGY, crop_mode='center'):
+    """
+    Decode and resize one upload, or fetch it from the result cache.
+    Runs in a pool worker. Returns (encoded bytes, budget report), the
+    report including per-stage timings.
+    """
+    return _resize(read_source(source), crop_data, [target_size], max_size, cache, output_format, strategy,
+                   crop_mode)[0]
+
+
+@with_timings
+def process_renditions_file(source, crop_data, target_sizes, max_size=MAX_SIZE, cache=None,
+                            output_format=DEFAULT_FORMAT, strategy=DEFAULT_STRATEGY, crop_mode='center'):
+    """
+    Like process_resize_file for several target sizes from one decode.
+    Returns ([encoded bytes per size], report) where report['renditions']
+    holds each size's budget report; cached is true only if every size
+    came from the cache.
+    """
+    results = _resize(read_source(source), crop_data, target_sizes, max_size, cache, output_format, strategy,
+                      crop_mode)
+    reports = [report for _, report in results]
+    return [output_data for output_data, _ in results], {
+        'renditions': reports,
+        'attempts': sum(report['attempts'] for report in reports),
+        'cached': all(report['cached'] for report in reports),
+    }
+
+
+@with_timings
+def process_optimize_file(source, max_size_bytes, cache=None, output_format=DEFAULT_FORMAT,
+                          strategy=DEFAULT_STRATEGY):
+    """
+    Decode and optimize one upload, or fetch it from the result cache.
+    Runs in a pool worker. Returns (encoded bytes, budget report), the
+    report including per-stage timings.
+    """
+    image_data = read_source(source)
+    key = cache_key(image_data, operation='optimize', max_size=max_size_bytes, strategy=strategy,
+                    format=output_format)
+    cached = _cached(cache, key)
+    if cached is not None:
+        return cached
+
+    with stage('decode'):
+        image = Image.open(io.BytesIO(image_data))
+        image.load()
+    report = {}
+    output = optimize_image(image, max_size_bytes, report, strategy, output_format)
+    return _store(cache, key, output.getvalue(), report)
+
+
+def process_autocrop_file(source, target_size=TARGET_SIZE):
+    """
+    Suggested crop_data for one upload at target_size's aspect ratio, for
+    the crop UI to start from. Runs in a pool worker.
+    """
+    start = time.perf_counter()
+    crop, size = suggest_crop(read_source(source), target_size)
+    return {'crop': crop, 'width': size[0], 'height': size[1],
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 1)}
@@ -0,0 +1,130 @@
+"""
+Process pool for per-file batch work.
+
+Quantize, LANCZOS resampling and PNG encoding spend long stretches holding
+the GIL, so threads do not scale; a shared process pool does. Configure with:
+
+    RESIZER_WORKERS         number of worker processes (1 disables the pool)
+    RESIZER_MAX_PENDING     files submitted but not yet collected, per batch
+    RESIZER_ENCODE_THREADS  threads a worker may use for one file's
+                            independent encodes (default: CPUs per worker)
+
+Each in-flight file holds its upload and its decoded image in a worker, so
+RESIZER_MAX_PENDING is what bounds memory for large batches.
+"""
+import contextvars
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+def _default_workers():
+    # Serverless runtimes (Vercel/Lambda) have no /dev/shm for semaphores
+    if os.environ.get('VERCEL'):
+        return 1
+    return os.cpu_count() or 1
+
+
+WORKERS = int(os.environ.get('RESIZER_WORKERS', 0)) or _default_workers()
+MAX_PENDING = int(os.environ.get('RESIZER_MAX_PENDING', 0)) or WORKERS * 2
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def configure(workers, max_pending=None):
+    """Override RESIZER_WORKERS/RESIZER_MAX_PENDING, e.g. from a command-line flag."""
+    global WORKERS, MAX_PENDING, _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+        WORKERS = max(1, workers)
+        MAX_PENDING = max_pending or WORKERS * 2
+
+
+def get_executor():
+    """Return the shared pool, or None when running inline."""
+    global _executor
+    if WORKERS <= 1:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            try:
+                _executor = ProcessPoolExecutor(max_workers=WORKERS)
+            except (OSError, NotImplementedError):
+                # Platform cannot create process pools; fall back to inline
+                return None
+        return _executor
+
+
+def _discard_executor(executor):
+    # A worker died (e.g. killed for memory); start a fresh pool next batch
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def run_batch(func, jobs, max_pending=None):
+    """
+    Run func(*job) for every job and yield (result, error) pairs in job order.
+
+    error is the exception raised by that job (result is then None), so one
+    bad file never aborts the batch. At most max_pending jobs are in flight.
+    """
+    executor = get_executor()
+    if executor is None:
+        for job in jobs:
+            try:
+                yield func(*job), None
+            except Exception as e:
+                yield None, e
+        return
+
+    max_pending = max_pending or MAX_PENDING
+    pending = deque()
+    jobs = iter(jobs)
+    while True:
+        while len(pending) < max_pending:
+            job = next(jobs, None)
+            if job is None:
+                break
+            try:
+                future = executor.submit(func, *job)
+            except (BrokenProcessPool, RuntimeError) as e:
+                future = Future()
+                future.set_exception(e)
+            pending.append(future)
+        if not pending:
+            return
+        future = pending.popleft()
+        try:
+            yield future.result(), None
+        except BrokenProcessPool as e:
+            _discard_executor(executor)
+            yield None, e
+        except Exception as e:
+            yield None, e
+
+
+def encode_threads():
+    """Threads one worker may use for a file's independent encodes."""
+    return int(os.environ.get('RESIZER_ENCODE_THREADS', 0)) or max(1, (os.cpu_count() or 1) // WORKERS)
+
+
+def map_threads(func, items, threads=None):
+    """
+    Return [func(item) for item in items], run on up to threads threads.
+    Each call runs in a copy of the caller's context, so stage timings
+    (processing.metrics) still reach the caller's collector.
+    """
+    threads = min(threads or encode_threads(), len(items))
+    if threads <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, func, item) for item in items]
+        return [future.result() for future in futures]
@@ -0,0 +1,132 @@
+"""
+Cheap PNG size predictor.
+
+Encodes a handful of evenly spaced row strips at the default zlib level,
+without the optimize pass, and extrapolates to the full height. That costs
+roughly a tenth of a full optimize=True encode. The budget engine uses the estimate to skip rungs
+that are clearly too big.
+
+Run as a script to calibrate against a corpus:
+
+    python -m processing.predict photos/ --max-dim 1080
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+
+from PIL import Image
+
+SAMPLE_STRIPS = 16
+STRIP_ROWS = 8
+# Sampled strips compress slightly worse than the whole image; measured with calibrate()
+OPTIMIZED_RATIO = 0.95
+# Relative error within which a prediction is trusted to skip a rung
+TOLERANCE = 0.25
+
+
+def sample_strips(image):
+    """Stack evenly spaced strips of rows into one small image."""
+    width, height = image.size
+    sample_height = SAMPLE_STRIPS * STRIP_ROWS
+    if height <= sample_height * 2:
+        return image
+    sample = Image.new(image.mode, (width, sample_height))
+    if image.mode == 'P':
+        sample.putpalette(image.getpalette())
+    step = (height - STRIP_ROWS) / (SAMPLE_STRIPS - 1)
+    for index in range(SAMPLE_STRIPS):
+        top = int(index * step)
+        strip = image.crop((0, top, width, top + STRIP_ROWS))
+        sample.paste(strip, (0, index * STRIP_ROWS))
+    return sample
+
+
+def estimate_png_size(image):
+    """Predict the size in bytes of image saved as PNG with optimize=True."""
+    sample = sample_strips(image)
+    output = io.BytesIO()
+    sample.save(output, format='PNG', compress_level=6)
+    return int(len(output.getvalue()) * image.size[1] / sample.size[1] * OPTIMIZED_RATIO)
+
+
+def likely_too_big(predicted, max_size):
+    return predicted > max_size * (1 + TOLERANCE)
+
+
+def likely_fits(predicted, max_size):
+    return predicted < max_size * (1 - TOLERANCE)
+
+
+def calibrate(paths, max_dim=None):
+    """
+    Compare predictions with real optimize=True encodes.
+    Returns a list of per-file results and a summary of relative errors.
+    """
+    results = []
+    for path in paths:
+        try:
+            image = Image.open(path)
+            image.load()
+        except Exception as e:
+            print(f'skipping {path}: {e}', file=sys.stderr)
+            continue
+        if image.mode not in ('RGB', 'L', 'P'):
+            image = image.convert('RGB')
+        if max_dim:
+            image.thumbnail((max_dim, max_dim), Image.Resampling.LANCZOS)
+        predicted = estimate_png_size(image)
+        output = io.BytesIO()
+        image.save(output, format='PNG', optimize=True)
+        actual = len(output.getvalue())
+        results.append({
+            'path': path,
+            'predicted': predicted,
+            'actual': actual,
+            'error': (predicted - actual) / actual,
+        })
+
+    errors = sorted(abs(result['error']) for result in results)
+    summary = {'files': len(results)}
+    if errors:
+        summary.update({
+            'mean_abs_error': statistics.mean(errors),
+            'p95_abs_error': errors[min(len(errors) - 1, int(len(errors) * 0.95))],
+            'mean_bias': statistics.mean(result['error'] for result in results),
+            'within_tolerance': sum(e <= TOLERANCE for e in errors) / len(errors),
+        })
+    return results, summary
+
+
+def _walk(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Report PNG size predictor error over a corpus.')
+    parser.add_argument('paths', nargs='+', help='image files or directories')
+    parser.add_argument('--max-dim', type=int, default=None,
+                        help='downscale images so the longest side is at most this many pixels')
+    args = parser.parse_args(argv)
+
+    results, summary = calibrate(list(_walk(args.paths)), args.max_dim)
+    for result in results:
+        print(f"{result['error']:+7.1%}  {result['predicted']:>10}  {result['actual']:>10}  {result['path']}")
+    if not results:
+        print('no images found')
+        return 1
+    print(f"files: {summary['files']}  mean |error|: {summary['mean_abs_error']:.1%}  "
+          f"p95 |error|: {summary['p95_abs_error']:.1%}  bias: {summary['mean_bias']:+.1%}  "
+          f"within {TOLERANCE:.0%}: {summary['within_tolerance']:.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
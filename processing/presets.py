@@ -0,0 +1,99 @@
+"""
+Per-request output geometry: named target presets, custom sizes and the
+byte budget, validated before any work is queued.
+
+Presets are read from presets.json next to this file, or from the file
+named by RESIZER_PRESETS, once per process:
+
+    {"story": {"size": [1080, 1920], "label": "Story 9:16 (1080x1920)"}, ...}
+
+A request picks sizes with the form fields preset (comma-separated preset
+names) and sizes (comma-separated WIDTHxHEIGHT, or a number for a
+square); without either it gets TARGET_SIZE. The crop for each size is
+planned by the smart-fill logic in processing.stages, so any aspect ratio
+works.
+"""
+import functools
+import json
+import os
+
+from .pipeline import MAX_SIZE, TARGET_SIZE
+
+PRESETS_FILE = os.environ.get('RESIZER_PRESETS') or os.path.join(os.path.dirname(__file__), 'presets.json')
+MIN_DIMENSION = 16
+MAX_DIMENSION = 4096
+MAX_RENDITIONS = 8
+MIN_BUDGET = 10 * 1024
+MAX_BUDGET = 50 * 1024 * 1024
+
+
+def validate_size(width, height):
+    """Return (width, height) as ints; ValueError if out of bounds."""
+    if not (MIN_DIMENSION <= width <= MAX_DIMENSION and MIN_DIMENSION <= height <= MAX_DIMENSION):
+        raise ValueError(f'Size {width}x{height} is out of range; '
+                         f'each side must be {MIN_DIMENSION} to {MAX_DIMENSION} pixels')
+    return int(width), int(height)
+
+
+def parse_size(text):
+    """'1080x1350' or '1080' (a square) as a validated (width, height)."""
+    dimensions = text.strip().lower().split('x')
+    try:
+        if len(dimensions) > 2:
+            raise ValueError
+        width, height = int(dimensions[0]), int(dimensions[-1])
+    except ValueError:
+        raise ValueError(f"Invalid size '{text.strip()}'. Use a number or WIDTHxHEIGHT, e.g. 1080x1350")
+    return validate_size(width, height)
+
+
+@functools.lru_cache(maxsize=None)
+def load_presets(path=PRESETS_FILE):
+    """{name: {'size': (width, height), 'label': text}} from path, validated."""
+    with open(path) as f:
+        table = json.load(f)
+    presets = {}
+    for name, preset in table.items():
+        presets[name] = {
+            'size': validate_size(*preset['size']),
+            'label': preset.get('label', name),
+        }
+    return presets
+
+
+def requested_sizes(form):
+    """
+    Target sizes named by the form fields preset and sizes, presets first,
+    without duplicates. ValueError for unknown presets or invalid sizes.
+    """
+    presets = load_presets()
+    sizes = []
+    for name in (form.get('preset') or '').split(','):
+        name = name.strip().lower()
+        if not name:
+            continue
+        if name not in presets:
+            raise ValueError(f"Unknown preset '{name}'. Choose from: {', '.join(presets)}")
+        sizes.append(presets[name]['size'])
+    for part in (form.get('sizes') or '').split(','):
+        if part.strip():
+            sizes.append(parse_size(part))
+    sizes = list(dict.fromkeys(sizes)) or [TARGET_SIZE]
+    if len(sizes) > MAX_RENDITIONS:
+        raise ValueError(f'At most {MAX_RENDITIONS} sizes per request')
+    return sizes
+
+
+def requested_max_size(form):
+    """The byte budget from the form field max_size (bytes); MAX_SIZE when absent."""
+    value = form.get('max_size')
+    if not value:
+        return MAX_SIZE
+    try:
+        max_size = int(float(value))
+    except (ValueError, OverflowError):
+        # OverflowError: inf and values like 1e400
+        raise ValueError(f"Invalid max_size '{value}'; give the budget in bytes")
+    if not MIN_BUDGET <= max_size <= MAX_BUDGET:
+        raise ValueError(f'max_size must be between {MIN_BUDGET} and {MAX_BUDGET} bytes')
+    return max_size
@@ -0,0 +1,120 @@
+"""
+Palette quantization for the PNG budget fallbacks.
+
+A Quantizer computes one 256-colour palette for an image and derives
+every smaller palette from it: the 256 entries, weighted by how many
+pixels use each, are clustered down to the requested count, and the
+indexed image is remapped through a point() lookup table instead of being
+quantized again. Scaled copies of the image are mapped onto the existing
+palette, which skips palette construction entirely.
+
+Results stay in P mode, so the PNG is written with 8-bit (or smaller)
+indices rather than 24-bit RGB.
+
+    mediancut      Pillow's median cut, the original behaviour
+    fastoctree     much faster; slightly larger files on photos
+    libimagequant  best quality, when Pillow is built with it
+
+The method is set with RESIZER_QUANTIZER (default mediancut). Dithering
+is off by default: it usually makes the PNG larger, which works against
+the byte budget.
+"""
+import os
+
+from PIL import Image, features
+
+from .metrics import stage
+
+METHODS = {
+    'mediancut': Image.Quantize.MEDIANCUT,
+    'fastoctree': Image.Quantize.FASTOCTREE,
+}
+if features.check('libimagequant'):
+    METHODS['libimagequant'] = Image.Quantize.LIBIMAGEQUANT
+DEFAULT_METHOD = os.environ.get('RESIZER_QUANTIZER', 'mediancut')
+if DEFAULT_METHOD not in METHODS:
+    raise ValueError(f'RESIZER_QUANTIZER must be one of {", ".join(METHODS)}')
+
+# Pixels in the stand-in image used to cluster a palette down
+WEIGHTED_SAMPLE = 1 << 16
+
+
+def _entries(palette, indices):
+    return [tuple(palette[3 * index:3 * index + 3]) for index in indices]
+
+
+class Quantizer:
+    """Palettes for one RGB image, computed once and reused."""
+
+    def __init__(self, image, method=DEFAULT_METHOD, dither=False):
+        self.image = image
+        self.method = METHODS[method]
+        self.dither = Image.Dither.FLOYDSTEINBERG if dither else Image.Dither.NONE
+        self._base = None
+        self._derived = {}
+
+    @property
+    def base(self):
+        """The image quantized to 256 colours, in P mode."""
+        if self._base is None:
+            # quantize() only dithers when mapping onto a given palette
+            self._base = self.image.quantize(256, method=self.method)
+            if self.dither != Image.Dither.NONE:
+                self._base = self.image.quantize(palette=self._base, dither=self.dither)
+        return self._base
+
+    def _derive(self, colors):
+        """
+        Return (lookup table, P image carrying the palette) for a palette of
+        colors entries derived from the base palette.
+        """
+        if colors not in self._derived:
+            base = self.base
+            counts = base.histogram()[:256]
+            # Images with fewer colours get a shorter palette; pad it so
+            # every index has an entry
+            palette = base.getpalette()
+            palette += [0] * (768 - len(palette))
+            used = [index for index, count in enumerate(counts) if count]
+            total = sum(counts)
+
+            # Cluster the base palette with each entry repeated in proportion
+            # to the pixels that use it
+            weights = [max(1, round(counts[index] * WEIGHTED_SAMPLE / total)) for index in used]
+            stand_in = Image.new('RGB', (sum(weights), 1))
+            stand_in.putdata([entry for entry, weight in zip(_entries(palette, used), weights)
+                              for _ in range(weight)])
+            reduced = stand_in.quantize(colors, method=self.method)
+
+            # Nearest reduced entry for each base entry
+            entries = Image.new('RGB', (256, 1))
+            entries.putdata(_entries(palette, range(256)))
+            lut = list(entries.quantize(palette=reduced, dither=Image.Dither.NONE).getdata())
+            self._derived[colors] = (lut, reduced)
+        return self._derived[colors]
+
+    def quantize(self, colors=256, image=None):
+        """
+        Return image (default: the quantizer's own) in P mode with at most
+        colors palette entries. Other images, such as scaled copies, are
+        mapped onto the existing palette.
+        """
+        with stage('quantize'):
+            return self._quantize(colors, image)
+
+    def _quantize(self, colors, image):
+        if colors >= 256:
+            lut, palette_image = None, self.base
+        else:
+            lut, palette_image = self._derive(colors)
+
+        if image is None or image is self.image:
+            if lut is None:
+                return self.base
+            if self.dither == Image.Dither.NONE:
+                derived = self.base.point(lut)
+                derived.putpalette(palette_image.getpalette())
+                return derived
+            # A lookup table cannot dither, so map the pixels again
+            image = self.image
+        return image.quantize(palette=palette_image, dither=self.dither)
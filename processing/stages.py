@@ -0,0 +1,211 @@
+"""
+Pipeline stages that run before encoding:
+
+    plan_crop -> crop -> resample -> flatten
+
+The crop box is planned on the source dimensions and the image is cropped
+and downscaled before alpha compositing, so compositing and mode
+conversion only touch target-sized buffers instead of the full frame.
+
+Transparency is composited onto BACKGROUND, white unless RESIZER_BACKGROUND
+names another colour ('#202020', 'black', 'rgb(240,240,240)').
+"""
+import math
+import os
+
+import numpy as np
+from PIL import Image, ImageColor
+
+WHITE = (255, 255, 255)
+BACKGROUND = ImageColor.getrgb(os.environ.get('RESIZER_BACKGROUND') or 'white')[:3]
+# Modes holding more than 8 bits per sample, scaled down rather than clipped
+HIGH_BIT_DEPTH = ('I;16', 'I;16L', 'I;16B', 'I;16N', 'I')
+# Crop boxes within this fraction of the target aspect ratio are used as is
+ASPECT_TOLERANCE = 0.01
+CROP_FIELDS = ('x', 'y', 'width', 'height')
+
+
+def parse_crop(crop_data):
+    """
+    Validate crop data sent by a client. Returns None for no crop or a
+    dict of float x, y, width and height; raises ValueError for anything
+    else, so a bad crop fails its own file rather than the request.
+    """
+    if not crop_data:
+        return None
+    if not isinstance(crop_data, dict):
+        raise ValueError('Crop must be an object with x, y, width and height')
+    try:
+        crop = {name: float(crop_data[name]) for name in CROP_FIELDS}
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Crop needs numeric x, y, width and height')
+    if not all(math.isfinite(value) for value in crop.values()):
+        raise ValueError('Crop needs numeric x, y, width and height')
+    return crop
+
+
+def plan_crop(size, target_size, crop_data=None):
+    """
+    Work out the crop box (left, top, right, bottom) for the source size.
+    Uses crop_data if provided, otherwise a smart-fill center crop. A
+    crop_data box of another aspect ratio than target_size is trimmed to
+    it around its center rather than stretched.
+    """
+    width, height = size
+    target_width, target_height = target_size
+
+    if crop_data:
+        # Crop using provided coordinates
+        left = max(0, int(crop_data['x']))
+        top = max(0, int(crop_data['y']))
+        right = min(width, int(crop_data['x'] + crop_data['width']))
+        bottom = min(height, int(crop_data['y'] + crop_data['height']))
+        return _fit_aspect((left, top, right, bottom), target_size)
+
+    # Smart Fill: Auto-detect orientation and fill accordingly
+    is_landscape = width >= height
+
+    if is_landscape:
+        # Landscape: Fill height, crop width (center crop horizontally)
+        scale = target_height / height
+        scaled_width = width * scale
+
+        if scaled_width >= target_width:
+            # Wide enough - crop width, use full height
+            crop_width = target_width / scale
+            crop_height = height
+            left = (width - crop_width) / 2
+            top = 0
+        else:
+            # Not wide enough - fill width instead, crop height
+            scale = target_width / width
+            crop_width = width
+            crop_height = target_height / scale
+            left = 0
+            top = (height - crop_height) / 2
+    else:
+        # Portrait: Fill width, crop height (center crop vertically)
+        scale = target_width / width
+        scaled_height = height * scale
+
+        if scaled_height >= target_height:
+            # Tall enough - crop height, use full width
+            crop_height = target_height / scale
+            crop_width = width
+            left = 0
+            top = (height - crop_height) / 2
+        else:
+            # Not tall enough - fill height instead, crop width
+            scale = target_height / height
+            crop_height = height
+            crop_width = target_width / scale
+            left = (width - crop_width) / 2
+            top = 0
+
+    left = max(0, int(left))
+    top = max(0, int(top))
+    right = min(width, int(left + crop_width))
+    bottom = min(height, int(top + crop_height))
+    return left, top, right, bottom
+
+
+def _fit_aspect(box, target_size):
+    """The largest box of target_size's aspect ratio centered in box."""
+    left, top, right, bottom = box
+    box_width, box_height = right - left, bottom - top
+    if box_width <= 0 or box_height <= 0:
+        return box
+    target_ratio = target_size[0] / target_size[1]
+    if abs(box_width / box_height / target_ratio - 1) <= ASPECT_TOLERANCE:
+        return box
+    if box_width / box_height > target_ratio:
+        trim = (box_width - box_height * target_ratio) / 2
+        return int(left + trim), top, int(right - trim), bottom
+    trim = (box_height - box_width / target_ratio) / 2
+    return left, int(top + trim), right, int(bottom - trim)
+
+
+def resample(image, target_size):
+    """
+    Resize to target_size with LANCZOS.
+
+    RGBA and LA are resampled as is (Pillow premultiplies alpha) and
+    flattened afterwards. Palette images are flattened first because Pillow
+    can only resize them with NEAREST; compositing is linear, so that gives
+    the same result, and for a palette it only touches 256 entries. Every
+    other mode becomes RGB or L here, which is per-pixel and so gives the
+    same result as converting before the crop.
+    """
+    if image.mode in HIGH_BIT_DEPTH:
+        image = _to_8bit(image)
+    elif image.mode in ('P', 'PA'):
+        image = flatten(image)
+    elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        image = image.convert('RGB')
+    return image.resize(target_size, Image.Resampling.LANCZOS)
+
+
+def _to_8bit(image):
+    """L image of a 16-bit one, keeping the high byte of each sample."""
+    samples = np.asarray(image)
+    if image.mode == 'I':
+        samples = samples.clip(0, 65535)
+    return Image.fromarray((samples >> 8).astype(np.uint8), 'L')
+
+
+def _blend(channel, alpha, inverse, background):
+    """channel over background with alpha (uint8 arrays), rounded, as uint8."""
+    mixed = channel.astype(np.uint16) * alpha
+    mixed += inverse * np.uint16(background)
+    # Exact round(mixed / 255) for mixed <= 255 * 255
+    mixed += 128
+    mixed += mixed >> 8
+    mixed >>= 8
+    return mixed.astype(np.uint8)
+
+
+def _flatten_palette(image, background):
+    """RGB of a palette image, compositing its 256 entries rather than its pixels."""
+    # Indices past the end of a short palette are black, as in convert()
+    palette = np.zeros((256, 3), dtype=np.uint8)
+    entries = np.asarray(image.getpalette('RGB'), dtype=np.uint8).reshape(-1, 3)[:256]
+    palette[:len(entries)] = entries
+    alpha = np.full(256, 255, dtype=np.uint8)
+    transparency = image.info['transparency']
+    if isinstance(transparency, int):
+        if transparency < 256:
+            alpha[transparency] = 0
+    else:
+        count = min(len(transparency), 256)
+        alpha[:count] = np.frombuffer(transparency, dtype=np.uint8)[:count]
+    inverse = (255 - alpha).astype(np.uint16)
+    alpha = alpha.astype(np.uint16)
+    entries = np.stack([_blend(palette[:, band], alpha, inverse, background[band]) for band in range(3)], axis=1)
+    composited = image.copy()
+    composited.info.pop('transparency', None)
+    composited.putpalette(entries.tobytes(), 'RGB')
+    return composited.convert('RGB')
+
+
+def flatten(image, background=None):
+    """
+    Composite any transparency onto a solid background (default
+    BACKGROUND) and return RGB. RGBA, LA and PA are blended by Pillow in
+    C, with the image's own alpha as the mask; palette transparency is
+    applied to the 256 palette entries with NumPy instead of to every
+    pixel; 16-bit samples are scaled to 8 bits rather than clipped.
+    """
+    background = BACKGROUND if background is None else tuple(background)
+    if image.mode == 'RGB':
+        return image
+    if image.mode in HIGH_BIT_DEPTH:
+        return _to_8bit(image).convert('RGB')
+    if image.mode == 'P' and 'transparency' in image.info:
+        return _flatten_palette(image, background)
+    if image.mode == 'PA':
+        image = image.convert('RGBA')
+    if image.mode not in ('RGBA', 'LA'):
+        return image.convert('RGB')
+    flattened = Image.new('RGB', image.size, background)
+    flattened.paste(image, mask=image)
+    return flattened
@@ -0,0 +1,211 @@
+"""
+Watch-folder mode: keep an input folder processed as files arrive.
+
+    python -m processing watch incoming/ -o output/ [--format jpeg] [--workers 2]
+
+On start every image not already up to date is processed, exactly like
+the resize command (processing.cli), including its on-disk index, so a
+restart only picks up what changed while the watcher was down. After that
+the folder is watched with inotify on Linux (through ctypes, no extra
+dependency) or by polling elsewhere or with --poll.
+
+Copies are not atomic, so a changed file is debounced: it is processed
+only once its size and mtime have stayed the same for --debounce seconds.
+Ready files go through the shared process pool in batches, with at most
+RESIZER_MAX_PENDING in flight (processing.pool).
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+from .cli import load_index, plan, process, settings, walk
+from .pipeline import allowed_file
+
+# inotify(7) event bits
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """Changed paths under root, from inotify watches on every directory."""
+
+    def __init__(self, root, skip=None):
+        self.root = root
+        self.skip = skip
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._dirs = {}
+        self._add_tree(root)
+
+    def _add_tree(self, directory):
+        """Watch directory and its subdirectories; return the files already in them."""
+        found = []
+        for path, names, files in os.walk(directory):
+            names[:] = [name for name in names if os.path.abspath(os.path.join(path, name)) != self.skip]
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                print(f'cannot watch {path}: {os.strerror(ctypes.get_errno())}', file=sys.stderr)
+                continue
+            self._dirs[wd] = path
+            found.extend(os.path.relpath(os.path.join(path, name), self.root) for name in files)
+        return found
+
+    def changes(self, timeout):
+        """Relative paths changed since the last call, waiting up to timeout seconds for one."""
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b'\0'))
+            offset += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped; fall back to looking at everything
+                changed.extend(walk(self.root, skip=self.skip))
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and os.path.abspath(path) != self.skip:
+                    # A folder moved in arrives with its files already inside
+                    changed.extend(self._add_tree(path))
+                continue
+            changed.append(os.path.relpath(path, self.root))
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """Changed paths under root, found by comparing directory listings."""
+
+    def __init__(self, root, skip=None, interval=2.0):
+        self.root = root
+        self.skip = skip
+        self.interval = interval
+        self._seen = self._snapshot()
+
+    def _snapshot(self):
+        seen = {}
+        for relative in walk(self.root, skip=self.skip):
+            try:
+                stat = os.stat(os.path.join(self.root, relative))
+            except OSError:
+                continue
+            seen[relative] = (stat.st_size, stat.st_mtime_ns)
+        return seen
+
+    def changes(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        seen = self._snapshot()
+        changed = [relative for relative, signature in seen.items() if self._seen.get(relative) != signature]
+        self._seen = seen
+        return changed
+
+    def close(self):
+        pass
+
+
+def make_watcher(root, skip=None, poll=False, interval=2.0):
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(root, skip)
+        except (OSError, AttributeError) as e:
+            print(f'inotify unavailable ({e}), polling instead', file=sys.stderr)
+    return PollingWatcher(root, skip, interval)
+
+
+class Debouncer:
+    """Hold changed files until their size and mtime stop changing."""
+
+    def __init__(self, root, quiet_seconds):
+        self.root = root
+        self.quiet_seconds = quiet_seconds
+        # relative path -> ((size, mtime) or None, time it was last seen changing)
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def changed(self, relative):
+        self._pending[relative] = (None, time.monotonic())
+
+    def ready(self):
+        """Pop and return the files that have been quiet long enough."""
+        now = time.monotonic()
+        ready = []
+        for relative, (signature, since) in list(self._pending.items()):
+            try:
+                stat = os.stat(os.path.join(self.root, relative))
+            except OSError:
+                # Deleted, or moved away again, before it settled
+                del self._pending[relative]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != signature:
+                self._pending[relative] = (current, now)
+            elif now - since >= self.quiet_seconds:
+                del self._pending[relative]
+                ready.append(relative)
+        return sorted(ready)
+
+
+def watch(args):
+    params = settings(args)
+    output_dir = os.path.abspath(args.output)
+    index = load_index(output_dir)
+    watcher = make_watcher(args.input, skip=output_dir, poll=args.poll, interval=args.interval)
+    debouncer = Debouncer(args.input, args.debounce)
+    kind = 'polling' if isinstance(watcher, PollingWatcher) else 'inotify'
+    print(f'watching {args.input} ({kind}), writing to {args.output}; Ctrl+C to stop', flush=True)
+
+    processed = failed = 0
+    try:
+        # Catch up on whatever arrived while the watcher was not running
+        work, _, clashes = plan(args, index, params)
+        done, errors, _, _ = process(work, args, index, params)
+        processed, failed = done, errors + clashes
+
+        while True:
+            for relative in watcher.changes(args.debounce / 2 if len(debouncer) else args.interval):
+                if allowed_file(relative):
+                    debouncer.changed(relative)
+            ready = debouncer.ready()
+            if not ready:
+                continue
+            work, _, clashes = plan(args, index, params, ready)
+            done, errors, _, _ = process(work, args, index, params)
+            processed += done
+            failed += errors + clashes
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    print(f'stopped: {processed} processed, {failed} failed')
+    return 0
@@ -9,11 +9,17 @@ const clearBtn = document.getElementById('clearBtn');
 const progressContainer = document.getElementById('progressContainer');
 const progressFill = document.getElementById('progressFill');
 const progressText = document.getElementById('progressText');
+const progressFiles = document.getElementById('progressFiles');
 const results = document.getElementById('results');
 const resultsInfo = document.getElementById('resultsInfo');
 const downloadZipBtn = document.getElementById('downloadZipBtn');
 const resetBtn = document.getElementById('resetBtn');
 const errorMessage = document.getElementById('errorMessage');
+const formatSelect = document.getElementById('formatSelect');
+const presetSelect = document.getElementById('presetSelect');
+const JOB_POLL_INTERVAL = 500;
+// Cleared when the server turns out not to have the job API
+let jobApiAvailable = true;
 
 // Cropping elements
 const cropContainer = document.getElementById('cropContainer');
@@ -30,6 +36,8 @@ const cropFinishBtn = document.getElementById('cropFinishBtn');
 let selectedFiles = [];
 let processedData = null;
 let cropData = []; // Store crop coordinates for each image
+let suggestedCrops = []; // Crop centers from /autocrop, as fractions of each image
+let cropTouched = false; // The user has moved the current crop box
 let currentCropIndex = 0;
 let currentImage = null;
 let cropBoxData = { x: 0, y: 0, width: 1080, height: 1080 };
@@ -72,6 +80,32 @@ const API_BASE = window.location.hostname === 'localhost'
     ? 'http://localhost:5001' 
     : '/api';
 
+// Replace the built-in size presets with the server's list, when it has one
+async function loadPresets() {
+    try {
+        const response = await fetch(`${API_BASE}/presets`);
+        if (!response.ok) return;
+        const presets = await response.json();
+        const selected = presetSelect.value;
+        presetSelect.innerHTML = '';
+        Object.entries(presets).forEach(([name, preset]) => {
+            const option = document.createElement('option');
+            option.value = name;
+            option.textContent = preset.label;
+            presetSelect.appendChild(option);
+        });
+        if (presets[selected]) {
+            presetSelect.value = selected;
+        }
+    } catch (error) {
+        // Keep the built-in options
+    }
+}
+
+if (presetSelect) {
+    loadPresets();
+}
+
 // Tab switching
 if (tabCropper && tabOptimizer) {
     tabCropper.addEventListener('click', () => switchTab('cropper'));
@@ -219,6 +253,7 @@ if (processBtn) {
         // Initialize crop data array
         cropData = selectedFiles.map(() => null);
         currentCropIndex = 0;
+        suggestCrops(selectedFiles);
         
         // Hide other UI elements
         hideActions();
@@ -232,6 +267,69 @@ if (processBtn) {
     });
 }
 
+// Downscaled JPEG copy of an image file, so suggestions upload quickly
+function cropThumbnail(file, maxSide = 256) {
+    return new Promise((resolve, reject) => {
+        const url = URL.createObjectURL(file);
+        const img = new Image();
+        img.onload = () => {
+            URL.revokeObjectURL(url);
+            const scale = Math.min(maxSide / img.width, maxSide / img.height, 1);
+            const canvas = document.createElement('canvas');
+            canvas.width = Math.max(1, Math.round(img.width * scale));
+            canvas.height = Math.max(1, Math.round(img.height * scale));
+            canvas.getContext('2d').drawImage(img, 0, 0, canvas.width, canvas.height);
+            canvas.toBlob(blob => blob ? resolve(blob) : reject(new Error('thumbnail failed')), 'image/jpeg', 0.85);
+        };
+        img.onerror = () => {
+            URL.revokeObjectURL(url);
+            reject(new Error('unreadable image'));
+        };
+        img.src = url;
+    });
+}
+
+// Ask the server where the interesting part of each image is. The crop
+// box starts there instead of the center; without the endpoint (or on any
+// failure) the center is kept.
+async function suggestCrops(files) {
+    suggestedCrops = files.map(() => null);
+    const requested = suggestedCrops;
+    try {
+        const formData = new FormData();
+        const thumbnails = await Promise.all(files.map(file => cropThumbnail(file).catch(() => null)));
+        thumbnails.forEach((thumbnail, index) => {
+            // Unreadable files still take a slot, so indexes line up
+            formData.append('files', thumbnail || new Blob(), `${index}.jpg`);
+        });
+        formData.append('sizes', '1080');
+        const response = await fetch(`${API_BASE}/autocrop`, { method: 'POST', body: formData });
+        if (!response.ok || requested !== suggestedCrops) return;
+        const data = await response.json();
+        data.files.forEach(file => {
+            suggestedCrops[file.index] = {
+                x: (file.crop.x + file.crop.width / 2) / file.width,
+                y: (file.crop.y + file.crop.height / 2) / file.height
+            };
+        });
+        // Move the box shown now, unless the user already placed it
+        if (currentImage && !cropTouched && !cropData[currentCropIndex] && suggestedCrops[currentCropIndex]) {
+            applySuggestedCrop(currentCropIndex, currentImage);
+            updateCropBox();
+        }
+    } catch (error) {
+        // Suggestions are optional
+    }
+}
+
+// Center the current crop box on the suggested point, keeping its size
+function applySuggestedCrop(index, img) {
+    const suggestion = suggestedCrops[index];
+    if (!suggestion) return;
+    cropBoxData.x = Math.max(0, Math.min(img.width - cropBoxData.width, suggestion.x * img.width - cropBoxData.width / 2));
+    cropBoxData.y = Math.max(0, Math.min(img.height - cropBoxData.height, suggestion.y * img.height - cropBoxData.height / 2));
+}
+
 function showCropInterface() {
     cropContainer.style.display = 'block';
     cropTotal.textContent = selectedFiles.length;
@@ -247,6 +345,7 @@ function loadImageForCrop(index) {
     
     currentCropIndex = index;
     cropCounter.textContent = index + 1;
+    cropTouched = false;
     
     const file = selectedFiles[index];
     const reader = new FileReader();
@@ -336,6 +435,7 @@ function loadImageForCrop(index) {
                     width: cropWidth,
                     height: cropHeight
                 };
+                applySuggestedCrop(index, img);
             }
             
             updateCropBox();
@@ -500,6 +600,7 @@ cropBox.addEventListener('mousedown', (e) => {
     e.preventDefault();
     e.stopPropagation();
     isDragging = true;
+    cropTouched = true;
     
     // Get container rect for coordinate conversion
     const container = cropCanvas.parentElement;
@@ -713,8 +814,7 @@ if (cropFinishBtn) {
     
     // Process images with crop data
     try {
-        progressText.textContent = 'Processing images with your crops...';
-        progressFill.style.width = '30%';
+        progressText.textContent = 'Uploading images...';
         
         const formData = new FormData();
         selectedFiles.forEach((file, index) => {
@@ -723,43 +823,212 @@ if (cropFinishBtn) {
                 formData.append(`crop_${index}`, JSON.stringify(cropData[index]));
             }
         });
+        formData.append('format', formatSelect.value);
+        formData.append('preset', presetSelect.value);
         
-        const response = await fetch(`${API_BASE}/resize`, {
-            method: 'POST',
-            body: formData
-        });
+        // Prefer a background job with real progress; servers without the
+        // job API (Vercel) get the single blocking request
+        let data = await runResizeJob(formData);
+        if (!data) {
+            progressText.textContent = 'Processing images with your crops...';
+            progressFill.style.width = '30%';
+            data = await requestResize(formData);
+        }
         
-        progressFill.style.width = '70%';
-        progressText.textContent = 'Finalizing...';
+        progressFill.style.width = '100%';
+        progressText.textContent = 'Complete!';
         
-        // Check if response is ok first
-        if (!response.ok) {
-            let errorMessage = 'Processing failed';
-            try {
-                const errorData = await response.json();
-                errorMessage = errorData.error || errorMessage;
-            } catch (e) {
-                // If we can't parse JSON, use status text
-                errorMessage = response.statusText || `Server error: ${response.status}`;
-            }
-            throw new Error(errorMessage);
-        }
+        processedData = data;
+        setTimeout(() => {
+            showResults(data);
+        }, 500);
         
-        // Check if response has content
-        const contentType = response.headers.get('content-type');
-        if (!contentType || !contentType.includes('application/json')) {
-            const text = await response.text();
-            console.error('Non-JSON response:', text);
-            throw new Error(`Unexpected response format: ${text.substring(0, 200)}`);
+    } catch (error) {
+        showError(`Error: ${error.message}`);
+        hideProgress();
+        if (processBtn) processBtn.disabled = false;
+    }
+    });
+}
+
+// Start a background job and poll it until every file is done.
+// Returns null if the server has no job API.
+async function runResizeJob(formData) {
+    if (!jobApiAvailable) {
+        return null;
+    }
+    const response = await fetch(`${API_BASE}/jobs`, {
+        method: 'POST',
+        body: formData
+    });
+    if (response.status === 404 || response.status === 405) {
+        jobApiAvailable = false;
+        return null;
+    }
+    
+    let job;
+    try {
+        job = await response.json();
+    } catch (e) {
+        throw new Error(response.statusText || `Server error: ${response.status}`);
+    }
+    if (!response.ok) {
+        throw new Error(job.error || 'Processing failed');
+    }
+    
+    const rejected = job.error_details || [];
+    rejected.forEach(showPartialResult);
+    const shown = new Set();
+    while (job.status !== 'done') {
+        showJobProgress(job, shown);
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL));
+        const statusResponse = await fetch(`${API_BASE}${job.status_url}`);
+        if (!statusResponse.ok) {
+            throw new Error(`Lost track of the processing job (${statusResponse.status})`);
         }
-        
+        job = await statusResponse.json();
+    }
+    showJobProgress(job, shown);
+    
+    const done = job.files
+        .filter(file => file.status === 'done')
+        .map(file => ({ ...file, download_url: `${API_BASE}${file.download_url}` }));
+    const failed = job.files
+        .filter(file => file.status === 'error')
+        .map(file => ({ filename: file.original_name, error: file.error }));
+    return {
+        success: true,
+        processed: done.length,
+        errors: rejected.length + failed.length,
+        files: done,
+        error_details: rejected.concat(failed),
+        zipUrl: `${API_BASE}${job.zip_url}`
+    };
+}
+
+// Read the NDJSON progress stream from /resize, rendering each file as it
+// arrives; resolves to the final summary event
+async function readResizeEvents(response, total) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    let finished = 0;
+    let summary = null;
+    
+    const handle = line => {
+        if (!line.trim()) {
+            return;
+        }
+        const event = JSON.parse(line);
+        if (event.event === 'done') {
+            summary = event;
+            return;
+        }
+        finished += 1;
+        if (event.event === 'file') {
+            event.download_url = `${API_BASE}${event.download_url}`;
+        }
+        showPartialResult(event);
+        progressFill.style.width = `${Math.max(10, Math.round(finished / Math.max(1, total) * 100))}%`;
+        progressText.textContent = `Processed ${finished} of ${total} image(s)...`;
+    };
+    
+    for (;;) {
+        const { done, value } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffered += decoder.decode(value, { stream: true });
+        const lines = buffered.split('\n');
+        buffered = lines.pop();
+        lines.forEach(handle);
+    }
+    handle(buffered + decoder.decode());
+    
+    if (!summary) {
+        throw new Error('Processing stopped before the batch finished');
+    }
+    summary.files.forEach(file => {
+        file.download_url = `${API_BASE}${file.download_url}`;
+    });
+    if (summary.zip_url) {
+        summary.zipUrl = `${API_BASE}${summary.zip_url}`;
+    }
+    return summary;
+}
+
+function showJobProgress(job, shown) {
+    const finished = job.processed + job.errors;
+    const fraction = job.bytes_total ? job.bytes_done / job.bytes_total : finished / Math.max(1, job.total);
+    progressFill.style.width = `${Math.max(10, Math.round(fraction * 100))}%`;
+    progressText.textContent = `Processed ${finished} of ${job.total} image(s)...`;
+    job.files.forEach((file, index) => {
+        if (shown.has(index) || (file.status !== 'done' && file.status !== 'error')) {
+            return;
+        }
+        shown.add(index);
+        if (file.status === 'done') {
+            showPartialResult({ ...file, download_url: `${API_BASE}${file.download_url}` });
+        } else {
+            showPartialResult({ filename: file.original_name, error: file.error });
+        }
+    });
+}
+
+// The whole batch in one request; resolves once every file is done
+async function requestResize(formData) {
+    // Ask for the ZIP itself instead of base64 inside JSON; servers that
+    // can stream progress (Flask) answer with NDJSON instead
+    formData.append('response', 'zip');
+    const total = formData.getAll('files').length;
+    
+    const response = await fetch(`${API_BASE}/resize`, {
+        method: 'POST',
+        body: formData,
+        headers: { 'Accept': 'application/x-ndjson, application/zip;q=0.9, application/json;q=0.8' }
+    });
+    
+    progressFill.style.width = '70%';
+    progressText.textContent = 'Finalizing...';
+    
+    // Check if response is ok first
+    if (!response.ok) {
+        let errorMessage = 'Processing failed';
+        try {
+            const errorData = await response.json();
+            errorMessage = errorData.error || errorMessage;
+        } catch (e) {
+            // If we can't parse JSON, use status text
+            errorMessage = response.statusText || `Server error: ${response.status}`;
+        }
+        throw new Error(errorMessage);
+    }
+    
+    // Check if response has content
+    const contentType = response.headers.get('content-type');
+    let data;
+    if (contentType && contentType.includes('application/x-ndjson')) {
+        data = await readResizeEvents(response, total);
+    } else if (contentType && contentType.includes('application/zip')) {
+        // Binary mode: per-file details come from the manifest inside the ZIP
+        const zipBlob = await response.blob();
+        const manifest = readStoredZipEntry(await zipBlob.arrayBuffer(), 'manifest.json');
+        if (!manifest) {
+            throw new Error('ZIP response is missing its manifest');
+        }
+        data = JSON.parse(new TextDecoder().decode(manifest));
+        data.zipBlob = zipBlob;
+    } else if (!contentType || !contentType.includes('application/json')) {
+        const text = await response.text();
+        console.error('Non-JSON response:', text);
+        throw new Error(`Unexpected response format: ${text.substring(0, 200)}`);
+    } else {
         // Parse JSON response
         const text = await response.text();
         if (!text || text.trim().length === 0) {
             throw new Error('Empty response from server');
         }
         
-        let data;
         try {
             data = JSON.parse(text);
             // Log debug info if present
@@ -770,26 +1039,69 @@ if (cropFinishBtn) {
             console.error('JSON parse error:', e, 'Response text:', text.substring(0, 500));
             throw new Error(`Invalid JSON response: ${e.message}. Response: ${text.substring(0, 200)}`);
         }
-        
-        progressFill.style.width = '100%';
-        progressText.textContent = 'Complete!';
-        
-        processedData = data;
-        setTimeout(() => {
-            showResults(data);
-        }, 500);
-        
-    } catch (error) {
-        showError(`Error: ${error.message}`);
-        hideProgress();
-        if (processBtn) processBtn.disabled = false;
     }
-    });
+    return data;
+}
+
+// Read an uncompressed (stored) entry from a ZIP archive via its central directory
+function readStoredZipEntry(buffer, name) {
+    const view = new DataView(buffer);
+    // The end of central directory record sits in the last 22 + 65535 bytes
+    let eocd = -1;
+    for (let i = buffer.byteLength - 22; i >= Math.max(0, buffer.byteLength - 22 - 65535); i--) {
+        if (view.getUint32(i, true) === 0x06054b50) {
+            eocd = i;
+            break;
+        }
+    }
+    if (eocd < 0) {
+        throw new Error('Invalid ZIP response');
+    }
+    
+    const decoder = new TextDecoder();
+    const count = view.getUint16(eocd + 10, true);
+    let offset = view.getUint32(eocd + 16, true);
+    for (let n = 0; n < count; n++) {
+        const method = view.getUint16(offset + 10, true);
+        const size = view.getUint32(offset + 20, true);
+        const nameLength = view.getUint16(offset + 28, true);
+        const extraLength = view.getUint16(offset + 30, true);
+        const commentLength = view.getUint16(offset + 32, true);
+        const localOffset = view.getUint32(offset + 42, true);
+        const entryName = decoder.decode(new Uint8Array(buffer, offset + 46, nameLength));
+        if (entryName === name) {
+            if (method !== 0) {
+                throw new Error(`${name} is compressed`);
+            }
+            const localNameLength = view.getUint16(localOffset + 26, true);
+            const localExtraLength = view.getUint16(localOffset + 28, true);
+            return new Uint8Array(buffer, localOffset + 30 + localNameLength + localExtraLength, size);
+        }
+        offset += 46 + nameLength + extraLength + commentLength;
+    }
+    return null;
 }
 
 function showProgress() {
     progressContainer.style.display = 'block';
     progressFill.style.width = '10%';
+    progressFiles.innerHTML = '';
+}
+
+// List a file under the progress bar as soon as it is finished, so it can
+// be downloaded before the rest of the batch is done
+function showPartialResult(file) {
+    const item = document.createElement('li');
+    if (file.error) {
+        item.textContent = `⚠ ${file.filename}: ${file.error}`;
+    } else {
+        const link = document.createElement('a');
+        link.href = file.download_url;
+        link.download = file.processed_name;
+        link.textContent = file.processed_name;
+        item.append('✓ ', link, ` - ${file.size_mb} MB`);
+    }
+    progressFiles.appendChild(item);
 }
 
 function hideProgress() {
@@ -806,8 +1118,11 @@ function showResults(data) {
         html += '<h4 style="margin-top: 20px; margin-bottom: 10px;">Processed Files:</h4>';
         html += '<ul style="list-style: none; padding: 0;">';
         data.files.forEach(file => {
+            const name = file.download_url
+                ? `<a href="${file.download_url}" download="${file.processed_name}">${file.processed_name}</a>`
+                : file.processed_name;
             html += `<li style="padding: 8px; background: #f0f0f0; margin: 5px 0; border-radius: 5px;">
-                ${file.processed_name} - ${file.size_mb} MB
+                ${name} - ${file.size_mb} MB
             </li>`;
         });
         html += '</ul>';
@@ -840,8 +1155,25 @@ if (downloadZipBtn) {
         return;
     }
     
-    // Check if we have zip_data
-    if (processedData.zip_data) {
+    if (processedData.zipUrl) {
+        // Background job: the server streams the finished files as a ZIP
+        const a = document.createElement('a');
+        a.href = processedData.zipUrl;
+        a.download = 'resized_images.zip';
+        document.body.appendChild(a);
+        a.click();
+        document.body.removeChild(a);
+    } else if (processedData.zipBlob) {
+        // Binary mode: the response body is already the ZIP
+        const url = URL.createObjectURL(processedData.zipBlob);
+        const a = document.createElement('a');
+        a.href = url;
+        a.download = 'resized_images.zip';
+        document.body.appendChild(a);
+        a.click();
+        document.body.removeChild(a);
+        URL.revokeObjectURL(url);
+    } else if (processedData.zip_data) {
         try {
             // Convert base64 to blob and download
             const zipBytes = Uint8Array.from(atob(processedData.zip_data), c => c.charCodeAt(0));
@@ -863,7 +1195,7 @@ if (downloadZipBtn) {
         processedData.files.forEach((file, index) => {
             try {
                 const fileBytes = Uint8Array.from(atob(file.data), c => c.charCodeAt(0));
-                const blob = new Blob([fileBytes], { type: 'image/png' });
+                const blob = new Blob([fileBytes], { type: `image/${file.format || 'png'}` });
                 const url = URL.createObjectURL(blob);
                 const a = document.createElement('a');
                 a.href = url;
@@ -892,6 +1224,7 @@ if (resetBtn) {
     resetBtn.addEventListener('click', () => {
         selectedFiles = [];
         cropData = [];
+        suggestedCrops = [];
         processedData = null;
         updateFileList();
         hideActions();
@@ -907,6 +1240,7 @@ if (clearBtn) {
     clearBtn.addEventListener('click', () => {
         selectedFiles = [];
         cropData = [];
+        suggestedCrops = [];
         updateFileList();
         hideActions();
         hideResults();
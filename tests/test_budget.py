@@ -0,0 +1,54 @@
+import io
+import random
+
+from PIL import Image, ImageFilter
+
+from processing.budget import MAX_ENCODE_ATTEMPTS, fit_to_budget
+from processing.encode import DEFAULT_STRATEGY
+
+
+def noise(size=(600, 600)):
+    rng = random.Random(0)
+    image = Image.frombytes('RGB', size, rng.randbytes(size[0] * size[1] * 3))
+    return image.filter(ImageFilter.GaussianBlur(2))
+
+
+def misleading_encode(image, strategy):
+    """
+    One byte per channel and pixel. The final strategy shrinks the small
+    strip sample used to estimate the trial-to-final ratio but grows
+    anything taller, so every estimate is too optimistic.
+    """
+    size = image.width * image.height * len(image.getbands())
+    if strategy == DEFAULT_STRATEGY:
+        size = int(size * (0.9 if image.height <= 128 else 1.1))
+    return io.BytesIO(bytes(size))
+
+
+def test_final_encode_that_misses_is_not_returned():
+    output, report = fit_to_budget(noise(), 200000, encode=misleading_encode, predictor=None)
+    assert report['fits']
+    assert report['size'] == len(output.getvalue()) <= 200000
+    assert report['attempts'] <= MAX_ENCODE_ATTEMPTS
+    # A 256-colour palette fits from 0.71 down
+    assert report['colors'] == 256
+    assert 0.6 < report['scale'] <= 0.71
+
+
+def test_attempt_cap_counts_final_encodes():
+    for max_size in (50000, 100000, 200000, 300000):
+        for max_attempts in (3, 5, MAX_ENCODE_ATTEMPTS):
+            _, report = fit_to_budget(noise(), max_size, max_attempts=max_attempts,
+                                      encode=misleading_encode, predictor=None)
+            assert report['attempts'] <= max_attempts
+
+
+def test_output_grows_with_the_budget():
+    image = noise()
+    sizes = []
+    for max_size in range(150000, 400001, 50000):
+        output, report = fit_to_budget(image, max_size)
+        assert report['attempts'] <= MAX_ENCODE_ATTEMPTS
+        assert len(output.getvalue()) <= max_size
+        sizes.append(len(output.getvalue()))
+    assert sizes == sorted(sizes)
@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from processing.cache import ResultCache
+
+
+def fill(cache, key, nbytes):
+    cache.put(key, bytes(nbytes), {'size': nbytes})
+    cache.record(False, nbytes)
+
+
+def test_entries_use_a_neutral_suffix(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    fill(cache, 'a' * 64, 10)
+    assert cache.path('a' * 64) == str(tmp_path / ('a' * 64 + '.bin'))
+    assert sorted(os.listdir(tmp_path)) == ['a' * 64 + '.bin', 'a' * 64 + '.json']
+    assert cache.get('a' * 64) == (bytes(10), {'size': 10})
+
+
+def test_stats_keep_running_totals(tmp_path, monkeypatch):
+    fill(ResultCache(str(tmp_path)), 'a' * 64, 10)
+    cache = ResultCache(str(tmp_path))
+    assert cache.stats() == {'hits': 0, 'misses': 0, 'entries': 1, 'bytes': 10}
+
+    def scan():
+        pytest.fail('stats() scanned the cache directory')
+
+    monkeypatch.setattr(cache, '_entries', scan)
+    cache.record(True)
+    fill(cache, 'b' * 64, 20)
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'entries': 2, 'bytes': 30}
+
+
+def test_eviction_resyncs_the_totals(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=25)
+    for index, key in enumerate(('a' * 64, 'b' * 64, 'c' * 64)):
+        fill(cache, key, 10)
+        os.utime(cache.path(key), (index, index))
+    assert cache.get('a' * 64) is None
+    assert cache.stats()['entries'] == 2 and cache.stats()['bytes'] == 20
@@ -0,0 +1,144 @@
+import io
+import os
+import random
+import threading
+
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+import app as flask_app
+from processing import jobs
+from processing.cache import ResultCache
+from processing.governor import Busy, MemoryGovernor, working_set
+from processing.ingest import SPOOL_THRESHOLD, ingest
+
+MALFORMED_CROPS = ['{"x": "a"}', '[1, 2]', '{"x": 0, "y": 0, "width": "10", "height": null}']
+
+
+def large_png():
+    """A PNG past the spool threshold, so ingest writes it to disk."""
+    rng = random.Random(0)
+    image = Image.frombytes('RGB', (500, 400), rng.randbytes(500 * 400 * 3))
+    output = io.BytesIO()
+    image.save(output, 'PNG')
+    assert output.tell() > SPOOL_THRESHOLD
+    return output.getvalue()
+
+
+@pytest.fixture
+def spool(monkeypatch, tmp_path):
+    """The upload spool directory, empty and private to the test."""
+    directory = tmp_path / 'uploads'
+    directory.mkdir()
+    monkeypatch.setattr(flask_app, 'UPLOAD_FOLDER', str(directory))
+    monkeypatch.setattr(flask_app, 'RESULT_CACHE', ResultCache(str(tmp_path / 'cache')))
+    return directory
+
+
+@pytest.fixture
+def governor(monkeypatch):
+    """A 1 MB governor for the app that turns requests away after 50 ms."""
+    governor = MemoryGovernor(1024 * 1024)
+    monkeypatch.setattr(flask_app, 'GOVERNOR', governor)
+    monkeypatch.setattr(flask_app, 'ADMISSION_WAIT', 0.05)
+    return governor
+
+
+def resize(data, **fields):
+    client = flask_app.app.test_client()
+    form = dict(fields, files=[(io.BytesIO(data), 'photo.png')], sizes='64')
+    return client.post('/resize', data=form, content_type='multipart/form-data')
+
+
+def test_admission_and_release():
+    governor = MemoryGovernor(100)
+    first = governor.reserve(60)
+    assert governor.stats() == {'budget': 100, 'reserved': 60, 'waiting': 0}
+    with pytest.raises(Busy):
+        governor.reserve(60, timeout=0.01)
+
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(governor.reserve(60, timeout=5)))
+    waiter.start()
+    first.release()
+    waiter.join()
+    assert admitted and governor.reserved == 60
+
+    # Releasing twice gives the bytes back once
+    admitted[0].release()
+    admitted[0].release()
+    assert governor.reserved == 0
+
+
+def test_oversized_reservation_is_capped_to_the_budget():
+    governor = MemoryGovernor(100)
+    reservation = governor.reserve(1000)
+    assert governor.reserved == 100
+    reservation.release()
+    assert governor.reserved == 0
+
+
+@pytest.mark.parametrize('route', ['/resize', '/optimize', '/autocrop'])
+def test_busy_server_answers_503(spool, governor, route):
+    held = governor.reserve(governor.budget)
+    response = flask_app.app.test_client().post(
+        route,
+        data={'files': [(io.BytesIO(large_png()), 'photo.png')], 'sizes': '64'},
+        content_type='multipart/form-data',
+    )
+    held.release()
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+    assert 'busy' in response.get_json()['error']
+    assert os.listdir(spool) == []
+
+
+@pytest.mark.parametrize('route, fields', [('/resize', {'response': 'ndjson'}), ('/optimize', {'response': 'zip'})])
+def test_reservation_held_until_streamed_response_closes(spool, governor, route, fields):
+    response = flask_app.app.test_client().post(
+        route,
+        data=dict(fields, files=[(io.BytesIO(large_png()), 'photo.png')], sizes='64', max_size='20000'),
+        content_type='multipart/form-data',
+        buffered=False,
+    )
+    assert response.status_code == 200
+    assert governor.reserved > 0
+    assert response.get_data()
+    response.close()
+    assert governor.reserved == 0
+    assert os.listdir(spool) == []
+
+
+@pytest.mark.parametrize('crop', MALFORMED_CROPS)
+def test_malformed_crop_fails_its_file(spool, governor, crop):
+    response = resize(large_png(), crop_0=crop)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['processed'] == 0
+    assert body['error_details'][0]['filename'] == 'photo.png'
+    assert os.listdir(spool) == []
+    assert governor.reserved == 0
+
+
+@pytest.mark.parametrize('crop', [{'x': 'a'}, [1, 2], {'x': 0, 'y': 0, 'width': '10', 'height': None}])
+def test_working_set_tolerates_malformed_crops(spool, crop):
+    upload = ingest(FileStorage(io.BytesIO(large_png()), 'photo.png'), str(spool))
+    try:
+        assert working_set([upload], [(64, 64)], 10 ** 6, [crop]) > 0
+    finally:
+        upload.discard()
+
+
+def test_job_whose_reservation_fails_is_finished(spool, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError('no estimate')
+
+    monkeypatch.setattr(jobs, 'working_set', fail)
+    upload = ingest(FileStorage(io.BytesIO(large_png()), 'photo.png'), str(spool))
+    job = jobs.Job([upload], [None], 'png', None, [(64, 64)])
+    with pytest.raises(RuntimeError):
+        job.run()
+    assert job.to_dict()['status'] == 'done'
+    assert [entry['error'] for entry in job.to_dict()['files']] == ['Job stopped']
+    assert os.listdir(spool) == []
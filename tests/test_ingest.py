@@ -0,0 +1,17 @@
+import io
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from processing.ingest import SPOOL_THRESHOLD, IngestError, ingest
+
+SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+@pytest.mark.parametrize('length', [64, SPOOL_THRESHOLD + 64])
+def test_unreadable_image_is_rejected_without_internals(tmp_path, length):
+    data = SIGNATURE + bytes(length)
+    with pytest.raises(IngestError) as error:
+        ingest(FileStorage(io.BytesIO(data), 'photo.png'), str(tmp_path))
+    assert str(error.value) == 'File is not a readable image'
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,101 @@
+import io
+import json
+import os
+import time
+import zipfile
+
+import pytest
+from PIL import Image
+
+import app as flask_app
+from processing.cache import ResultCache
+from processing.jobs import LocalJobQueue
+
+
+def encoded(size, image_format='PNG'):
+    output = io.BytesIO()
+    Image.linear_gradient('L').resize(size).convert('RGB').save(output, image_format)
+    return output.getvalue()
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(flask_app, 'RESULT_CACHE', ResultCache(str(tmp_path / 'cache')))
+    monkeypatch.setattr(flask_app, 'JOB_QUEUE', LocalJobQueue())
+    return flask_app.app.test_client()
+
+
+def submit(client, uploads, **fields):
+    form = dict(fields, files=[(io.BytesIO(data), filename) for filename, data in uploads])
+    response = client.post('/jobs', data=form, content_type='multipart/form-data')
+    assert response.status_code == 202
+    return response.get_json()
+
+
+def poll(client, status_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        body = client.get(status_url).get_json()
+        if body['status'] == 'done':
+            return body
+        time.sleep(0.05)
+    pytest.fail(f'{status_url} did not finish')
+
+
+def test_job_lifecycle(client):
+    png = encoded((320, 200))
+    uploads = [('photo.png', png), ('truncated.png', png[:len(png) // 2]), ('notes.txt', b'not an image')]
+    created = submit(client, uploads, sizes='64,32x48')
+    # The upload that fails ingest is reported at once and never queued
+    assert [error['filename'] for error in created['error_details']] == ['notes.txt']
+    assert created['status'] in ('queued', 'running', 'done')
+    assert created['total'] == 4
+
+    body = poll(client, created['status_url'])
+    assert (body['processed'], body['errors'], body['bytes_done']) == (2, 2, body['bytes_total'])
+    done = [file for file in body['files'] if file['status'] == 'done']
+    failed = [file for file in body['files'] if file['status'] == 'error']
+    assert [file['processed_name'] for file in done] == ['photo_64x64.png', 'photo_32x48.png']
+    assert {file['original_name'] for file in failed} == {'truncated.png'}
+    assert all(file['error'] for file in failed)
+    assert all('cache_key' not in file for file in body['files'])
+
+    outputs = {}
+    for file in done:
+        response = client.get(file['download_url'])
+        assert response.status_code == 200
+        outputs[file['processed_name']] = response.data
+        assert Image.open(io.BytesIO(response.data)).size == tuple(map(int, file['target_size'].split('x')))
+    assert client.get(f"/jobs/{created['job_id']}/files/truncated_64x64.png").status_code == 404
+
+    response = client.get(body['zip_url'])
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        manifest = json.loads(archive.read('manifest.json'))
+        assert {name: archive.read(name) for name in archive.namelist() if name != 'manifest.json'} == outputs
+    assert manifest['job_id'] == created['job_id']
+    assert manifest['processed'] == 2
+
+
+def test_evicted_result_is_gone(client):
+    created = submit(client, [('photo.png', encoded((100, 100)))], sizes='64')
+    body = poll(client, created['status_url'])
+    directory = flask_app.RESULT_CACHE.directory
+    for name in os.listdir(directory):
+        os.remove(os.path.join(directory, name))
+    assert client.get(body['files'][0]['download_url']).status_code == 410
+
+
+def test_finished_jobs_expire(client, monkeypatch):
+    monkeypatch.setattr(flask_app, 'JOB_QUEUE', LocalJobQueue(ttl=0.2))
+    created = submit(client, [('photo.png', encoded((100, 100)))], sizes='64')
+    poll(client, created['status_url'])
+    time.sleep(0.3)
+    for url in (created['status_url'], created['zip_url'], f"/jobs/{created['job_id']}/files/photo_64x64.png"):
+        response = client.get(url)
+        assert response.status_code == 404
+        assert response.get_json()['error'] == 'Job not found'
+
+
+def test_unknown_job(client):
+    assert client.get('/jobs/0123').status_code == 404
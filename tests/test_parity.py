@@ -0,0 +1,161 @@
+"""
+The same uploads through every entry point: processing.pipeline directly,
+the Flask routes and the Vercel handlers, which must agree byte for byte.
+"""
+import base64
+import importlib.util
+import io
+import json
+import os
+import random
+import sys
+import types
+import zipfile
+
+import pytest
+from PIL import Image, ImageFilter
+from werkzeug.test import EnvironBuilder
+
+import app as flask_app
+from processing.cache import ResultCache
+from processing.pipeline import optimized_name, output_name, process_optimize_file, process_renditions_file
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TARGET = (270, 270)
+MAX_SIZE = 40000
+
+
+def encoded(image, image_format='PNG'):
+    output = io.BytesIO()
+    image.save(output, image_format)
+    return output.getvalue()
+
+
+def corpus():
+    """(filename, bytes) uploads covering the common modes and the usual rejections."""
+    rng = random.Random(0)
+    photo = Image.frombytes('RGB', (480, 320), rng.randbytes(480 * 320 * 3)).filter(ImageFilter.GaussianBlur(2))
+    alpha = photo.convert('RGBA')
+    alpha.putalpha(Image.linear_gradient('L').resize(photo.size))
+    png = encoded(photo)
+    return [
+        ('photo.png', png),
+        ('alpha.png', encoded(alpha)),
+        ('grey.jpg', encoded(photo.convert('L'), 'JPEG')),
+        ('palette.gif', encoded(photo.quantize(64), 'GIF')),
+        ('notes.txt', b'not an image'),
+        ('fake.png', b'not an image'),
+        ('truncated.png', png[:len(png) // 2]),
+    ]
+
+
+class VercelResponse:
+    def __init__(self, body, status=200, headers=None):
+        self.body = body
+        self.status = status
+        self.headers = headers or {}
+
+
+@pytest.fixture
+def handlers(monkeypatch, tmp_path):
+    """The api/ handlers by name, with the vercel module stubbed and their caches in tmp_path."""
+    monkeypatch.setitem(sys.modules, 'vercel', types.SimpleNamespace(Response=VercelResponse))
+    loaded = {}
+    for name in ('resize', 'optimize'):
+        spec = importlib.util.spec_from_file_location(f'api_{name}', os.path.join(ROOT, 'api', f'{name}.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        monkeypatch.setattr(module, 'RESULT_CACHE', ResultCache(str(tmp_path / f'api_{name}')))
+        loaded[name] = module.handler
+    return loaded
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(flask_app, 'RESULT_CACHE', ResultCache(str(tmp_path / 'flask')))
+    return flask_app.app.test_client()
+
+
+def form(uploads, **fields):
+    return dict(fields, files=[(io.BytesIO(data), filename) for filename, data in uploads])
+
+
+def call_flask(client, route, data):
+    response = client.post(route, data=data, content_type='multipart/form-data')
+    return response.status_code, response.get_json()
+
+
+def call_vercel(handler, data):
+    """Send data as the raw multipart body a Vercel request carries."""
+    environ = EnvironBuilder(method='POST', data=data).get_environ()
+    request = types.SimpleNamespace(
+        method='POST',
+        headers={'content-type': environ['CONTENT_TYPE']},
+        body=environ['wsgi.input'].read(),
+    )
+    response = handler(request)
+    return response.status, json.loads(response.body)
+
+
+def outputs(body):
+    """name -> bytes of every output in a JSON response, read from its ZIP."""
+    if not body['zip_data']:
+        return {}
+    with zipfile.ZipFile(io.BytesIO(base64.b64decode(body['zip_data']))) as archive:
+        return {name: archive.read(name) for name in archive.namelist()}
+
+
+def test_resize_parity(client, handlers):
+    uploads = corpus()
+    fields = {'sizes': f'{TARGET[0]}x{TARGET[1]}', 'max_size': str(MAX_SIZE)}
+
+    status, flask_body = call_flask(client, '/resize', form(uploads, **fields))
+    assert status == 200
+    vercel_status, vercel_body = call_vercel(handlers['resize'], form(uploads, **fields))
+    assert vercel_status == 200
+
+    expected = {}
+    for filename, data in uploads[:4]:
+        (output,), _ = process_renditions_file(data, None, [TARGET], MAX_SIZE)
+        expected[output_name(filename, TARGET, 'png')] = output
+    assert outputs(flask_body) == expected
+    assert outputs(vercel_body) == expected
+    assert {file['processed_name']: base64.b64decode(file['data']) for file in vercel_body['files']} == expected
+
+    assert [error['filename'] for error in flask_body['error_details']] == ['notes.txt', 'fake.png', 'truncated.png']
+    assert vercel_body['error_details'] == flask_body['error_details']
+
+
+def test_optimize_parity(client, handlers):
+    uploads = corpus()
+    fields = {'max_size': str(MAX_SIZE)}
+
+    status, flask_body = call_flask(client, '/optimize', form(uploads, **fields))
+    assert status == 200
+    vercel_status, vercel_body = call_vercel(handlers['optimize'], form(uploads, **fields))
+    assert vercel_status == 200
+
+    expected = {}
+    for filename, data in uploads[:4]:
+        output, _ = process_optimize_file(data, MAX_SIZE)
+        expected[optimized_name(filename, 'png')] = output
+    for body in (flask_body, vercel_body):
+        assert outputs(body) == expected
+        assert {file['processed_name']: base64.b64decode(file['data']) for file in body['files']} == expected
+
+    assert [error['filename'] for error in flask_body['error_details']] == ['notes.txt', 'fake.png', 'truncated.png']
+    assert vercel_body['error_details'] == flask_body['error_details']
+
+
+@pytest.mark.parametrize('route', ['resize', 'optimize'])
+@pytest.mark.parametrize('uploads, fields', [
+    (corpus()[:1], {'format': 'bmp'}),
+    (corpus()[:1], {'max_size': 'inf'}),
+    (corpus()[:1], {'max_size': '-5'}),
+    ([('', b'')], {}),
+])
+def test_request_errors_match(client, handlers, route, uploads, fields):
+    flask_status, flask_body = call_flask(client, f'/{route}', form(uploads, **fields))
+    vercel_status, vercel_body = call_vercel(handlers[route], form(uploads, **fields))
+    assert flask_status == vercel_status == 400
+    assert vercel_body == flask_body
@@ -0,0 +1,72 @@
+import io
+
+import pytest
+
+import app as flask_app
+from processing.pipeline import MAX_SIZE, TARGET_SIZE
+from processing.presets import (MAX_BUDGET, MAX_RENDITIONS, MIN_BUDGET, parse_size, requested_max_size,
+                                requested_sizes)
+
+
+def test_default_size():
+    assert requested_sizes({}) == [TARGET_SIZE]
+
+
+def test_presets_then_sizes_without_duplicates():
+    form = {'preset': 'story, Thumbnail', 'sizes': '150,1080x1350,1080x1920'}
+    assert requested_sizes(form) == [(1080, 1920), (150, 150), (1080, 1350)]
+
+
+def test_unknown_preset():
+    with pytest.raises(ValueError, match="Unknown preset 'poster'"):
+        requested_sizes({'preset': 'square,poster'})
+
+
+@pytest.mark.parametrize('text, size', [('1080', (1080, 1080)), (' 1200X628 ', (1200, 628)), ('16x4096', (16, 4096))])
+def test_parse_size(text, size):
+    assert parse_size(text) == size
+
+
+@pytest.mark.parametrize('text', ['wide', '10x10x10', '1080x', '1.5x2'])
+def test_invalid_size(text):
+    with pytest.raises(ValueError, match='Invalid size'):
+        parse_size(text)
+
+
+@pytest.mark.parametrize('text', ['15', '4097x100', '100x0'])
+def test_size_out_of_range(text):
+    with pytest.raises(ValueError, match='out of range'):
+        parse_size(text)
+
+
+def test_too_many_sizes():
+    sizes = ','.join(str(100 + index) for index in range(MAX_RENDITIONS + 1))
+    with pytest.raises(ValueError, match=f'At most {MAX_RENDITIONS}'):
+        requested_sizes({'sizes': sizes})
+
+
+@pytest.mark.parametrize('value, budget', [(None, MAX_SIZE), ('', MAX_SIZE), ('200000', 200000), ('2e5', 200000),
+                                           (str(MIN_BUDGET), MIN_BUDGET), (str(MAX_BUDGET), MAX_BUDGET)])
+def test_max_size(value, budget):
+    assert requested_max_size({'max_size': value}) == budget
+
+
+@pytest.mark.parametrize('value', ['big', 'inf', '-inf', '1e400', 'nan'])
+def test_invalid_max_size(value):
+    with pytest.raises(ValueError, match='Invalid max_size'):
+        requested_max_size({'max_size': value})
+
+
+@pytest.mark.parametrize('value', ['-5', str(MIN_BUDGET - 1), str(MAX_BUDGET + 1)])
+def test_max_size_out_of_range(value):
+    with pytest.raises(ValueError, match='max_size must be between'):
+        requested_max_size({'max_size': value})
+
+
+@pytest.mark.parametrize('route', ['/resize', '/jobs'])
+@pytest.mark.parametrize('fields', [{'max_size': 'inf'}, {'max_size': '1e400'}, {'sizes': '8'}, {'preset': 'poster'}])
+def test_invalid_requests_answer_400(route, fields):
+    form = dict(fields, files=[(io.BytesIO(b'\x89PNG\r\n\x1a\n'), 'photo.png')])
+    response = flask_app.app.test_client().post(route, data=form, content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert response.get_json()['error']
@@ -0,0 +1,42 @@
+import io
+import random
+
+from PIL import Image, ImageDraw
+
+from processing.pipeline import process_resize_file
+from processing.quantize import Quantizer
+
+
+def striped(colors, size=(200, 200)):
+    """An RGB image using exactly colors distinct colours."""
+    rng = random.Random(0)
+    image = Image.new('RGB', size)
+    draw = ImageDraw.Draw(image)
+    stripe = size[0] / colors
+    for index in range(colors):
+        fill = tuple(rng.randrange(256) for _ in range(3))
+        draw.rectangle((round(index * stripe), 0, round((index + 1) * stripe) - 1, size[1]), fill=fill)
+    return image
+
+
+def test_short_palette_derives_smaller_palettes():
+    quantizer = Quantizer(striped(100))
+    assert len(quantizer.base.getpalette()) < 768
+    for colors in (64, 32):
+        quantized = quantizer.quantize(colors)
+        assert quantized.mode == 'P'
+        assert len(quantized.getcolors(256)) <= colors
+
+
+def test_la_upload_under_tight_budget():
+    # Grey noise with 100 levels at the target size: flattening keeps it
+    # under 256 colours, and the budget forces the palette fallback
+    rng = random.Random(0)
+    grey = Image.frombytes('L', (1080, 1080), bytes(rng.randrange(100) * 2 for _ in range(1080 * 1080)))
+    image = Image.merge('LA', (grey, Image.new('L', grey.size, 255)))
+    upload = io.BytesIO()
+    image.save(upload, 'PNG')
+
+    output, report = process_resize_file(upload.getvalue(), None, max_size=20000)
+    assert report['colors'] is not None
+    assert len(output) == report['size']
@@ -0,0 +1,84 @@
+import io
+import random
+
+import numpy as np
+import pytest
+from PIL import Image, ImageFilter
+
+from processing.pipeline import resize_renditions
+from processing.stages import BACKGROUND, flatten, plan_crop
+
+TARGET = (270, 270)
+
+
+def photo(mode, size=(640, 400)):
+    """Smooth noise converted to mode, so resampling has something to do."""
+    rng = random.Random(0)
+    image = Image.frombytes('RGB', size, rng.randbytes(size[0] * size[1] * 3)).filter(ImageFilter.GaussianBlur(3))
+    if mode == 'P':
+        return image.quantize(256)
+    return image.convert(mode)
+
+
+def with_alpha(mode, size=(640, 400)):
+    """photo() with an alpha gradient from opaque on the left to transparent on the right."""
+    image = photo('RGB' if mode == 'RGBA' else 'L', size)
+    ramp = np.linspace(255, 0, size[0]).round().astype(np.uint8)
+    alpha = Image.fromarray(np.tile(ramp, (size[1], 1)), 'L')
+    image.putalpha(alpha)
+    return image
+
+
+def baseline(image, target_size):
+    """The original resize_and_compress before encoding: convert the full frame, then crop and resize."""
+    if image.mode == 'P':
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        image = image.convert('RGBA')
+        background.paste(image, mask=image.split()[-1])
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+    image = image.crop(plan_crop(image.size, target_size))
+    return image.resize(target_size, Image.Resampling.LANCZOS)
+
+
+def staged(image, target_size):
+    output, = resize_renditions(image, [target_size], max_size=1 << 30)
+    return Image.open(io.BytesIO(output.getvalue())).convert('RGB')
+
+
+def composited(image):
+    """image over BACKGROUND, blended in floating point."""
+    pixels = np.asarray(image.convert('RGBA'), dtype=np.float64)
+    alpha = pixels[..., 3:] / 255
+    blended = pixels[..., :3] * alpha + np.array(BACKGROUND) * (1 - alpha)
+    return Image.fromarray(blended.round().astype(np.uint8), 'RGB')
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'L', 'CMYK', 'P'])
+def test_opaque_inputs_match_the_baseline(mode):
+    image = photo(mode)
+    assert staged(image, TARGET).tobytes() == baseline(image, TARGET).tobytes()
+
+
+@pytest.mark.parametrize('mode', ['RGBA', 'LA'])
+def test_alpha_inputs_are_composited_after_resampling(mode):
+    image = with_alpha(mode)
+    expected = np.asarray(baseline(composited(image), TARGET), dtype=np.int16)
+    actual = np.asarray(staged(image, TARGET), dtype=np.int16)
+    # Resampling before compositing only changes rounding
+    difference = np.abs(actual - expected)
+    assert difference.max() <= 3
+    assert difference.mean() < 0.25
+
+
+@pytest.mark.parametrize('mode', ['RGBA', 'LA'])
+def test_flatten_blends_onto_the_background(mode):
+    image = with_alpha(mode, (64, 8))
+    flattened = flatten(image)
+    assert flattened.mode == 'RGB'
+    expected = np.asarray(composited(image), dtype=np.int16)
+    assert np.abs(np.asarray(flattened, dtype=np.int16) - expected).max() <= 1
+    # Fully transparent pixels are the background, opaque ones unchanged
+    assert flattened.getpixel((63, 0)) == BACKGROUND
+    assert flattened.getpixel((0, 0)) == image.convert('RGB').getpixel((0, 0))